@@ -0,0 +1,336 @@
+# 效能測試：產生與 Tokenlon Subgraph、CoinGecko、Uniswap V3 相同格式的模擬資料，分別計算每個處理階段的耗時
+# 結果寫成 JSON，比較不同版本的 utils.py 時即可看出哪個階段變慢
+# python3 ./analysis/bench.py --rows 10000 100000 1000000
+
+# 使用不需要視窗的繪圖後端，必須在 import pyplot（utils）之前設定
+import matplotlib
+matplotlib.use('Agg')
+
+import argparse
+import binascii
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import candles
+import cube
+import ids
+import lod
+import pairs
+import reference
+import stats
+import timerange
+import utils
+from datetime import datetime
+
+# 結果輸出的資料夾
+BENCH_PATH = './data/bench'
+
+# 模擬資料的起始時間（與 data/ 底下的資料同一段期間）
+START_TIMESTAMP = 1671091200
+
+# 交易對的比例（MakerToken, TakerToken, 權重），參考 data/tokenlon_subgraph.csv 中各交易對的筆數
+# OTHER 為不在註冊表中的 Token
+OTHER = '0x3212b29e33587a00fb1c83346f5dbfa69a458923'
+PAIR_MIX = [
+    ('USDT', 'WETH', 4252),
+    ('USDT', 'USDC', 1663),
+    ('NATIVE', 'USDT', 1437),
+    ('USDT', 'NATIVE', 1121),
+    ('WETH', 'USDT', 1066),
+    ('DAI', 'USDC', 955),
+    ('WBTC', OTHER, 415),
+    ('USDT', 'WBTC', 351),
+    ('USDC', 'USDT', 283),
+    ('DAI', 'WETH', 207),
+    ('WBTC', 'USDT', 200),
+    ('NATIVE', 'USDC', 139),
+    ('DAI', 'NATIVE', 115),
+    ('USDT', 'DAI', 90),
+]
+
+# Method 的比例
+METHOD_MIX = [('pmmOrRfq', 6670), ('amm', 6450), ('ByProtocol', 38), ('ByTrader', 5)]
+
+# 模擬價格的起始值（USD）及每小時的波動率
+START_PRICES = {'ETH': 1300.0, 'WBTC': 17000.0}
+HOURLY_VOLATILITY = 0.005
+
+# 副程式：將代號轉為地址（NATIVE 為原生 ETH 的 0x000…000）
+def token_address(symbol):
+    if symbol == 'NATIVE':
+        return pairs.TOKENS['ETH']['addresses'][1]
+    if symbol == 'WETH':
+        return pairs.TOKENS['ETH']['addresses'][0]
+    if symbol in pairs.TOKENS:
+        return pairs.TOKENS[symbol]['addresses'][0]
+    return symbol
+
+# 副程式：代號的小數點位數（不在註冊表中的 Token 為 18）
+def token_decimals(symbol):
+    if symbol == 'NATIVE' or symbol == 'WETH':
+        return 18
+    return pairs.TOKENS[symbol]['decimals'] if symbol in pairs.TOKENS else 18
+
+# 副程式：產生 n 個 32 bytes 的隨機 hash（0x 開頭的 16 進位字串）
+def random_hashes(rng, n):
+    hex_bytes = binascii.hexlify(rng.bytes(n * 32))
+    return pd.Series(np.frombuffer(hex_bytes, dtype='S64').astype(str)).radd('0x')
+
+# 副程式：產生以 GBM 模擬的每小時價格，回傳 {代號: (每小時的 Timestamp, 價格)}
+def simulate_prices(rng, days):
+    hours = np.arange(days * 24 + 1)
+    timestamps = START_TIMESTAMP + hours * 3600
+    prices = {}
+    for symbol, start_price in START_PRICES.items():
+        returns = rng.normal(0, HOURLY_VOLATILITY, len(hours))
+        prices[symbol] = start_price * np.exp(np.cumsum(returns))
+    return timestamps, prices
+
+# 副程式：以每小時價格內插出任意時間的價格（穩定幣及不在註冊表中的 Token 為 1）
+def price_at(symbol, timestamps, hourly_timestamps, hourly_prices):
+    symbol = 'ETH' if symbol in ('NATIVE', 'WETH') else symbol
+    if symbol not in hourly_prices:
+        return np.ones(len(timestamps))
+    return np.interp(timestamps, hourly_timestamps, hourly_prices[symbol])
+
+# 副程式：將 Token 數量轉為整數字串（乘上 10 ** decimals），以 6 位小數的 int64 再補 0，避免超過 int64 的範圍
+def amount_strings(amounts, decimals):
+    micro_units = np.maximum(np.round(amounts * 1e6), 1).astype('int64')
+    return pd.Series(micro_units).astype(str) + '0' * (decimals - 6)
+
+# 副程式：產生 rows 筆 Tokenlon Subgraph 格式的交易，平均分布在 days 天內，依 Timestamp 遞增排序
+def generate_tokenlon(rows, days, rng, hourly_timestamps, hourly_prices):
+    timestamps = np.sort(rng.integers(START_TIMESTAMP, START_TIMESTAMP + days * 86400, rows))
+    weights = np.array([weight for maker, taker, weight in PAIR_MIX], dtype='float64')
+    pair_choice = rng.choice(len(PAIR_MIX), rows, p=weights / weights.sum())
+    # 每筆交易的 USD 價值為對數常態分布（中位數約 3000 USD）
+    usd_values = rng.lognormal(np.log(3000), 1.2, rows)
+    maker_tokens = np.empty(rows, dtype=object)
+    taker_tokens = np.empty(rows, dtype=object)
+    maker_amounts = pd.Series(index=range(rows), dtype=object)
+    taker_amounts = pd.Series(index=range(rows), dtype=object)
+    for choice, (maker, taker, weight) in enumerate(PAIR_MIX):
+        mask = pair_choice == choice
+        if not mask.any():
+            continue
+        maker_tokens[mask] = token_address(maker)
+        taker_tokens[mask] = token_address(taker)
+        # Maker 比市價少給 0.1%（價差）
+        maker_amount = usd_values[mask] / price_at(maker, timestamps[mask], hourly_timestamps, hourly_prices) * 0.999
+        taker_amount = usd_values[mask] / price_at(taker, timestamps[mask], hourly_timestamps, hourly_prices)
+        maker_amounts[mask] = amount_strings(maker_amount, token_decimals(maker)).to_numpy()
+        taker_amounts[mask] = amount_strings(taker_amount, token_decimals(taker)).to_numpy()
+    methods, method_weights = zip(*METHOD_MIX)
+    method_weights = np.array(method_weights, dtype='float64')
+    log_indices = pd.Series(rng.integers(0, 400, rows)).astype(str)
+    return pd.DataFrame({
+        'Id': random_hashes(rng, rows) + '-' + random_hashes(rng, rows) + '-' + log_indices,
+        # 約 12 秒一個區塊
+        'BlockNumber': 16200000 + (timestamps - START_TIMESTAMP) // 12,
+        'Timestamp': timestamps,
+        'MakerToken': maker_tokens,
+        'MakerAmount': maker_amounts.to_numpy(),
+        'TakerToken': taker_tokens,
+        'TakerAmount': taker_amounts.to_numpy(),
+        'Method': np.asarray(methods)[rng.choice(len(methods), rows, p=method_weights / method_weights.sum())],
+    })
+
+# 副程式：CoinGecko 格式的每小時價格（Timestamp 為毫秒）
+def generate_coingecko(symbol, hourly_timestamps, hourly_prices):
+    return pd.DataFrame({'Timestamp': hourly_timestamps * 1000, 'Price': hourly_prices[symbol]})
+
+# 副程式：Uniswap V3 poolHourDatas 格式的每小時 OHLC
+def generate_uniswap3(rng, hourly_timestamps, hourly_prices):
+    close = hourly_prices['ETH']
+    open_price = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, HOURLY_VOLATILITY / 2, len(close))) * close
+    return pd.DataFrame({
+        'Id': token_address('WETH'),
+        'Timestamp': hourly_timestamps,
+        'Open': open_price,
+        'High': np.maximum(open_price, close) + spread,
+        'Low': np.minimum(open_price, close) - spread,
+        'Close': close,
+        'Price': close,
+    })
+
+# 副程式：產生 tokenlon_transaction_index 格式的資料（Index 的分布與實際資料相近，平均約 28）
+def generate_tx_index(tokenlon, rng):
+    return tokenlon[['Id', 'BlockNumber', 'Timestamp']].assign(Index=np.floor(rng.gamma(1.3, 22, len(tokenlon))).astype('int64'))
+
+# 記錄每個階段耗時的計時器，同一個階段執行多次時保留最快的一次
+class StageTimer:
+    def __init__(self):
+        self.results = {}
+
+    def run(self, stage, function, repeat=1):
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.results[stage] = best
+        print(f'  {stage}：{best:.4f} 秒')
+        return result
+
+# 副程式：以 rows 筆模擬資料執行一次完整流程，回傳 {階段: 秒數}
+def run_benchmark(rows, days=90, seed=0, repeat=1):
+    rng = np.random.default_rng(seed)
+    hourly_timestamps, hourly_prices = simulate_prices(rng, days)
+    print(f'產生 {rows} 筆模擬資料')
+    tokenlon = generate_tokenlon(rows, days, rng, hourly_timestamps, hourly_prices)
+    coingecko = {coin: generate_coingecko(symbol, hourly_timestamps, hourly_prices) for coin, symbol in (('ethereum', 'ETH'), ('bitcoin', 'WBTC'))}
+    uniswap3 = generate_uniswap3(rng, hourly_timestamps, hourly_prices)
+    tx_index = generate_tx_index(tokenlon, rng)
+
+    timer = StageTimer()
+    data_path = tempfile.mkdtemp(prefix='tokenlon-bench-')
+    try:
+        tokenlon_path = os.path.join(data_path, 'tokenlon_subgraph.csv')
+        # CoinGecko 的檔名需與 reference.SOURCES 相同，寫入 Tokenlon 資料時才能計算偏離程度
+        coin_paths = {coin: os.path.join(data_path, reference.SOURCES[pairs.resolve(coin)][0][1]) for coin in coingecko}
+        uniswap3_path = os.path.join(data_path, 'uniswap3_subgraph.csv')
+        tx_index_path = os.path.join(data_path, 'tokenlon_transaction_index.csv')
+
+        # 換算數量（寫入資料庫時也會執行一次，這裡單獨計算）
+        timer.run('amount_normalization', lambda: pairs.normalize_amounts(tokenlon), repeat)
+
+        # 寫入資料庫（包含型別轉換、數量換算、去除重複、依日期切分及更新彙總表）
+        def ingest():
+            for coin, coin_data in coingecko.items():
+                utils.write_data(coin_paths[coin], coin_data)
+            utils.write_data(tokenlon_path, tokenlon)
+            utils.write_data(uniswap3_path, uniswap3)
+            utils.write_data(tx_index_path, tx_index)
+        timer.run('ingest', ingest)
+
+        # 讀取資料
+        def load():
+            return (utils.load_data(tokenlon_path),
+                    {coin: utils.load_data(path, columns=['Timestamp', 'Price']) for coin, path in coin_paths.items()},
+                    utils.load_data(uniswap3_path))
+        subgraph_data, coin_data, uniswap3_data = timer.run('load', load, repeat)
+
+        # 合併 CoinGecko 及 Uniswap V3 的參考價格（ingest 時已建立快取，這裡為讀取快取的耗時）
+        timer.run('reference', lambda: {coin: reference.series(coin, data_path).frame() for coin in coin_data}, repeat)
+
+        # 建立交易對索引，取出 ETH、BTC 對 USDT 的買價及賣價
+        def pair_filter():
+            pair_index = pairs.PairIndex(subgraph_data)
+            return {(coin, direction): pair_index.priced_trades(coin, 'tether', direction, 5000 if coin == 'ethereum' else None)
+                    for coin in coin_data for direction in ('sell', 'buy')}
+        trades = timer.run('pair_filter', pair_filter, repeat)
+
+        # 加入最靠近的 CoinGecko 價格
+        def price_join():
+            return {key: utils.add_nearest_price_column(coin_data[key[0]], coin_trades) for key, coin_trades in trades.items()}
+        trades = timer.run('price_join', price_join, repeat)
+
+        # 偏離程度的 z-score、Y 軸範圍及每天的異常值筆數
+        def outlier_stats():
+            for coin_trades in trades.values():
+                z = stats.deviation_zscores(coin_trades)
+                stats.daily_counts(coin_trades['Timestamp'], np.abs(z) > stats.DEFAULT_N)
+                stats.clip_range(coin_trades['Price'], coin_trades['Timestamp'])
+        timer.run('outlier_stats', outlier_stats, repeat)
+
+        # Tx Index 直方圖（與 index_transactionIndex.py 相同的計算）
+        def tx_index_histogram():
+            tokenlon_txIndex = utils.load_data(tx_index_path)
+            bins = list(range(0, tokenlon_txIndex['Index'].max() + 41, 40))
+            return pd.cut(tokenlon_txIndex['Index'], bins=bins).value_counts()
+        timer.run('tx_index_histogram', tx_index_histogram, repeat)
+
+        # 以 Id 合併 Tokenlon 交易及 Tx Index（解析為二進位後以 hash 索引做 equi-join）
+        def id_join():
+            return ids.join(ids.load(tokenlon_path), ids.load(tx_index_path))
+        timer.run('id_join', id_join, repeat)
+
+        # 繪圖前的準備：日期數值轉換、降採樣金字塔及滑鼠提示資料
+        def plot_prep():
+            for coin_trades in trades.values():
+                x = utils.timestamps_to_datenum(coin_trades['Timestamp'])
+                prices = coin_trades['Price'].to_numpy(dtype='float64')
+                levels = lod.build_pyramid(prices)
+                lod.select(levels, 0, len(prices), 2000)
+                utils.hover_series('Sell', x, coin_trades['Timestamp'], prices, coin_trades['CoingeckoPrice'])
+        timer.run('plot_prep', plot_prep, repeat)
+
+        # 時間範圍查詢：每個交易對取出 100 個隨機的 3 天範圍
+        def range_query():
+            query_rng = np.random.default_rng(seed)
+            for coin_trades in trades.values():
+                timestamps = coin_trades['Timestamp'].to_numpy()
+                if not len(timestamps):
+                    continue
+                for start in query_rng.integers(timestamps[0], timestamps[-1] + 1, 100):
+                    timerange.view(coin_trades, start, start + 3 * timerange.SECONDS_PER_DAY)
+        timer.run('range_query', range_query, repeat)
+
+        # 由彙總表取得各 Method 的成交量及偏離程度，以及每小時的彙總，不需要讀取原始交易
+        def cube_query():
+            for coin in coin_data:
+                for direction in ('sell', 'buy'):
+                    cube.query(tokenlon_path, coin, 'tether', direction, by=['Method'])
+                    cube.query(tokenlon_path, coin, 'tether', direction, by=['Hour'], time_range=7)
+        timer.run('cube_query', cube_query, repeat)
+
+        # 1 小時及 1 分鐘的 K 線，並與 CoinGecko 及 Uniswap V3 對齊計算價差
+        def candle_build():
+            pair_index = pairs.PairIndex(subgraph_data)
+            for coin in coin_data:
+                references = {'Coingecko': coin_data[coin], 'Uniswap': uniswap3_data} if coin == 'ethereum' else {'Coingecko': coin_data[coin]}
+                for freq in ('1m', '1h'):
+                    candles.pair_candles(pair_index, coin, 'tether', 'sell', freq, references)
+        timer.run('candles', candle_build, repeat)
+    finally:
+        shutil.rmtree(data_path, ignore_errors=True)
+    return timer.results
+
+# 副程式：取得目前的 git commit 及 utils.py 的 hash，用來分辨結果屬於哪一個版本
+def code_version():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with open(utils.__file__, 'rb') as f:
+        utils_hash = hashlib.sha256(f.read()).hexdigest()
+    return {'commit': commit, 'utils_sha256': utils_hash}
+
+# 副程式：依序執行各個資料筆數的效能測試，並將結果寫入 JSON 檔，回傳檔案路徑
+def run_all(rows_list, days=90, seed=0, repeat=1, output_path=None):
+    report = {
+        'created': datetime.now().astimezone().isoformat(timespec='seconds'),
+        'version': code_version(),
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform()},
+        'parameters': {'days': days, 'seed': seed, 'repeat': repeat},
+        'results': [],
+    }
+    for rows in rows_list:
+        stages = run_benchmark(rows, days, seed, repeat)
+        report['results'].append({'rows': rows, 'stages': stages, 'total': sum(stages.values())})
+    if output_path is None:
+        os.makedirs(BENCH_PATH, exist_ok=True)
+        output_path = os.path.join(BENCH_PATH, f'bench-{datetime.now():%Y%m%dT%H%M%S}.json')
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'結果已寫入 {output_path}')
+    return output_path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='以模擬資料測試各處理階段的耗時')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000], help='模擬的 Tokenlon 交易筆數（可指定多個，最多約 50000000）')
+    parser.add_argument('--days', type=int, default=90, help='模擬資料涵蓋的天數')
+    parser.add_argument('--seed', type=int, default=0, help='亂數種子')
+    parser.add_argument('--repeat', type=int, default=1, help='每個階段執行的次數（取最快的一次）')
+    parser.add_argument('--output', help='結果 JSON 檔的路徑，預設為 ./data/bench/bench-<時間>.json')
+    args = parser.parse_args()
+    run_all(args.rows, args.days, args.seed, args.repeat, args.output)
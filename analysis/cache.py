@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 存放在本地磁碟的 HTTP 回應快取（SQLite），以請求內容（GraphQL body、RPC method + params、CoinGecko 參數）作為 key
+# 每個來源各自設定 TTL；不會改變的資料（例如歷史交易的 Index）標記為 immutable，永遠不會過期
+# 總大小超過 MAX_BYTES 時，依最近使用時間（LRU）刪除最久沒用到的資料
+
+CACHE_PATH = './data/cache/http_cache.sqlite'
+
+# 快取總大小上限（bytes）
+MAX_BYTES = 256 * 1024 * 1024
+
+# 各來源的 TTL（秒）
+SOURCE_TTL = {
+    'tokenlon': 300,
+    'uniswap3': 300,
+    'coingecko': 300,
+    'ethrpc': 300,
+}
+
+# 命中／未命中次數，依來源分別計算
+stats = {}
+
+_lock = threading.Lock()
+_connection = None
+
+# 副程式：取得 SQLite 連線（多個執行緒共用，以 _lock 保護）
+def _connect():
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        _connection = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        # WAL 模式讓每次寫入不需要等待整個檔案同步到磁碟
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL,
+            accessed REAL NOT NULL
+        )""")
+        _connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+    return _connection
+
+# 副程式：以來源及請求內容計算快取的 key
+def make_key(source, request):
+    body = json.dumps(request, sort_keys=True, separators=(',', ':'))
+    return source + ':' + hashlib.sha256(body.encode()).hexdigest()
+
+def _count(source, name):
+    source_stats = stats.setdefault(source, {'hits': 0, 'misses': 0})
+    source_stats[name] += 1
+
+# 副程式：讀取快取，找不到或已過期時回傳 None
+def get(source, request):
+    key = make_key(source, request)
+    now = time.time()
+    with _lock:
+        connection = _connect()
+        row = connection.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < now):
+            _count(source, 'misses')
+            return None
+        connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        connection.commit()
+        _count(source, 'hits')
+    return json.loads(row[0])
+
+# 副程式：寫入快取；immutable=True 時永遠不會過期，否則使用該來源的 TTL
+def put(source, request, value, immutable=False):
+    key = make_key(source, request)
+    body = json.dumps(value).encode()
+    now = time.time()
+    expires = None if immutable else now + SOURCE_TTL.get(source, 0)
+    with _lock:
+        connection = _connect()
+        connection.execute("INSERT OR REPLACE INTO entries (key, source, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?, ?)", (key, source, body, len(body), expires, now))
+        _evict(connection, now)
+        connection.commit()
+
+# 副程式：先刪除已過期的資料，總大小仍超過 MAX_BYTES 時，再從最久沒用到的資料開始刪除
+def _evict(connection, now):
+    connection.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (now,))
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total <= MAX_BYTES:
+        return
+    for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed ASC").fetchall():
+        connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+        total -= size
+        if total <= MAX_BYTES:
+            break
+
+# 副程式：先查快取，沒有時才呼叫 fetch() 並寫入快取
+# immutable 可以是 bool，或是以 fetch() 的結果判斷是否 immutable 的函式
+def cached(source, request, fetch, immutable=False):
+    value = get(source, request)
+    if value is not None:
+        return value
+    value = fetch()
+    put(source, request, value, immutable(value) if callable(immutable) else immutable)
+    return value
+
+# 副程式：清除所有快取
+def clear():
+    with _lock:
+        connection = _connect()
+        connection.execute("DELETE FROM entries")
+        connection.commit()
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import stats
+import timerange
+
+# 將 Tokenlon 交易彙總為 K 線（Open／High／Low／Close、VWAP、成交量及筆數），並與 Uniswap V3、CoinGecko 的價格逐根對齊後計算價差
+# 資料已依 Timestamp 排序，每根 K 線在陣列中是連續的一段，因此只需要找出每段的起點，再以 ufunc.reduceat 一次算出所有 K 線
+# 長時間範圍的比較只需要處理數千根 K 線，而不是數百萬筆交易
+
+# K 線長度的代號（秒）
+FREQUENCIES = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '30m': 1800,
+    '1h': 3600,
+    '4h': 14400,
+    '1d': 86400,
+}
+
+# 副程式：取得 K 線長度（秒），可為 FREQUENCIES 中的代號或秒數
+def bucket_seconds(freq):
+    if isinstance(freq, str):
+        if freq not in FREQUENCIES:
+            raise ValueError(f"Unknown frequency: {freq}")
+        return FREQUENCIES[freq]
+    return int(freq)
+
+# 副程式：找出已排序的 buckets 中每一段的起點及終點（不含）
+def segments(buckets):
+    if len(buckets) == 0:
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+    ends = np.concatenate([starts[1:], [len(buckets)]])
+    return starts, ends
+
+# 副程式：以依時間排序的 timestamps、prices（及 base_amounts）建立 K 線
+# 有 base_amounts 時另外計算 BaseVolume、QuoteVolume（base 數量 × 價格）及 VWAP；價格為 NaN 或無限大的資料會被略過
+def build(timestamps, prices, freq='1h', base_amounts=None):
+    size = bucket_seconds(freq)
+    timestamps = np.asarray(timestamps, dtype='int64')
+    prices = np.asarray(prices, dtype='float64')
+    valid = np.isfinite(prices)
+    if base_amounts is not None:
+        base_amounts = np.asarray(base_amounts, dtype='float64')
+        valid &= np.isfinite(base_amounts)
+        base_amounts = base_amounts[valid]
+    timestamps, prices = timestamps[valid], prices[valid]
+    buckets = timestamps // size * size
+    starts, ends = segments(buckets)
+    candles = pd.DataFrame({
+        'Timestamp': buckets[starts],
+        'Open': prices[starts],
+        'High': np.maximum.reduceat(prices, starts) if len(starts) else prices[:0],
+        'Low': np.minimum.reduceat(prices, starts) if len(starts) else prices[:0],
+        'Close': prices[ends - 1],
+        'Count': ends - starts,
+    })
+    if base_amounts is not None:
+        base_volume = np.add.reduceat(base_amounts, starts) if len(starts) else base_amounts[:0]
+        quote_volume = np.add.reduceat(base_amounts * prices, starts) if len(starts) else base_amounts[:0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            candles = candles.assign(BaseVolume=base_volume, QuoteVolume=quote_volume, VWAP=quote_volume / base_volume)
+    return candles
+
+# 副程式：將已是 K 線的資料（例如 Uniswap V3 的 tokenHourDatas）合併為較長的 K 線；freq 比原本的 K 線短時維持原本的 K 線
+def resample(ohlc, freq='1h'):
+    size = bucket_seconds(freq)
+    timestamps = ohlc['Timestamp'].to_numpy(dtype='int64')
+    buckets = timestamps // size * size
+    starts, ends = segments(buckets)
+    if len(starts) == len(timestamps):
+        return ohlc[['Timestamp', 'Open', 'High', 'Low', 'Close']].assign(Timestamp=buckets).reset_index(drop=True)
+    columns = {column: ohlc[column].to_numpy(dtype='float64') for column in ('Open', 'High', 'Low', 'Close')}
+    return pd.DataFrame({
+        'Timestamp': buckets[starts],
+        'Open': columns['Open'][starts],
+        'High': np.maximum.reduceat(columns['High'], starts),
+        'Low': np.minimum.reduceat(columns['Low'], starts),
+        'Close': columns['Close'][ends - 1],
+    })
+
+# 副程式：取得參考價格的 K 線；有 Open／High／Low／Close 欄位（Uniswap V3）時合併 K 線，否則（CoinGecko）以 Price 建立 K 線
+def reference_candles(reference, freq='1h'):
+    if 'Open' in reference:
+        return resample(reference, freq)
+    return build(reference['Timestamp'], reference['Price'], freq)
+
+# 副程式：將參考價格的 K 線逐根對齊至 candles，並新增 {name}Mid（(Open + Close) / 2）、{name}Age 及 {name}Spread 欄位
+# 每根 K 線對應到開始時間不晚於它的最後一根參考 K 線；參考價格的間隔比 K 線長時（例如 1m K 線對 CoinGecko 的每小時價格），Age 為兩者開始時間的差距（秒）
+# Spread 為 VWAP（沒有 VWAP 時為 Close）相對於 {name}Mid 的偏離程度（VWAP / Mid - 1）
+def align(candles, reference, name, freq='1h'):
+    reference = reference_candles(reference, freq)
+    reference_timestamps = reference['Timestamp'].to_numpy(dtype='int64')
+    reference_mid = (reference['Open'].to_numpy(dtype='float64') + reference['Close'].to_numpy(dtype='float64')) / 2
+    timestamps = candles['Timestamp'].to_numpy(dtype='int64')
+    index = np.searchsorted(reference_timestamps, timestamps, side='right') - 1
+    # 開始時間早於所有參考 K 線的 K 線沒有對應的參考價格（Mid 為 NaN、Age 為 -1）
+    found = index >= 0
+    index = np.clip(index, 0, None)
+    mid, age = np.full(len(candles), np.nan), np.full(len(candles), -1, dtype='int64')
+    mid[found] = reference_mid[index[found]]
+    age[found] = timestamps[found] - reference_timestamps[index[found]]
+    price = candles['VWAP'] if 'VWAP' in candles else candles['Close']
+    return candles.assign(**{f'{name}Mid': mid, f'{name}Age': age, f'{name}Spread': stats.deviations(price, mid)})
+
+# 副程式：以 PairIndex 取出交易對（base／quote／direction 與 PairIndex.priced_trades() 相同）的 K 線
+# references 為 {名稱: 參考價格 DF}，例如 {'Coingecko': CoinGecko DF, 'Uniswap': Uniswap V3 DF}，每個都會對齊並計算價差；time_range 見 timerange.resolve()
+def pair_candles(pair_index, base, quote, direction, freq='1h', references=None, min_quote_amount=None, time_range=None):
+    trades = pair_index.priced_trades(base, quote, direction, min_quote_amount)
+    trades = timerange.view(trades, *timerange.resolve(time_range, trades['Timestamp'].iloc[-1] if len(trades) else 0))
+    # sell：Taker 付出 base（TakerValue）；buy：Taker 得到 base（MakerValue）
+    base_amounts = trades['TakerValue'] if direction == 'sell' else trades['MakerValue']
+    candles = build(trades['Timestamp'], trades['Price'], freq, base_amounts)
+    for name, reference in (references or {}).items():
+        candles = align(candles, reference, name, freq)
+    return candles
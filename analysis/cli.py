@@ -0,0 +1,192 @@
+# 統一的指令入口，每個子指令只載入自己需要的模組（例如 fetch 不會載入 matplotlib）
+# python3 ./analysis/cli.py fetch
+# python3 ./analysis/cli.py enrich-txindex --days 3
+# python3 ./analysis/cli.py analyze --coin ethereum
+# python3 ./analysis/cli.py summary --coin ethereum --by Method
+# python3 ./analysis/cli.py candles --coin ethereum --freq 1h --days 7
+# python3 ./analysis/cli.py plot --coin ethereum --target tether --days 3
+# python3 ./analysis/cli.py bench --rows 10000 100000
+# python3 ./analysis/cli.py tail --port 8765
+
+import argparse
+import instrument
+
+# 資料來源名稱，fetch 可以只更新其中幾個（與 index_price.SOURCES 相同，這裡不 import index_price 以免拖慢 --help）
+SOURCES = ['coingecko', 'tokenlon', 'uniswap3']
+
+# 副程式：由 --start / --end / --days 取得時間範圍（見 timerange.resolve()），都沒有指定時回傳 default
+def time_range(args, default=None):
+    if args.start or args.end:
+        return tuple(int(value) if value and value.isdigit() else value for value in (args.start, args.end))
+    if args.days is not None:
+        return args.days
+    return default
+
+# 副程式：加入 --start / --end / --days 參數
+def add_time_range_arguments(parser, days_help):
+    parser.add_argument('--start', help='時間範圍的起點（含），例如 "2023/03/20 00:00:00+0800" 或 Unix 時間（秒）')
+    parser.add_argument('--end', help='時間範圍的終點（不含），格式同 --start')
+    parser.add_argument('--days', type=float, help=days_help)
+
+# 副程式：加入 --reference 參數（參考價格來源的優先順序，見 reference.SOURCES）
+def add_reference_argument(parser):
+    parser.add_argument('--reference', nargs='+', choices=['coingecko', 'uniswap3'], help='參考價格來源的優先順序，例如 --reference uniswap3 coingecko（預設以 CoinGecko 為主）')
+
+# 子指令：同時更新資料來源
+def fetch(args):
+    import index_price
+    results = index_price.refresh_all(args.source)
+    # 有任何來源失敗或逾時時，以非 0 的結束碼通知 cron
+    if any(result['status'] != 'ok' for result in results.values()):
+        raise SystemExit(1)
+
+# 子指令：取得 Tokenlon 交易的 Tx Index
+def enrich_txindex(args):
+    import index_transactionIndex
+    index_transactionIndex.enrich_transaction_index(time_range(args, 3))
+
+# 子指令：印出 coin 對 USDT 的買價／賣價相對於 CoinGecko 價格的偏離程度及異常值筆數，不需要載入 matplotlib
+def analyze(args):
+    import numpy as np
+    import index_price
+    import stats
+    analysis_range = time_range(args)
+    # 相對的天數以該交易對最新的交易為準，因此只有指定日期時才在讀取時篩選
+    pair_index, coin_data_csv, uniswap3_subgraph_data_csv = index_price.load_analysis_data(None if isinstance(analysis_range, float) else analysis_range, args.reference, [(args.coin, 'tether')])
+    sell_coin, buy_coin = index_price.sell_buy_trades(pair_index, coin_data_csv, args.coin, analysis_range)
+    for direction, trades in (('sell', sell_coin), ('buy', buy_coin)):
+        deviations = stats.deviations(trades['Price'], trades['CoingeckoPrice'])
+        z = stats.deviation_zscores(trades)
+        outliers = int(np.sum(np.abs(z) > args.n))
+        print(f'{args.coin}-tether {direction}：{len(trades)} 筆，偏離中位數 {np.nanmedian(deviations) * 10000:.1f} bps，超過 {args.n} 倍標準差 {outliers} 筆')
+        if args.output:
+            trades.assign(Deviation=deviations, ZScore=z).to_csv(f'{args.output}-{direction}.csv', index=False)
+
+# 子指令：由彙總表印出 coin 對 USDT 的成交量、VWAP 及偏離程度，不需要讀取原始交易
+def summary(args):
+    import cube
+    import index_price
+    import pandas as pd
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        for direction in ('sell', 'buy'):
+            result = cube.query(index_price.tokenlon_subgraph_file_path, args.coin, 'tether', direction, args.by, time_range(args))
+            print(f'{args.coin}-tether {direction}：')
+            print(result.to_string(index=False))
+            if args.output:
+                result.to_csv(f'{args.output}-{direction}.csv', index=False)
+
+# 子指令：印出 coin 對 USDT 的 K 線，並與參考價格及 Uniswap V3（只有 ethereum）逐根對齊計算價差
+def candles(args):
+    import candles
+    import index_price
+    import pandas as pd
+    analysis_range = time_range(args)
+    pair_index, coin_data_csv, uniswap3_subgraph_data_csv = index_price.load_analysis_data(None if isinstance(analysis_range, float) else analysis_range, args.reference, [(args.coin, 'tether')])
+    # Reference 為 reference.py 合併後的參考價格，另外再單獨與 Uniswap V3 比較
+    references = {'Reference': coin_data_csv[args.coin]}
+    # Uniswap V3 的 tokenHourDatas 只有 WETH
+    if args.coin == 'ethereum' and len(uniswap3_subgraph_data_csv):
+        references['Uniswap'] = uniswap3_subgraph_data_csv
+    with pd.option_context('display.max_rows', args.rows, 'display.width', None):
+        for direction in args.direction:
+            result = candles.pair_candles(pair_index, args.coin, 'tether', direction, args.freq, references, index_price.min_quote_amount.get(args.coin), analysis_range)
+            print(f'{args.coin}-tether {direction}（{args.freq}）：{len(result)} 根 K 線')
+            print(result.tail(args.rows).to_string(index=False))
+            if args.output:
+                result.to_csv(f'{args.output}-{direction}.csv', index=False)
+
+# 子指令：繪圖（互動視窗、批次輸出圖檔或 Tx Index 直方圖）
+def plot(args):
+    if args.batch:
+        import render
+        render.render_all(render.JOBS, args.workers)
+    elif args.txindex:
+        import index_transactionIndex
+        index_transactionIndex.plot_histogram(time_range(args))
+    else:
+        import index_price
+        import utils
+        index_price.plot(args.coin, args.target, time_range(args, utils.plot_time_range), args.reference)
+
+# 子指令：持續輪詢各資料來源，在記憶體中更新統計並輸出目前狀態
+def tail(args):
+    import tail
+    intervals = {source: seconds for source, seconds in (('tokenlon', args.tokenlon_interval), ('coingecko', args.coingecko_interval), ('ethrpc', args.ethrpc_interval)) if seconds is not None}
+    tail.run(args.coin, args.state, args.port, intervals)
+
+# 子指令：效能測試
+def bench(args):
+    import bench
+    bench.run_all(args.rows, args.days, args.seed, args.repeat, args.output)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tokenlon 合約交易分析')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help='更新 CoinGecko、Tokenlon 及 Uniswap V3 資料')
+    fetch_parser.add_argument('--source', nargs='+', choices=SOURCES, default=SOURCES, help='只更新指定的資料來源')
+    fetch_parser.set_defaults(handler=fetch)
+
+    enrich_parser = subparsers.add_parser('enrich-txindex', help='向 ETH 節點取得 Tokenlon 交易的 Tx Index')
+    add_time_range_arguments(enrich_parser, '取得最近幾天的交易（預設 3 天）')
+    enrich_parser.set_defaults(handler=enrich_txindex)
+
+    analyze_parser = subparsers.add_parser('analyze', help='計算買價／賣價相對於 CoinGecko 價格的偏離程度')
+    analyze_parser.add_argument('--coin', default='ethereum', help='CoinGecko coin id，例如 ethereum、bitcoin')
+    analyze_parser.add_argument('--n', type=float, default=2, help='判斷異常值的標準差倍數')
+    add_time_range_arguments(analyze_parser, '只分析到最新一筆交易為止的最近幾天')
+    analyze_parser.add_argument('--output', help='將結果寫入 <output>-sell.csv 及 <output>-buy.csv')
+    add_reference_argument(analyze_parser)
+    analyze_parser.set_defaults(handler=analyze)
+
+    summary_parser = subparsers.add_parser('summary', help='由彙總表印出各 Method／小時的成交量、VWAP 及偏離程度')
+    summary_parser.add_argument('--coin', default='ethereum', help='CoinGecko coin id，例如 ethereum、bitcoin')
+    summary_parser.add_argument('--by', nargs='*', choices=['Method', 'Hour'], default=['Method'], help='分組的欄位，不指定時為整個時間範圍的彙總')
+    add_time_range_arguments(summary_parser, '只彙總到最新一筆交易為止的最近幾天')
+    summary_parser.add_argument('--output', help='將結果寫入 <output>-sell.csv 及 <output>-buy.csv')
+    summary_parser.set_defaults(handler=summary)
+
+    candles_parser = subparsers.add_parser('candles', help='建立 K 線（OHLC、VWAP、筆數），並計算相對於 CoinGecko 及 Uniswap V3 的價差')
+    candles_parser.add_argument('--coin', default='ethereum', help='CoinGecko coin id，例如 ethereum、bitcoin')
+    candles_parser.add_argument('--direction', nargs='+', choices=['sell', 'buy'], default=['sell', 'buy'], help='賣價（sell）或買價（buy）')
+    candles_parser.add_argument('--freq', default='1h', help='K 線長度：1m、5m、15m、30m、1h、4h、1d')
+    candles_parser.add_argument('--rows', type=int, default=20, help='印出最後幾根 K 線')
+    add_time_range_arguments(candles_parser, '只處理到最新一筆交易為止的最近幾天')
+    candles_parser.add_argument('--output', help='將所有 K 線寫入 <output>-sell.csv 及 <output>-buy.csv')
+    add_reference_argument(candles_parser)
+    candles_parser.set_defaults(handler=candles)
+
+    plot_parser = subparsers.add_parser('plot', help='繪製價格圖表')
+    plot_parser.add_argument('--coin', default='ethereum', help='CoinGecko coin id，例如 ethereum、bitcoin')
+    plot_parser.add_argument('--target', default='tether', help='計價的 Token')
+    plot_parser.add_argument('--batch', action='store_true', help='不開啟視窗，將 render.py 的所有圖表輸出至 images/')
+    plot_parser.add_argument('--workers', type=int, help='--batch 時同時繪圖的 process 數量')
+    plot_parser.add_argument('--txindex', action='store_true', help='繪製 Tx Index 的直方圖')
+    add_time_range_arguments(plot_parser, '顯示到最新一筆資料為止的最近幾天')
+    add_reference_argument(plot_parser)
+    plot_parser.set_defaults(handler=plot)
+
+    tail_parser = subparsers.add_parser('tail', help='持續輪詢 Tokenlon、CoinGecko 及 ETH 節點，即時更新偏離程度統計及 Tx Index 直方圖')
+    tail_parser.add_argument('--coin', nargs='+', default=['ethereum', 'bitcoin'], help='CoinGecko coin id，例如 ethereum、bitcoin')
+    tail_parser.add_argument('--state', default='./data/tail_state.json', help='目前狀態 JSON 檔的路徑')
+    tail_parser.add_argument('--port', type=int, help='在 127.0.0.1 的此 port 提供目前狀態的 JSON')
+    tail_parser.add_argument('--tokenlon-interval', type=float, help='Tokenlon Subgraph 的輪詢間隔（秒）')
+    tail_parser.add_argument('--coingecko-interval', type=float, help='CoinGecko 的輪詢間隔（秒）')
+    tail_parser.add_argument('--ethrpc-interval', type=float, help='ETH 節點的輪詢間隔（秒）')
+    tail_parser.set_defaults(handler=tail)
+
+    bench_parser = subparsers.add_parser('bench', help='以模擬資料測試各處理階段的耗時')
+    bench_parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000], help='模擬的 Tokenlon 交易筆數')
+    bench_parser.add_argument('--days', type=int, default=90, help='模擬資料涵蓋的天數')
+    bench_parser.add_argument('--seed', type=int, default=0, help='亂數種子')
+    bench_parser.add_argument('--repeat', type=int, default=1, help='每個階段執行的次數（取最快的一次）')
+    bench_parser.add_argument('--output', help='結果 JSON 檔的路徑')
+    bench_parser.set_defaults(handler=bench)
+
+    args = parser.parse_args(argv)
+    if args.command != 'bench':
+        instrument.enable()
+    args.handler(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pairs
+import reference
+import stats
+import storage
+import timerange
+
+# Tokenlon 交易的彙總表：以 (MakerToken, TakerToken, Method, 小時) 分組，保存筆數、成交量、最低／最高價及相對於參考價格的偏離程度總和
+# 資料寫入資料庫時（storage.append）只需要彙總新的資料再合併，查詢時不需要讀取原始交易
+# 彙總表存放在資料集資料夾中的 _cube.parquet；Count 的總和與 metadata 的 row_count 不同時（例如以 storage.py 直接轉換的資料），會在查詢時重新建立
+# 與最接近的參考價格相差超過 reference.TOLERANCE 的交易（例如參考價格比交易晚寫入）不計算偏離程度
+# 參考價格各來源最後的 Timestamp 記錄在 _cube.json，有更新時，寫入或查詢時會重新彙總尚未確定的小時（見 settled_timestamp()）
+
+# 要彙總的資料集
+DATASET = 'tokenlon_subgraph'
+
+CUBE_FILE = '_cube.parquet'
+CUBE_META_FILE = '_cube.json'
+
+# 彙總的時間單位（秒）
+BUCKET = 3600
+
+# 視為 USD 的穩定幣，只有對這些 Token 的交易才計算偏離程度
+USD_SYMBOLS = ['USDT', 'USDC', 'DAI']
+
+# 分組的欄位
+KEY_COLUMNS = ['Maker', 'Taker', 'Method', 'Hour']
+
+# 各彙總欄位合併時的計算方式
+AGGREGATIONS = {
+    'Count': 'sum',
+    'MakerVolume': 'sum',
+    'TakerVolume': 'sum',
+    'MinPrice': 'min',
+    'MaxPrice': 'max',
+    'DeviationCount': 'sum',
+    'DeviationSum': 'sum',
+    'DeviationSquareSum': 'sum',
+}
+
+# 讀取原始交易時需要的欄位
+SOURCE_COLUMNS = ['Timestamp', 'MakerToken', 'TakerToken', 'Method', 'MakerValue', 'TakerValue', 'MakerPrice']
+
+# 副程式：取得彙總表的檔案路徑
+def cube_path(csv_file_path):
+    return os.path.join(storage.dataset_dir(csv_file_path), CUBE_FILE)
+
+# 副程式：取得彙總表 metadata 的檔案路徑
+def cube_meta_path(csv_file_path):
+    return os.path.join(storage.dataset_dir(csv_file_path), CUBE_META_FILE)
+
+# 副程式：參考價格各來源最後一筆資料的 Timestamp（沒有資料時為 0），依 reference.SOURCES 的順序，只需要讀取 metadata
+def reference_lasts(csv_file_path):
+    data_dir = os.path.dirname(csv_file_path)
+    return [storage.last_timestamp(os.path.join(data_dir, file_name)) for sources in reference.SOURCES.values() for source, file_name in sources]
+
+# 副程式：偏離程度已確定的最後時間：參考價格只有在各來源最後一筆資料之後（及最後一個格點內）會改變，
+# 每筆交易只使用前後 reference.TOLERANCE 秒內的參考價格，因此在此之前的交易之後不需要重新計算
+def settled_timestamp(lasts):
+    return min(lasts) - reference.GRID - reference.TOLERANCE
+
+# 副程式：以二分搜尋取得最靠近 timestamps 的參考價格，沒有參考價格或相差超過 tolerance 秒時為 NaN
+def nearest_prices(reference_timestamps, reference_prices, timestamps, tolerance=reference.TOLERANCE):
+    if len(reference_timestamps) == 0:
+        return np.full(len(timestamps), np.nan)
+    if len(reference_timestamps) == 1:
+        index = np.zeros(len(timestamps), dtype='int64')
+    else:
+        index = np.clip(np.searchsorted(reference_timestamps, timestamps), 1, len(reference_timestamps) - 1)
+        index -= (timestamps - reference_timestamps[index - 1]) <= (reference_timestamps[index] - timestamps)
+    return np.where(np.abs(timestamps - reference_timestamps[index]) <= tolerance, reference_prices[index], np.nan)
+
+# 副程式：計算每筆交易相對於參考價格（reference.py，與 Tokenlon 資料放在同一個資料夾）的偏離程度
+# 只有有參考價格的 Token（ETH、WBTC）對 USD 穩定幣、且 reference.TOLERANCE 秒內有參考價格的交易才有值，其他為 NaN
+def trade_deviations(csv_file_path, timestamps, maker_codes, taker_codes, maker_prices):
+    result = np.full(len(timestamps), np.nan)
+    usd_codes = [pairs.SYMBOLS.index(symbol) for symbol in USD_SYMBOLS]
+    for symbol in reference.SOURCES:
+        code = pairs.SYMBOLS.index(symbol)
+        # sell：Taker 用 coin 換穩定幣，MakerPrice 即為以 USD 計價的價格；buy：Taker 用穩定幣換 coin，價格為 MakerPrice 的倒數
+        sell = (taker_codes == code) & np.isin(maker_codes, usd_codes)
+        buy = (maker_codes == code) & np.isin(taker_codes, usd_codes)
+        mask = sell | buy
+        if not mask.any():
+            continue
+        series = reference.series(symbol, os.path.dirname(csv_file_path))
+        with np.errstate(divide='ignore'):
+            prices = np.where(sell, maker_prices, 1 / maker_prices)[mask]
+        result[mask] = stats.deviations(prices, nearest_prices(series.timestamps, series.prices, timestamps[mask]))
+    return result
+
+# 副程式：將原始交易彙總為以 (Maker, Taker, Method, Hour) 分組的 DF
+def aggregate(csv_file_path, data):
+    if 'MakerValue' not in data:
+        data = pairs.normalize_amounts(data)
+    timestamps = data['Timestamp'].to_numpy(dtype='int64')
+    maker_codes = pairs.encode_addresses(data['MakerToken'])
+    taker_codes = pairs.encode_addresses(data['TakerToken'])
+    maker_prices = data['MakerPrice'].to_numpy(dtype='float64')
+    deviations = trade_deviations(csv_file_path, timestamps, maker_codes, taker_codes, maker_prices)
+    has_deviation = ~np.isnan(deviations)
+    symbols = np.array(pairs.SYMBOLS + ['UNKNOWN'], dtype=object)
+    rows = pd.DataFrame({
+        'Maker': symbols[maker_codes],
+        'Taker': symbols[taker_codes],
+        'Method': data['Method'].astype(str).to_numpy() if 'Method' in data else 'unknown',
+        'Hour': timestamps // BUCKET * BUCKET,
+        'Count': 1,
+        'MakerVolume': data['MakerValue'].to_numpy(dtype='float64'),
+        'TakerVolume': data['TakerValue'].to_numpy(dtype='float64'),
+        'MinPrice': maker_prices,
+        'MaxPrice': maker_prices,
+        'DeviationCount': has_deviation.astype('int64'),
+        'DeviationSum': np.where(has_deviation, deviations, 0.0),
+        'DeviationSquareSum': np.where(has_deviation, deviations ** 2, 0.0),
+    })
+    return merge(rows)
+
+# 副程式：將相同分組的資料合併（sum／min／max）
+def merge(rows):
+    return rows.groupby(KEY_COLUMNS, sort=True, dropna=False, observed=True).agg(AGGREGATIONS).reset_index()
+
+# 副程式：寫入彙總表（暫存檔 + 取代）及彙總時參考價格各來源最後的 Timestamp
+def write(csv_file_path, cube, lasts):
+    path = cube_path(csv_file_path)
+    cube.to_parquet(path + '.tmp', index=False, compression='zstd')
+    os.replace(path + '.tmp', path)
+    storage.write_json_atomic(cube_meta_path(csv_file_path), {'reference_lasts': lasts})
+
+# 副程式：讀取彙總表及彙總時參考價格各來源最後的 Timestamp，不存在時回傳 (None, None)
+def read(csv_file_path):
+    path, meta_path = cube_path(csv_file_path), cube_meta_path(csv_file_path)
+    if not os.path.exists(path) or not os.path.exists(meta_path):
+        return None, None
+    with open(meta_path) as f:
+        return pd.read_parquet(path), json.load(f)['reference_lasts']
+
+# 副程式：由資料庫中的所有交易重新建立彙總表
+def rebuild(csv_file_path):
+    lasts = reference_lasts(csv_file_path)
+    cube = aggregate(csv_file_path, storage.load(csv_file_path, columns=SOURCE_COLUMNS))
+    write(csv_file_path, cube, lasts)
+    return cube
+
+# 副程式：參考價格更新後，以原始交易重新彙總上次尚未確定的小時（包含所有交易對），回傳新的彙總表
+# 只需要讀取這幾個小時的交易；data 為此次新寫入、但早於這些小時的交易（沒有時為 None），另外合併
+def catch_up(csv_file_path, cube, previous_lasts, data=None):
+    start = max(settled_timestamp(previous_lasts), 0) // BUCKET * BUCKET
+    parts = [cube[cube['Hour'] < start], aggregate(csv_file_path, storage.load(csv_file_path, columns=SOURCE_COLUMNS, start=start))]
+    if data is not None:
+        parts.append(aggregate(csv_file_path, data[data['Timestamp'] < start]))
+    return merge(pd.concat(parts, ignore_index=True))
+
+# 副程式：storage.append 寫入新資料後呼叫，只彙總新的資料再合併至彙總表（參考價格有更新時改為重新彙總尚未確定的小時）
+def update(csv_file_path, data):
+    cube, previous_lasts = read(csv_file_path)
+    if cube is None:
+        rebuild(csv_file_path)
+        return
+    lasts = reference_lasts(csv_file_path)
+    if lasts != previous_lasts:
+        cube = catch_up(csv_file_path, cube, previous_lasts, data)
+    else:
+        cube = merge(pd.concat([cube, aggregate(csv_file_path, data)], ignore_index=True))
+    write(csv_file_path, cube, lasts)
+
+# 副程式：讀取彙總表，不存在或與資料庫的筆數不同時重新建立；參考價格有更新時重新彙總尚未確定的小時
+def load(csv_file_path):
+    if not storage.exists(csv_file_path):
+        return pd.DataFrame(columns=KEY_COLUMNS + list(AGGREGATIONS))
+    cube, previous_lasts = read(csv_file_path)
+    if cube is None or int(cube['Count'].sum()) != storage.read_meta(csv_file_path)['row_count']:
+        return rebuild(csv_file_path)
+    lasts = reference_lasts(csv_file_path)
+    if lasts != previous_lasts:
+        cube = catch_up(csv_file_path, cube, previous_lasts)
+        write(csv_file_path, cube, lasts)
+    return cube
+
+# 副程式：查詢交易對（base／quote／direction 與 PairIndex.priced_trades() 相同）的彙總結果
+# by：分組的欄位（'Method'、'Hour'），例如 ['Method'] 為各 Method 在整個時間範圍的彙總；time_range 見 timerange.resolve()
+# 回傳 Count、BaseVolume、QuoteVolume、VWAP、Low、High（以 quote 計價）及偏離程度的平均值、標準差
+def query(csv_file_path, base, quote, direction, by=('Method', 'Hour'), time_range=None):
+    cube = load(csv_file_path)
+    base, quote = pairs.resolve(base), pairs.resolve(quote)
+    if direction == 'sell':
+        cube = cube[(cube['Maker'] == quote) & (cube['Taker'] == base)]
+        base_volume, quote_volume, low, high = cube['TakerVolume'], cube['MakerVolume'], cube['MinPrice'], cube['MaxPrice']
+    elif direction == 'buy':
+        cube = cube[(cube['Maker'] == base) & (cube['Taker'] == quote)]
+        base_volume, quote_volume, low, high = cube['MakerVolume'], cube['TakerVolume'], 1 / cube['MaxPrice'], 1 / cube['MinPrice']
+    else:
+        raise ValueError(f"Unknown direction: {direction}")
+    cube = cube.assign(BaseVolume=base_volume, QuoteVolume=quote_volume, Low=low, High=high)
+    # 彙總表依 Hour 排序後，以二分搜尋取出時間範圍（最近 N 天以最後一個小時的結尾為準）
+    cube = cube.sort_values(by='Hour', kind='stable')
+    last_timestamp = int(cube['Hour'].iloc[-1]) + BUCKET - 1 if len(cube) else 0
+    cube = timerange.view(cube, *timerange.resolve(time_range, last_timestamp), column='Hour')
+    keys = list(by)
+    if not keys:
+        cube = cube.assign(Total='total')
+        keys = ['Total']
+    result = cube.groupby(keys, sort=True, observed=True).agg(
+        Count=('Count', 'sum'), BaseVolume=('BaseVolume', 'sum'), QuoteVolume=('QuoteVolume', 'sum'),
+        Low=('Low', 'min'), High=('High', 'max'),
+        DeviationCount=('DeviationCount', 'sum'), DeviationSum=('DeviationSum', 'sum'), DeviationSquareSum=('DeviationSquareSum', 'sum'),
+    )
+    # 以總和計算平均值及樣本標準差（ddof=1），少於 2 筆時標準差為 NaN
+    count = result['DeviationCount'].to_numpy(dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = result['DeviationSum'].to_numpy(dtype='float64') / count
+        variance = np.where(count > 1, (result['DeviationSquareSum'].to_numpy(dtype='float64') - count * mean ** 2) / (count - 1), np.nan)
+        result = result.assign(
+            VWAP=result['QuoteVolume'] / result['BaseVolume'],
+            DeviationMean=mean,
+            DeviationStd=np.sqrt(np.maximum(variance, 0.0)),
+        )
+    return result.drop(columns=['DeviationSum', 'DeviationSquareSum']).reset_index()
+
+storage.on_append(DATASET, update)
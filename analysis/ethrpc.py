@@ -0,0 +1,186 @@
+import lazy
+import os
+import pandas as pd
+import threading
+import time
+import cache
+import instrument
+from concurrent.futures import ThreadPoolExecutor
+
+# 第一次送出請求時才載入 requests
+requests = lazy.module('requests')
+
+# 副程式：Ethereum 節點回傳錯誤時使用的例外
+class JsonRpcError(Exception):
+    pass
+
+# 限制每秒送出的 HTTP 請求數量（多個執行緒共用）
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            sleep_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+# 每個執行緒各自使用一個 requests.Session，以重複使用連線
+_thread_local = threading.local()
+
+def _get_session():
+    if not hasattr(_thread_local, 'session'):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+# 副程式：以一個 HTTP 請求送出多個 JSON-RPC 呼叫（batch request），並依原本的順序回傳 result
+# calls 為 [(method, params), ...]
+def post_json_rpc_batch(node_url, calls, timeout=30):
+    payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]
+    r = _get_session().post(node_url, json=payload, timeout=timeout)
+    r.raise_for_status()
+    instrument.count_http('ethrpc', len(r.content))
+    instrument.count('rpc_calls', len(calls))
+    responses = r.json()
+    # 有些節點在整個 batch 失敗時，只回傳一個錯誤物件
+    if isinstance(responses, dict):
+        raise JsonRpcError(responses.get('error', responses))
+    results = [None] * len(calls)
+    for response in responses:
+        if 'error' in response:
+            raise JsonRpcError(response['error'])
+        results[response['id']] = response['result']
+    return results
+
+# 副程式：失敗時以指數退避（backoff、2 * backoff、4 * backoff…）重試
+def post_json_rpc_batch_with_retry(node_url, calls, limiter, retries=5, backoff=0.5, timeout=30):
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return post_json_rpc_batch(node_url, calls, timeout)
+        except (requests.RequestException, ValueError, JsonRpcError) as e:
+            if attempt == retries:
+                raise
+            print(f'Note: JSON-RPC 請求失敗（{e}），{backoff * 2 ** attempt:.1f} 秒後重試')
+            time.sleep(backoff * 2 ** attempt)
+
+# 結果不會改變的 RPC method（已上鏈的交易及區塊）：所在區塊已有 CONFIRMATIONS 個確認時，會永久存放在本地快取中
+# 尚未確認的結果可能因鏈重組而改變，只以 TTL 快取
+IMMUTABLE_METHODS = {'eth_getTransactionByHash', 'eth_getBlockByNumber'}
+
+# 區塊高度比最新區塊低至少此數量時，視為不會再因鏈重組（reorg）而改變
+CONFIRMATIONS = 12
+
+# 副程式：區塊是否已有 CONFIRMATIONS 個確認（head 為最新區塊高度，不知道時為 None，視為未確認）
+def is_confirmed(block_number, head):
+    return head is not None and block_number is not None and int(block_number) <= head - CONFIRMATIONS
+
+# 副程式：call 的結果是否可以永久存放在快取中（method 在 IMMUTABLE_METHODS 中，且所在區塊已確認）
+def is_immutable(method, params, result, head):
+    if method not in IMMUTABLE_METHODS:
+        return False
+    if method == 'eth_getBlockByNumber':
+        block_number = int(params[0], 16)
+    else:
+        block_number = int(result['blockNumber'], 16) if result.get('blockNumber') else None
+    return is_confirmed(block_number, head)
+
+# 副程式：取得節點目前最新的區塊高度（不使用快取）
+def fetch_block_number(node_url, rate_limit=10, retries=5, backoff=0.5):
+    result, = post_json_rpc_batch_with_retry(node_url, [("eth_blockNumber", [])], RateLimiter(rate_limit), retries, backoff)
+    return int(result, 16)
+
+# 副程式：將 calls 切成每 batch_size 個一組的 batch request，以 concurrency 個執行緒同時送出，依原本的順序回傳 result
+# rate_limit：每秒最多送出的請求數；已在本地快取中的 call 不會送出；head：最新區塊高度（見 is_immutable()）
+def run_json_rpc_batches(node_url, calls, batch_size=50, concurrency=4, rate_limit=10, retries=5, backoff=0.5, head=None):
+    results = [cache.get('ethrpc', [method, params]) for method, params in calls]
+    missing = [i for i, result in enumerate(results) if result is None]
+    limiter = RateLimiter(rate_limit)
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    def fetch_batch(batch):
+        return post_json_rpc_batch_with_retry(node_url, [calls[i] for i in batch], limiter, retries, backoff)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch, batch_results in zip(batches, executor.map(fetch_batch, batches)):
+            for i, result in zip(batch, batch_results):
+                results[i] = result
+                method, params = calls[i]
+                # 找不到的交易或區塊（None）不寫入快取
+                if result is not None:
+                    cache.put('ethrpc', [method, params], result, immutable=is_immutable(method, params, result, head))
+    return results
+
+# 副程式：以 JSON-RPC batch request 同時取得多筆交易的 transactionIndex，依 tx_hashes 的順序回傳
+def fetch_transaction_indices(node_url, tx_hashes, batch_size=50, **kwargs):
+    tx_hashes = list(tx_hashes)
+    if not tx_hashes:
+        return []
+    start = time.perf_counter()
+    calls = [("eth_getTransactionByHash", [tx_hash]) for tx_hash in tx_hashes]
+    results = run_json_rpc_batches(node_url, calls, batch_size, **kwargs)
+    indices = []
+    for tx_hash, tx in zip(tx_hashes, results):
+        if tx is None:
+            raise JsonRpcError(f'Transaction not found: {tx_hash}')
+        indices.append(int(tx['transactionIndex'], 16))
+    elapsed = time.perf_counter() - start
+    print(f'向 ETH 節點取資料：{len(tx_hashes)} 筆交易，{len(tx_hashes) / elapsed:.1f} tx/s')
+    return indices
+
+# 副程式：取得每個區塊的完整交易列表（只含 tx hash），回傳 {BlockNumber: [tx hash, ...]}
+# 交易在列表中的位置即為 transactionIndex
+def fetch_block_transaction_hashes(node_url, block_numbers, batch_size=10, **kwargs):
+    block_numbers = [int(block_number) for block_number in block_numbers]
+    calls = [("eth_getBlockByNumber", [hex(block_number), False]) for block_number in block_numbers]
+    results = run_json_rpc_batches(node_url, calls, batch_size, **kwargs)
+    blocks = {}
+    for block_number, block in zip(block_numbers, results):
+        if block is None:
+            raise JsonRpcError(f'Block not found: {block_number}')
+        blocks[block_number] = [tx_hash.lower() for tx_hash in block['transactions']]
+    return blocks
+
+# 副程式：讀取 tx hash → transactionIndex 的快取檔，回傳 dict
+def load_tx_index_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    cache_data = pd.read_csv(cache_path)
+    return dict(zip(cache_data['TxHash'], cache_data['Index']))
+
+# 以 BlockNumber 為單位解析 transactionIndex：每個區塊只取一次完整交易列表，即可得到區塊內所有 Tokenlon 交易的 Index
+# 已在 cache（tx hash → Index）中的交易不會再向 ETH 節點要取；新解析、且所在區塊已有 CONFIRMATIONS 個確認的結果會加入 cache，並附加寫入 cache_path
+# 較新區塊中的交易可能因鏈重組而改變，只回傳此次的結果；head 為最新區塊高度，沒有指定時向節點取得
+# 依 tx_hashes 的順序回傳 Index
+def resolve_transaction_indices(node_url, tx_hashes, block_numbers, cache, cache_path=None, head=None, **kwargs):
+    tx_hashes = [tx_hash.lower() for tx_hash in tx_hashes]
+    block_numbers = [int(block_number) for block_number in block_numbers]
+    missing = {tx_hash: block_number for tx_hash, block_number in zip(tx_hashes, block_numbers) if tx_hash not in cache}
+    resolved = {}
+    if missing:
+        start = time.perf_counter()
+        if head is None:
+            head = fetch_block_number(node_url, **{key: kwargs[key] for key in ('rate_limit', 'retries', 'backoff') if key in kwargs})
+        blocks = fetch_block_transaction_hashes(node_url, sorted(set(missing.values())), head=head, **kwargs)
+        for block_number, block_tx_hashes in blocks.items():
+            for index, tx_hash in enumerate(block_tx_hashes):
+                if tx_hash in missing:
+                    resolved[tx_hash] = index
+        # 若區塊中找不到（例如 BlockNumber 有誤），改用 tx hash 逐筆查詢
+        not_found = [tx_hash for tx_hash in missing if tx_hash not in resolved]
+        if not_found:
+            resolved.update(zip(not_found, fetch_transaction_indices(node_url, not_found, head=head, **kwargs)))
+        elapsed = time.perf_counter() - start
+        print(f'向 ETH 節點取資料：{len(blocks)} 個區塊，解析 {len(resolved)} 筆交易，{len(resolved) / elapsed:.1f} tx/s')
+        confirmed = {tx_hash: index for tx_hash, index in resolved.items() if is_confirmed(missing[tx_hash], head)}
+        cache.update(confirmed)
+        if cache_path is not None and confirmed:
+            new_cache = pd.DataFrame({'TxHash': list(confirmed.keys()), 'BlockNumber': [missing[tx_hash] for tx_hash in confirmed], 'Index': list(confirmed.values())})
+            new_cache.to_csv(cache_path, mode='a', header=not os.path.exists(cache_path), index=False)
+    return [cache[tx_hash] if tx_hash in cache else resolved[tx_hash] for tx_hash in tx_hashes]
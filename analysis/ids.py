@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+import storage
+
+# Tokenlon 交易 Id（"0x<hash>-0x<tx hash>-<log index>"，每筆約 136 bytes 的字串）的二進位表示
+# 第一段為事件中的 hash，第二段為 Ethereum 的 tx hash（向 ETH 節點查詢 transactionIndex 時使用）
+# 兩個 32 bytes 的 hash 以 (N, 32) 的 uint8 陣列保存、log index 為 int64，每筆只需要 72 bytes，且不需要再以 str.split 切字串
+# 每個 Id 另有一個 64 位元的 key，HashIndex 以此做 O(1) 查詢及 equi-join；只有在顯示或輸出（例如 JSON-RPC 的參數）時才轉回 16 進位字串
+
+HASH_BYTES = 32
+
+# 一個 hash 的字串長度（"0x" + 64 個 16 進位字元）
+HASH_CHARS = 2 + 2 * HASH_BYTES
+
+# Id 中第二段 hash 及 log index 的起點
+TX_HASH_OFFSET = HASH_CHARS + 1
+LOG_INDEX_OFFSET = 2 * HASH_CHARS + 2
+
+# 16 進位字元（ASCII）→ 數值的對照表，其他字元為 255
+HEX_VALUES = np.full(256, 255, dtype='uint8')
+for value, char in enumerate('0123456789abcdef'):
+    HEX_VALUES[ord(char)] = value
+    HEX_VALUES[ord(char.upper())] = value
+
+HEX_CHARS = np.frombuffer(b'0123456789abcdef', dtype='uint8')
+
+# 副程式：將字串轉為 (N, 寬度) 的 ASCII uint8 陣列（較短的字串後方補 0）
+def ascii_matrix(strings):
+    strings = pd.Series(strings, dtype=object).to_numpy()
+    if len(strings) == 0:
+        return np.zeros((0, 0), dtype='uint8')
+    raw = strings.astype('S')
+    return raw.view('uint8').reshape(len(strings), raw.dtype.itemsize)
+
+# 副程式：將 (N, 64) 的 16 進位字元轉為 (N, 32) 的 uint8
+def decode_hex(chars):
+    values = HEX_VALUES[chars]
+    if (values == 255).any():
+        raise ValueError("Invalid hex string")
+    return values[:, 0::2] << 4 | values[:, 1::2]
+
+# 副程式：將 (N, 32) 的 uint8 轉為 "0x..." 的 16 進位字串陣列
+def encode_hex(hashes):
+    chars = np.empty((len(hashes), HASH_CHARS), dtype='uint8')
+    chars[:, 0], chars[:, 1] = ord('0'), ord('x')
+    chars[:, 2::2] = HEX_CHARS[hashes >> 4]
+    chars[:, 3::2] = HEX_CHARS[hashes & 0x0f]
+    return chars.view(f'S{HASH_CHARS}').ravel().astype(str)
+
+# 副程式：將 "0x..." 的 hash 字串（例如 tx hash）轉為 (N, 32) 的 uint8
+def parse_hashes(hex_strings):
+    chars = ascii_matrix(hex_strings)
+    if len(chars) == 0:
+        return np.zeros((0, HASH_BYTES), dtype='uint8')
+    if chars.shape[1] != HASH_CHARS or (chars[:, 0] != ord('0')).any() or (chars[:, 1] != ord('x')).any():
+        raise ValueError("Invalid hash")
+    return decode_hex(chars[:, 2:])
+
+# 副程式：以 hash 的前 8 bytes 作為 64 位元的 key（hash 本身已是均勻分布的亂數）
+def hash_keys(hashes):
+    return np.ascontiguousarray(hashes[:, :8]).view('<u8').ravel()
+
+# 一組 Tokenlon 交易 Id 的二進位表示，欄位都是依原本順序排列的 NumPy 陣列
+class TradeIds:
+    def __init__(self, order_hashes, tx_hashes, log_indices):
+        self.order_hashes = order_hashes
+        self.tx_hashes = tx_hashes
+        self.log_indices = log_indices
+        self._keys = None
+
+    def __len__(self):
+        return len(self.log_indices)
+
+    # 取出部份的 Id（positions 為位置陣列或 slice）
+    def take(self, positions):
+        return TradeIds(self.order_hashes[positions], self.tx_hashes[positions], self.log_indices[positions])
+
+    # 每個 Id 的 64 位元 key（兩個 hash 的前 8 bytes 及 log index 組合而成，只計算一次）
+    def keys(self):
+        if self._keys is None:
+            self._keys = hash_keys(self.order_hashes) * np.uint64(1000003) ^ hash_keys(self.tx_hashes) ^ self.log_indices.astype('uint64')
+        return self._keys
+
+    # tx hash 的 16 進位字串（JSON-RPC 的參數）
+    def tx_hex(self):
+        return encode_hex(self.tx_hashes)
+
+    # 轉回原本的 Id 字串（輸出時使用）
+    def to_strings(self):
+        return pd.Series(encode_hex(self.order_hashes), dtype=object) + '-' + encode_hex(self.tx_hashes) + '-' + self.log_indices.astype(str)
+
+    # 與 other 中相同位置的 Id 是否完全相同（逐 byte 比較，用來排除 key 的碰撞）
+    def equals_at(self, positions, other, other_positions):
+        return ((self.order_hashes[positions] == other.order_hashes[other_positions]).all(axis=1)
+                & (self.tx_hashes[positions] == other.tx_hashes[other_positions]).all(axis=1)
+                & (self.log_indices[positions] == other.log_indices[other_positions]))
+
+# 副程式：將 Id 字串解析為 TradeIds，所有 Id 一次以向量化計算，不需要逐筆切字串
+def parse(ids):
+    chars = ascii_matrix(ids)
+    if len(chars) == 0:
+        return TradeIds(np.zeros((0, HASH_BYTES), dtype='uint8'), np.zeros((0, HASH_BYTES), dtype='uint8'), np.zeros(0, dtype='int64'))
+    if chars.shape[1] <= LOG_INDEX_OFFSET:
+        raise ValueError("Invalid trade Id")
+    separators = (chars[:, HASH_CHARS] == ord('-')) & (chars[:, LOG_INDEX_OFFSET - 1] == ord('-'))
+    prefixes = ((chars[:, 0] == ord('0')) & (chars[:, 1] == ord('x'))
+                & (chars[:, TX_HASH_OFFSET] == ord('0')) & (chars[:, TX_HASH_OFFSET + 1] == ord('x')))
+    if not (separators & prefixes).all():
+        raise ValueError("Invalid trade Id")
+    order_hashes = decode_hex(chars[:, 2:HASH_CHARS])
+    tx_hashes = decode_hex(chars[:, TX_HASH_OFFSET + 2:TX_HASH_OFFSET + HASH_CHARS])
+    # log index 為最後一段的十進位數字（較短的 Id 後方補 0，遇到 0 即結束）
+    digits = chars[:, LOG_INDEX_OFFSET:]
+    present = digits != 0
+    if not present[:, 0].all() or ((digits < ord('0')) | (digits > ord('9')))[present].any() or (present[:, 1:] & ~present[:, :-1]).any():
+        raise ValueError("Invalid trade Id")
+    log_indices = np.zeros(len(chars), dtype='int64')
+    for column in range(digits.shape[1]):
+        log_indices = np.where(present[:, column], log_indices * 10 + (digits[:, column].astype('int64') - ord('0')), log_indices)
+    return TradeIds(order_hashes, tx_hashes, log_indices)
+
+# 副程式：合併多組 TradeIds
+def concat(parts):
+    parts = list(parts)
+    if not parts:
+        return parse([])
+    return TradeIds(np.concatenate([part.order_hashes for part in parts]),
+                    np.concatenate([part.tx_hashes for part in parts]),
+                    np.concatenate([part.log_indices for part in parts]))
+
+# 副程式：逐天讀取資料集的 Id 欄位並解析，同一時間只有一天的 Id 字串在記憶體中；參數同 storage.iter_dataset()
+def load(csv_file_path, start=None, end=None, filters=None):
+    if not storage.exists(csv_file_path):
+        return parse([])
+    return concat(parse(day_data['Id']) for day_data in storage.iter_dataset(csv_file_path, ['Id'], start, end, filters))
+
+# 以 64 位元 key 建立的 hash 索引（pandas Index 的 hash table），查詢每個 key 的位置為 O(1)
+class HashIndex:
+    def __init__(self, keys):
+        self.index = pd.Index(np.asarray(keys, dtype='uint64'))
+        if not self.index.is_unique:
+            raise ValueError("Duplicate keys in hash index")
+
+    def __len__(self):
+        return len(self.index)
+
+    # 查詢一個 key 的位置，不存在時為 -1
+    def get(self, key):
+        return int(self.lookup(np.array([key], dtype='uint64'))[0])
+
+    # 查詢多個 key 的位置，不存在時為 -1
+    def lookup(self, keys):
+        return self.index.get_indexer(np.asarray(keys, dtype='uint64'))
+
+# 副程式：以 Id 做 equi-join，回傳兩邊相同的 Id 各自的位置 (left_positions, right_positions)，依 left 的順序排列
+# right 的 Id 不可重複；以 key 找到後再逐 byte 比較，key 碰撞時不會配對錯誤
+def join(left, right, right_index=None):
+    if right_index is None:
+        right_index = HashIndex(right.keys())
+    positions = right_index.lookup(left.keys())
+    left_positions = np.flatnonzero(positions >= 0)
+    right_positions = positions[left_positions]
+    same = left.equals_at(left_positions, right, right_positions)
+    return left_positions[same], right_positions[same]
+
+# 副程式：left 中不在 right 的 Id 的位置（anti-join）
+def missing(left, right, right_index=None):
+    left_positions, right_positions = join(left, right, right_index)
+    mask = np.ones(len(left), dtype=bool)
+    mask[left_positions] = False
+    return np.flatnonzero(mask)
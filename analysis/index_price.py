@@ -1,12 +1,19 @@
 # brew install python3
 # 將 export PATH="$PATH:/Users/irara/Library/Python/3.9/bin" 加入至 ~/.zshrc
-# pip3 install pycoingecko matplotlib pandas python-dotenv
+# pip3 install pycoingecko matplotlib pandas pyarrow python-dotenv
 
 # Import 所需套件
 import datetime
-import pandas as pd
+import os
+import instrument
+import pairs
+import reference
+import refresh
+import timerange
 import utils
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# 直接執行此檔案時會同時更新所有資料來源後繪圖；cli.py 的 fetch / analyze / plot 指令也使用這裡的副程式
 
 ########################################
 #             CoinGecko API            #
@@ -18,16 +25,18 @@ coin_csv_file_path = {
     'bitcoin': './data/btc_usd_price.csv'
 }
 
-for coin, csv_file_path in coin_csv_file_path.items():
+# 副程式：更新單一 coin 的 CoinGecko 價格
+def refresh_coingecko(coin):
+    csv_file_path = coin_csv_file_path[coin]
     # 如果 CSV 檔案不存在，則從 CoinGecko API 取得資料後存入 csv
     if not utils.check_csv_file(csv_file_path):
         coin_price = utils.get_coingecko_price(coin)
-        coin_price.to_csv(csv_file_path, index=False)
+        utils.write_data(csv_file_path, coin_price)
 
-    # 從 CSV 中取得最後的 Timestamp（含毫秒），並計算與 now 的時間差
+    # 取得最後的 Timestamp（寫入時已由毫秒轉為秒），並計算與 now 的時間差
     last_timestamp = utils.get_last_time(csv_file_path)
-    time_diff = datetime.now() - datetime.fromtimestamp(last_timestamp / 1000.0)
-        
+    time_diff = datetime.now() - datetime.fromtimestamp(last_timestamp)
+
     # 如果超過 1 小時，表示 CSV 檔太舊，需將 CSV 檔更新
     if time_diff.total_seconds() > 3600:
         # 從 CoinGecko API 取得資料
@@ -39,35 +48,30 @@ for coin, csv_file_path in coin_csv_file_path.items():
 ########################################
 
 tokenlon_subgraph_file_path = './data/tokenlon_subgraph.csv'
+# 記錄回補進度的游標檔，回補中斷時會留下此檔，下次執行即可從中斷處繼續
+tokenlon_subgraph_cursor_path = './data/tokenlon_subgraph.cursor.json'
+
+# 副程式：更新 Tokenlon Subgraph 資料
+def refresh_tokenlon():
+    # 如果 CSV 檔案不存在（或上次回補尚未完成），則從 Tokenlon Subgraph 取得資料後存入 csv
+    if not utils.check_csv_file(tokenlon_subgraph_file_path) or os.path.exists(tokenlon_subgraph_cursor_path):
+        # 計算 90 天前的 timestamp
+        days_90_timestamp = int((datetime.now() - timedelta(days=90)).timestamp())
+        # 以游標逐頁取出資料，每頁成本固定，不受 The Graph 前 6000 筆的限制
+        # 每頁都已依 Timestamp 合併排序，逐頁寫入新的 partition 即可
+        for subgraph_data in utils.iter_tokenlon_pages(days_90_timestamp, tokenlon_subgraph_cursor_path):
+            utils.write_data(tokenlon_subgraph_file_path, subgraph_data)
+
+    # 從 CSV 中取得最後的 Timestamp（不含毫秒），並計算與 now 的時間差
+    last_timestamp = utils.get_last_time(tokenlon_subgraph_file_path)
+    time_diff = datetime.now() - datetime.fromtimestamp(last_timestamp)
 
-# 如果 CSV 檔案不存在，則從 Tokenlon Subgraph 取得資料後存入 csv
-if not utils.check_csv_file(tokenlon_subgraph_file_path):
-    # 因為 The Graph 一次最多只能取前 1000 筆資料
-    # 所以設定 skip = 0 ~ 5000 的值，並將執行 6 次的結果寫入 CSV 中
-    for i in range(5000,-1,-1000):
-        subgraph_data = utils.get_tokenlon_data(i)
-        if utils.check_csv_file(tokenlon_subgraph_file_path):
-            # 如第二次之後寫入 CSV，就不需要將像是 Id, Timestamp 等 Header 資料寫入 CSV
-            subgraph_data.to_csv(tokenlon_subgraph_file_path, mode='a', header=False, index=False)
-        else:
-            # 如果第一次寫入 CSV，則需要有像是 Id, Timestamp 等 Header 資料
-            subgraph_data.to_csv(tokenlon_subgraph_file_path, index=False)
-
-    # 因為 The Graph 的讀取是拆成 6 次執行，將 CSV 檔整個重新以 Timestamp 作排序
-    # 否則中間 Timestamp 若不連續，會導致畫出來的圖不會正確
-    tokenlon_subgraph_data_csv = pd.read_csv(tokenlon_subgraph_file_path, parse_dates=False)
-    tokenlon_subgraph_data_csv = tokenlon_subgraph_data_csv.sort_values(by="Timestamp", ascending=True)
-    tokenlon_subgraph_data_csv.to_csv(tokenlon_subgraph_file_path, index=False)
-
-# 從 CSV 中取得最後的 Timestamp（不含毫秒），並計算與 now 的時間差
-last_timestamp = utils.get_last_time(tokenlon_subgraph_file_path)
-time_diff = datetime.now() - datetime.fromtimestamp(last_timestamp)
-
-# 如果超過 1 小時，表示 CSV 檔太舊，需將 CSV 檔更新
-if time_diff.total_seconds() > 3600:
-    # 從 Tokenlon Subgraph 取得資料
-    subgraph_data = utils.get_tokenlon_data(0) # skip = 0
-    utils.update_csv(tokenlon_subgraph_file_path, subgraph_data)
+    # 如果超過 1 小時，表示 CSV 檔太舊，需將 CSV 檔更新
+    if time_diff.total_seconds() > 3600:
+        # 從最後的 Timestamp 開始逐頁取出所有新資料，不會只取到前 1000 筆
+        # 每頁都已依 Timestamp 排序，可以直接逐頁加入至 CSV 中
+        for subgraph_data in utils.iter_tokenlon_pages(last_timestamp):
+            utils.update_csv(tokenlon_subgraph_file_path, subgraph_data)
 
 ########################################
 #          Uniswap V3 Subgraph         #
@@ -75,174 +79,141 @@ if time_diff.total_seconds() > 3600:
 
 uniswap3_subgraph_file_path = './data/uniswap3_subgraph.csv'
 
-# # 如果 CSV 檔案不存在，則從 Uniswap V3 Subgraph 取得資料後存入 csv
-# if not utils.check_csv_file(uniswap3_subgraph_file_path):
-#     subgraph_data = utils.get_uniswap3_data()
-#     subgraph_data.to_csv(uniswap3_subgraph_file_path, index=False)
-
-# 如果 CSV 檔案不存在，則從 Tokenlon Subgraph 取得資料後存入 csv
-if not utils.check_csv_file(uniswap3_subgraph_file_path):
-    # 因為 The Graph 一次最多只能取前 1000 筆資料
-    # 所以設定 skip = 0 ~ 5000 的值，並將執行 6 次的結果寫入 CSV 中
-    for i in range(5000,-1,-1000):
-        subgraph_data = utils.get_uniswap3_data(i)
-        if utils.check_csv_file(uniswap3_subgraph_file_path):
-            # 如第二次之後寫入 CSV，就不需要將像是 Id, Timestamp 等 Header 資料寫入 CSV
-            subgraph_data.to_csv(uniswap3_subgraph_file_path, mode='a', header=False, index=False)
-        else:
-            # 如果第一次寫入 CSV，則需要有像是 Id, Timestamp 等 Header 資料
-            subgraph_data.to_csv(uniswap3_subgraph_file_path, index=False)
-
-    # 因為 The Graph 的讀取是拆成 6 次執行，將 CSV 檔整個重新以 Timestamp 作排序
-    # 否則中間 Timestamp 若不連續，會導致畫出來的圖不會正確
-    uniswap3_subgraph_data_csv = pd.read_csv(uniswap3_subgraph_file_path, parse_dates=False)
-    uniswap3_subgraph_data_csv = uniswap3_subgraph_data_csv.sort_values(by="Timestamp", ascending=True)
-    uniswap3_subgraph_data_csv.to_csv(uniswap3_subgraph_file_path, index=False)
-
-# 從 CSV 中取得最後的 Timestamp（不含毫秒），並計算與 now 的時間差
-last_timestamp = utils.get_last_time(uniswap3_subgraph_file_path)
-time_diff = datetime.now() - datetime.fromtimestamp(last_timestamp)
+# 副程式：更新 Uniswap V3 Subgraph 資料
+def refresh_uniswap3():
+    # # 如果 CSV 檔案不存在，則從 Uniswap V3 Subgraph 取得資料後存入 csv
+    # if not utils.check_csv_file(uniswap3_subgraph_file_path):
+    #     subgraph_data = utils.get_uniswap3_data()
+    #     utils.write_data(uniswap3_subgraph_file_path, subgraph_data)
+
+    # 如果 CSV 檔案不存在，則從 Tokenlon Subgraph 取得資料後存入 csv
+    if not utils.check_csv_file(uniswap3_subgraph_file_path):
+        # 因為 The Graph 一次最多只能取前 1000 筆資料
+        # 所以設定 skip = 0 ~ 5000 的值，並將執行 6 次的結果寫入資料庫中
+        # 讀取時會依 Timestamp 排序，因此不需要再整個重新排序
+        for i in range(5000,-1,-1000):
+            subgraph_data = utils.get_uniswap3_data(i)
+            utils.write_data(uniswap3_subgraph_file_path, subgraph_data)
+
+    # 從 CSV 中取得最後的 Timestamp（不含毫秒），並計算與 now 的時間差
+    last_timestamp = utils.get_last_time(uniswap3_subgraph_file_path)
+    time_diff = datetime.now() - datetime.fromtimestamp(last_timestamp)
 
-# 如果超過 1 小時，表示 CSV 檔太舊，需將 CSV 檔更新
-if time_diff.total_seconds() > 3600:
-    # 從 Uniswap V3 Subgraph 取得資料
-    subgraph_data = utils.get_uniswap3_data(0) # skip = 0
-    utils.update_csv(uniswap3_subgraph_file_path, subgraph_data)
+    # 如果超過 1 小時，表示 CSV 檔太舊，需將 CSV 檔更新
+    if time_diff.total_seconds() > 3600:
+        # 從 Uniswap V3 Subgraph 取得資料
+        subgraph_data = utils.get_uniswap3_data(0) # skip = 0
+        utils.update_csv(uniswap3_subgraph_file_path, subgraph_data)
+
+# 資料來源名稱
+SOURCES = ['coingecko', 'tokenlon', 'uniswap3']
+
+# 副程式：更新 sources 中的資料來源（各來源的同時執行數量及逾時時間設定在 refresh.py），回傳各工作的結果
+# 參考價格（CoinGecko、Uniswap V3）先同時更新完，再更新 Tokenlon，寫入 Tokenlon 資料時彙總表（cube.py）就能計算新交易的偏離程度
+def refresh_all(sources=SOURCES):
+    reference_jobs = []
+    if 'coingecko' in sources:
+        reference_jobs += [('coingecko', f'coingecko.{coin}', refresh_coingecko, (coin,)) for coin in coin_csv_file_path]
+    if 'uniswap3' in sources:
+        reference_jobs.append(('uniswap3', 'uniswap3', refresh_uniswap3, ()))
+    results = refresh.run(reference_jobs) if reference_jobs else {}
+    if 'tokenlon' in sources:
+        results.update(refresh.run([('tokenlon', 'tokenlon', refresh_tokenlon, ())]))
+    return results
 
 ########################################
 #                 Plot                 #
 ########################################
 
-# 賣 BTC 的賣價
-coin = 'bitcoin'
-target = 'tether'
+# 只保留大於此 USDT 數量的大單
+min_quote_amount = {
+    'ethereum': 5000,
+}
 
-# 買 BTC 的買價
-# coin = 'tether'
-# target = 'bitcoin'
+# 副程式：讀取分析所需的資料，回傳交易對索引、CoinGecko 價格及 Uniswap V3 資料
+# time_range 為 (start, end) 時，只讀取該範圍內的日期資料夾（見 timerange.resolve()）；參考價格資料量小，仍全部讀取以對應範圍邊緣的交易
+# reference_priority 為參考價格來源的優先順序，例如 ['uniswap3', 'coingecko']（見 reference.SOURCES），預設以 CoinGecko 為主
+def load_analysis_data(time_range=None, reference_priority=None, trading_pairs=None):
+    with instrument.stage('load'):
+        start, end = timerange.resolve(time_range, utils.get_last_time(tokenlon_subgraph_file_path))
+        # 指定 trading_pairs（[(base, quote), ...]）時，讀取時就只保留這些交易對（兩個方向）的交易
+        filters = None if trading_pairs is None else [conjunction for base, quote in trading_pairs for conjunction in pairs.pair_filters(base, quote)]
+        # 取出 Tokenlon Subgraph 資料（Timestamp 到秒，MakerToken 和 TakerToken 寫入時已全換成小寫，讀取時為 categorical）
+        subgraph_data_csv = utils.load_data(tokenlon_subgraph_file_path, start=start, end=end, filters=filters)
+        # 建立一次以交易對分組的索引（ETH 與 WETH 視為同一個 Token），之後取出任何交易對都只需要該組的資料
+        pair_index = pairs.PairIndex(subgraph_data_csv)
+
+        # 取出 Uniswap V3 Subgraph 資料
+        uniswap3_subgraph_data_csv = utils.load_data(uniswap3_subgraph_file_path, start=start, end=end)
+
+        # 取出各 coin 的參考價格（CoinGecko 為主、缺資料時改用 Uniswap V3，已合併至共同的時間格點並快取）
+        coin_data_csv = {coin_name: reference.series(coin_name, os.path.dirname(csv_file_path), reference_priority).frame() for coin_name, csv_file_path in coin_csv_file_path.items()}
+    return pair_index, coin_data_csv, uniswap3_subgraph_data_csv
+
+# 副程式：取得所有 Taker 用 coin 換 USDT 的資料（賣 coin 的賣價），及用 USDT 換 coin 的資料（買 coin 的買價），並加入 CoingeckoPrice 欄位
+# time_range 指定時只保留該範圍內的交易（以二分搜尋取出，不複製資料）
+def sell_buy_trades(pair_index, coin_data_csv, coin, time_range=None):
+    with instrument.stage('analyze'):
+        sell_coin = pair_index.priced_trades(coin, 'tether', 'sell', min_quote_amount.get(coin))
+        buy_coin = pair_index.priced_trades(coin, 'tether', 'buy', min_quote_amount.get(coin))
+        start, end = utils.resolve_time_range(time_range, sell_coin, buy_coin)
+        sell_coin = timerange.view(sell_coin, start, end)
+        buy_coin = timerange.view(buy_coin, start, end)
+        # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
+        sell_coin = utils.add_nearest_price_column(coin_data_csv[coin], sell_coin)
+        buy_coin = utils.add_nearest_price_column(coin_data_csv[coin], buy_coin)
+    return sell_coin, buy_coin
+
+# 副程式：繪製 coin-target 的價格圖表，time_range 為顯示範圍（見 timerange.resolve()），reference_priority 見 load_analysis_data()
+def plot(coin, target, time_range=utils.plot_time_range, reference_priority=None):
+    # 相對的天數以最新的交易為準，因此整個讀取；指定日期時只讀取該範圍
+    base = coin if target == 'tether' else target
+    pair_index, coin_data_csv, uniswap3_subgraph_data_csv = load_analysis_data(None if isinstance(time_range, (int, float)) else time_range, reference_priority, [(base, 'tether')])
+
+    # ------------------------------
+
+    if target == 'tether':
+        sell_coin, buy_coin = sell_buy_trades(pair_index, coin_data_csv, coin, time_range)
+        # utils.over_n_std_to_df(buy_coin).to_csv('./playground/over_n_std_to_df.csv', index=False)
+        # 繪製（與原本相同：BTC 使用 plotMove2，ETH 使用 plotMove3）
+        if coin == 'bitcoin':
+            utils.plotMove2(f'{coin}-{target}', coin_data_csv[coin], sell_coin, buy_coin, time_range)
+        else:
+            # utils.plotMove2(f'{coin}-{target}', coin_data_csv[coin], sell_coin, buy_coin)
+            # utils.plotMove2(f'{coin}-{target}', uniswap3_subgraph_data_csv, sell_coin, buy_coin)
+            utils.plotMove3(f'{coin}-{target}', coin_data_csv[coin], sell_coin, buy_coin, time_range)
 
-# 賣 ETH 的賣價
-coin = 'ethereum'
-target = 'tether'
+    # ------------------------------
 
-# 買 ETH 的買價
-# coin = 'tether'
-# target = 'ethereum'
+    # 單一方向的價格圖表（以 target 是否為 tether 判斷是賣價還是買價）：
+    # plot_raw_data = pair_index.priced_trades(base, 'tether', 'sell' if target == 'tether' else 'buy')
+    # plot_raw_data = utils.add_nearest_price_column(coin_data_csv[base], plot_raw_data)
+    # utils.plotMove(f'{coin}-{target}', plot_raw_data[['Timestamp', 'Price', 'CoingeckoPrice']], time_range)
 
+if __name__ == '__main__':
+    # 程式結束時將各階段耗時、請求次數及快取命中率寫入 ./data/reports
+    instrument.enable()
 
-# 設定 coin 的小數點位數
-coin_decimals = {
-    'tether': 6,
-    'ethereum': 18,
-    'bitcoin': 8,
-}
+    refresh_all()
+
+    # 賣 BTC 的賣價
+    coin = 'bitcoin'
+    target = 'tether'
+
+    # 買 BTC 的買價
+    # coin = 'tether'
+    # target = 'bitcoin'
+
+    # 賣 ETH 的賣價
+    coin = 'ethereum'
+    target = 'tether'
+
+    # 買 ETH 的買價
+    # coin = 'tether'
+    # target = 'ethereum'
+
+    # 顯示範圍：日期字串的 (start, end)，或是到最新一筆交易為止的最近 N 天
+    time_range = ("2023/03/20 00:00:00+0800", "2023/03/23 00:00:00+0800")
+    # time_range = 3
 
-# 從 Tokenlon Subgraph CSV 取出 subgraph 資料（Timestamp 到秒）
-subgraph_data_csv = pd.read_csv(tokenlon_subgraph_file_path, parse_dates=False)
-# 將 MakerToken 和 TakerToken 資料全換成小寫，以利後續取出所需的資料
-subgraph_data_csv = subgraph_data_csv.assign(MakerToken=subgraph_data_csv['MakerToken'].str.lower(), TakerToken=subgraph_data_csv['TakerToken'].str.lower())
-
-# 從 Uniswap V3 Subgraph CSV 取出 subgraph 資料
-uniswap3_subgraph_data_csv = pd.read_csv(uniswap3_subgraph_file_path, parse_dates=False)
-
-# 從 CoinGecko CSV 取出 ETH-USD 資料（Timestamp 到毫秒）
-eth_data_csv = pd.read_csv(coin_csv_file_path['ethereum'], parse_dates=False)
-eth_data_csv['Timestamp'] = eth_data_csv['Timestamp'] / 1000
-
-# 從 CoinGecko CSV 取出 BTC-USD 資料（Timestamp 到毫秒）
-btc_data_csv = pd.read_csv(coin_csv_file_path['bitcoin'], parse_dates=False)
-btc_data_csv['Timestamp'] = btc_data_csv['Timestamp'] / 1000
-
-# ------------------------------
-
-if coin == 'bitcoin' and target == 'tether':
-    # 取得所有 Taker 用 WBTC 換 USDT 的資料（賣 BTC 的賣價）
-    btc_usdt_condition = (subgraph_data_csv["MakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7") & (subgraph_data_csv["TakerToken"] == "0x2260fac5e5542a773aa44fbcfedf7c193bc2c599")
-    sell_btc = subgraph_data_csv[btc_usdt_condition]
-    # 在這個 DF 新增一個 Price 欄位，並且儲存用 MakerAmount / TakerAmount 計算的 Price 值
-    sell_btc = sell_btc.assign(Price=(sell_btc["MakerAmount"].astype(float) / 10 ** coin_decimals[target] ) /  ( sell_btc["TakerAmount"].astype(float) / 10 ** coin_decimals[coin] ))
-    # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
-    plot_raw_data = utils.add_nearest_price_column(btc_data_csv, sell_btc)
-
-if coin == 'tether' and target == 'bitcoin':
-    # 取得所有 Taker 用 WBTC 換 USDT 的資料（買 BTC 的買價）
-    usdt_btc_condition = (subgraph_data_csv["MakerToken"] == "0x2260fac5e5542a773aa44fbcfedf7c193bc2c599") & (subgraph_data_csv["TakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7")
-    buy_btc = subgraph_data_csv[usdt_btc_condition]
-    # 在這個 DF 新增一個 Price 欄位，並且儲存用 MakerAmount / TakerAmount 計算的 Price 值
-    buy_btc = buy_btc.assign(Price=(buy_btc["TakerAmount"].astype(float) / 10 ** coin_decimals[coin] ) /  ( buy_btc["MakerAmount"].astype(float) / 10 ** coin_decimals[target] ))
-    # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
-    plot_raw_data = utils.add_nearest_price_column(btc_data_csv, buy_btc)
-
-if coin == 'ethereum' and target == 'tether':
-    # 取得所有 Taker 用 ETH、WETH 換 USDT 的資料（賣 ETH 的賣價）
-    eth_usdt_condition_1 = (subgraph_data_csv["MakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7") & (subgraph_data_csv["TakerToken"] == "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2")
-    eth_usdt_condition_2 = (subgraph_data_csv["MakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7") & (subgraph_data_csv["TakerToken"] == "0x0000000000000000000000000000000000000000")
-    sell_eth = subgraph_data_csv[eth_usdt_condition_1 | eth_usdt_condition_2]
-    # 在這個 DF 新增一個 Price 欄位，並且儲存用 MakerAmount / TakerAmount 計算的 Price 值
-    sell_eth = sell_eth.assign(Price=(sell_eth["MakerAmount"].astype(float) / 10 ** coin_decimals[target] ) /  ( sell_eth["TakerAmount"].astype(float) / 10 ** coin_decimals[coin] ))
-    # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
-    plot_raw_data = utils.add_nearest_price_column(eth_data_csv, sell_eth)
-
-if coin == 'tether' and target == 'ethereum':
-    # 取得所有 Taker 用 USDT 換 ETH、WETH 的資料（買 ETH 的買價）
-    usdt_eth_condition_1 = (subgraph_data_csv["MakerToken"] == "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2") & (subgraph_data_csv["TakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7")
-    usdt_eth_condition_2 = (subgraph_data_csv["MakerToken"] == "0x0000000000000000000000000000000000000000") & (subgraph_data_csv["TakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7")
-    buy_eth = subgraph_data_csv[usdt_eth_condition_1 | usdt_eth_condition_2]
-    # 在這個 DF 新增一個 Price 欄位，並且儲存用 TakerAmount / MakerAmount 計算的 Price 值
-    buy_eth = buy_eth.assign(Price=(buy_eth["TakerAmount"].astype(float) / 10 ** coin_decimals[coin] ) /  ( buy_eth["MakerAmount"].astype(float) / 10 ** coin_decimals[target] ))
-    # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
-    plot_raw_data = utils.add_nearest_price_column(eth_data_csv, buy_eth)
-
-if coin == 'bitcoin' and target == 'tether':
-    # 取得所有 Taker 用 WBTC 換 USDT 的資料（賣 BTC 的賣價）
-    btc_usdt_condition = (subgraph_data_csv["MakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7") & (subgraph_data_csv["TakerToken"] == "0x2260fac5e5542a773aa44fbcfedf7c193bc2c599")
-    sell_btc = subgraph_data_csv[btc_usdt_condition]
-    # 在這個 DF 新增一個 Price 欄位，並且儲存用 MakerAmount / TakerAmount 計算的 Price 值
-    sell_btc = sell_btc.assign(Price=(sell_btc["MakerAmount"].astype(float) / 10 ** coin_decimals[target] ) /  ( sell_btc["TakerAmount"].astype(float) / 10 ** coin_decimals[coin] ))
-    # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
-    sell_btc = utils.add_nearest_price_column(btc_data_csv, sell_btc)
-
-    # 取得所有 Taker 用 WBTC 換 USDT 的資料（買 BTC 的買價）
-    usdt_btc_condition = (subgraph_data_csv["MakerToken"] == "0x2260fac5e5542a773aa44fbcfedf7c193bc2c599") & (subgraph_data_csv["TakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7")
-    buy_btc = subgraph_data_csv[usdt_btc_condition]
-    # 在這個 DF 新增一個 Price 欄位，並且儲存用 MakerAmount / TakerAmount 計算的 Price 值
-    buy_btc = buy_btc.assign(Price=(buy_btc["TakerAmount"].astype(float) / 10 ** coin_decimals[target] ) /  ( buy_btc["MakerAmount"].astype(float) / 10 ** coin_decimals[coin] ))
-    # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
-    plot_raw_data = utils.add_nearest_price_column(btc_data_csv, buy_btc)
-    # 繪製
-    utils.plotMove2(f'{coin}-{target}', btc_data_csv, sell_btc, buy_btc)
-
-if coin == 'ethereum' and target == 'tether':
-    # 取得所有 Taker 用 ETH、WETH 換 USDT 的資料（賣 ETH 的賣價）
-    eth_usdt_condition_1 = (subgraph_data_csv["MakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7") & (subgraph_data_csv["TakerToken"] == "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2")
-    eth_usdt_condition_2 = (subgraph_data_csv["MakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7") & (subgraph_data_csv["TakerToken"] == "0x0000000000000000000000000000000000000000")
-    sell_eth = subgraph_data_csv[eth_usdt_condition_1 | eth_usdt_condition_2]
-    # 篩出大於 5000 USDT 的大單
-    sell_eth = sell_eth[sell_eth["MakerAmount"].astype(float) > 5000 * 10 ** coin_decimals[target]]
-    # 在這個 DF 新增一個 Price 欄位，並且儲存用 MakerAmount / TakerAmount 計算的 Price 值
-    sell_eth = sell_eth.assign(Price=(sell_eth["MakerAmount"].astype(float) / 10 ** coin_decimals[target] ) /  ( sell_eth["TakerAmount"].astype(float) / 10 ** coin_decimals[coin] ))
-    # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
-    sell_eth = utils.add_nearest_price_column(eth_data_csv, sell_eth)
-    
-    # 取得所有 Taker 用 USDT 換 ETH、WETH 的資料（買 ETH 的買價）
-    usdt_eth_condition_1 = (subgraph_data_csv["MakerToken"] == "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2") & (subgraph_data_csv["TakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7")
-    usdt_eth_condition_2 = (subgraph_data_csv["MakerToken"] == "0x0000000000000000000000000000000000000000") & (subgraph_data_csv["TakerToken"] == "0xdac17f958d2ee523a2206206994597c13d831ec7")
-    buy_eth = subgraph_data_csv[usdt_eth_condition_1 | usdt_eth_condition_2]
-    # 篩出大於 5000 USDT 的大單
-    buy_eth = buy_eth[buy_eth["TakerAmount"].astype(float) > 5000 * 10 ** coin_decimals[target]]
-    # 在這個 DF 新增一個 Price 欄位，並且儲存用 TakerAmount / MakerAmount 計算的 Price 值
-    buy_eth = buy_eth.assign(Price=(buy_eth["TakerAmount"].astype(float) / 10 ** coin_decimals[target] ) /  ( buy_eth["MakerAmount"].astype(float) / 10 ** coin_decimals[coin] ))
-    # 在這個 DF 新增一個 CoingeckoPrice 欄位，用來儲存最靠近的市值
-    buy_eth = utils.add_nearest_price_column(eth_data_csv, buy_eth)
-    # utils.over_n_std_to_df(buy_eth).to_csv('./playground/over_n_std_to_df.csv', index=False)
-    # 繪製
-    # utils.plotMove2(f'{coin}-{target}', eth_data_csv, sell_eth, buy_eth)
-    # utils.plotMove2(f'{coin}-{target}', uniswap3_subgraph_data_csv, sell_eth, buy_eth)
-    utils.plotMove3(f'{coin}-{target}', eth_data_csv, sell_eth, buy_eth)
-
-# subgraph_data_eth_usdt.to_csv('./test/subgraph_data_eth_usdt.csv', index=False)
-
-# ------------------------------
-
-# plot_data = plot_raw_data[['Timestamp', 'Price', 'CoingeckoPrice']]
-# utils.plotMove(f'{coin}-{target}', plot_data)
\ No newline at end of file
+    plot(coin, target, time_range)
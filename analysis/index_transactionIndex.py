@@ -1,105 +1,130 @@
 import utils
+import ethrpc
+import ids
+import instrument
+import lazy
+import timerange
 import pandas as pd
-import os
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from web3 import Web3
-import matplotlib.pyplot as plt
+from datetime import datetime
+
+# 只在繪製直方圖時才載入 matplotlib
+plt = lazy.module('matplotlib.pyplot')
+
+# 直接執行此檔案時會更新 Tx Index 後繪製直方圖；cli.py 的 enrich-txindex 指令也使用這裡的副程式
 
 # 來源
 tokenlon_subgraph_file_path = './data/tokenlon_subgraph.csv'
 # 目的
 tokenlon_index_file_path = './data/tokenlon_transaction_index.csv'
-
-# 因為 tokenlon_subgraph_file 必須存在
-# 所以請先執行過「index_price.py」檔建立檔案後，再執行此程式
-if not utils.check_csv_file(tokenlon_subgraph_file_path):
-    raise ValueError("CSV file must be exist")
-
-# 從 .env 檔案取得 GRAPH_URL 參數
-load_dotenv()
-ETHEREUM_NODE_URL = os.getenv("ETHEREUM_NODE_URL")
-
-# 計算 days_n 天內的 Tx Index 值
-days_n = 3
-
-# 讀取已知的 Dataframe
-known_df = pd.read_csv(tokenlon_subgraph_file_path)
-# 從已知的Dataframe中選擇所需的列
-new_df = known_df.loc[:, ['Id', 'BlockNumber', 'Timestamp']]
-
-# 透過 Ethereum 節點取得此交易的交易 Index
-web3 = Web3(Web3.HTTPProvider(ETHEREUM_NODE_URL))
-def find_transaction_index(transactionHash):
-    # 透過交易哈希來獲取交易物件
-    tx = web3.eth.get_transaction(transactionHash)
-    print('向 ETH 節點取資料')
-    return tx["transactionIndex"]
-
-# tokenlon_index_file 如果存在就不用再去向 Ethereum 節點取值了
-if not utils.check_csv_file(tokenlon_index_file_path):
-    # 計算 days_n 天前的 timestamp
-    days_timestamp = int((datetime.now() - timedelta(days=days_n)).timestamp())
-    new_df = new_df[new_df['Timestamp'] > days_timestamp]
-    new_df = new_df.assign(Index=new_df['Id'].str.split('-').str[1].apply(find_transaction_index))
-    # 將新的DataFrame存儲為csv文件
-    new_df.to_csv(tokenlon_index_file_path, index=False)
-
-# 從 CSV 中取得最後的 Timestamp（不含毫秒），並計算與 now 的時間差
-last_timestamp = utils.get_last_time(tokenlon_index_file_path)
-time_diff = datetime.now() - datetime.fromtimestamp(last_timestamp)
-
-# 如果超過 1 小時，表示 CSV 檔太舊，需將 CSV 檔更新
-if time_diff.total_seconds() > 3600:
-    # 計算 days_n 天前的 timestamp
-    days_timestamp = int((datetime.now() - timedelta(days=days_n)).timestamp())
-    new_df = new_df[new_df['Timestamp'] > days_timestamp]
-    # 再篩出需要更新的部份
-    new_df = new_df[new_df['Timestamp'] > last_timestamp]
-    # 再將剩下的資料向 ETH 節點要取
-    new_df = new_df.assign(Index=new_df['Id'].str.split('-').str[1].apply(find_transaction_index))
-    # 最後將資料加入至 CSV 下方
-    new_df.to_csv(tokenlon_index_file_path, mode='a', header=False, index=False)
-
-# 從 CSV 中取得資料
-tokenlon_txIndex = pd.read_csv(tokenlon_index_file_path)
-
-# 計算 bins 的最大值
-max_txindex = tokenlon_txIndex['Index'].max()
-bins = list(range(0, max_txindex + 41, 40))
-
-# 將 TxIndex 按照 bins 分類
-txindex_counts = pd.cut(tokenlon_txIndex['Index'], bins=bins).value_counts()
-
-# 建立繪圖物件
-fig, ax = plt.subplots()
-# 設定子圖之間的間距，可以通過調整 bottom 參數增加底部的空白
-fig.subplots_adjust(bottom=0.2)
-
-# 繪製直方圖並標註數量
-plt.hist(tokenlon_txIndex['Index'], bins=bins)
-for i, count in enumerate(txindex_counts):
-    plt.text((bins[i] + bins[i+1])/2, count+1, str(count), ha='center')
-
-# 設置 X 軸刻度標籤
-bin_centers = [(bins[i] + bins[i+1])/2 for i in range(len(bins)-1)]
-bin_labels = [f'[{bins[i]}, {bins[i+1]})' for i in range(len(bins)-1)]
-plt.xticks(bin_centers, bin_labels)
-
-# 取出第一個及最後一個Timestamp
-# 首先取出第一個及最後一個Timestamp，並轉成datetime型別
-first_ts = pd.to_datetime(tokenlon_txIndex['Timestamp'].iloc[0], unit='s')
-last_ts = pd.to_datetime(tokenlon_txIndex['Timestamp'].iloc[-1], unit='s')
-
-# 將Timestamp格式轉成人類可讀的形式
-first_ts_str = first_ts.strftime('%Y-%m-%d')
-last_ts_str = last_ts.strftime('%Y-%m-%d')
-
-# 設置圖表標題及軸標籤
-plt.title(f'{first_ts_str} ~ {last_ts_str} TxIndex Info')
-plt.xticks(rotation=45, ha='right', rotation_mode='anchor', va='top')
-plt.xlabel('TxIndex')
-plt.ylabel('Count')
-
-# 顯示圖表
-plt.show()
+# tx hash → transactionIndex 的快取，已解析過的交易不會再向 ETH 節點要取
+tx_index_cache_path = './data/tx_index_cache.csv'
+
+# 每處理完 chunk_size 筆就寫入 CSV 一次，中斷後重新執行時只需補取 CSV 最後一筆之後的資料
+chunk_size = 500
+
+# 以 BlockNumber 為單位向 Ethereum 節點取得交易 Index（每個區塊只取一次），並分段加入至 CSV 下方
+# Id 只解析一次為二進位的 tx hash，送給 ETH 節點時才轉為 16 進位字串；head 為最新區塊高度（見 ethrpc.resolve_transaction_indices()）
+def append_transaction_index(data, node_url, tx_index_cache, head=None):
+    data = data.sort_values(by="Timestamp", ascending=True)
+    trade_ids = ids.parse(data['Id'])
+    for start in range(0, len(data), chunk_size):
+        chunk = data.iloc[start:start + chunk_size]
+        tx_hashes = trade_ids.take(slice(start, start + chunk_size)).tx_hex()
+        with instrument.stage('tx_index'):
+            chunk = chunk.assign(Index=ethrpc.resolve_transaction_indices(node_url, tx_hashes, chunk['BlockNumber'], tx_index_cache, tx_index_cache_path, head))
+        utils.write_data(tokenlon_index_file_path, chunk)
+
+# 副程式：取得 time_range 範圍內（預設為最近 3 天）Tokenlon 交易的 Tx Index 值，並加入至 tokenlon_index_file
+# time_range 見 timerange.resolve()，最近 N 天以現在時間為準
+def enrich_transaction_index(time_range=3):
+    # 因為 tokenlon_subgraph_file 必須存在
+    # 所以請先執行過「index_price.py」檔建立檔案後，再執行此程式
+    if not utils.check_csv_file(tokenlon_subgraph_file_path):
+        raise ValueError("CSV file must be exist")
+
+    # 從 .env 檔案取得 ETHEREUM_NODE_URL 參數
+    ETHEREUM_NODE_URL = utils.getenv("ETHEREUM_NODE_URL")
+
+    # 計算時間範圍的起訖 timestamp
+    start, end = timerange.resolve(time_range, int(datetime.now().timestamp()))
+
+    # 只讀取時間範圍內、所需的欄位
+    new_df = utils.load_data(tokenlon_subgraph_file_path, columns=['Id', 'BlockNumber', 'Timestamp'], start=start, end=end)
+
+    # 只處理已有 ethrpc.CONFIRMATIONS 個確認的區塊中的交易：較新的區塊可能因鏈重組而改變，下次執行時再取得
+    head = ethrpc.fetch_block_number(ETHEREUM_NODE_URL)
+    new_df = new_df[new_df['BlockNumber'].to_numpy(dtype='int64') <= head - ethrpc.CONFIRMATIONS]
+
+    # 讀取 tx hash → transactionIndex 的快取
+    tx_index_cache = ethrpc.load_tx_index_cache(tx_index_cache_path)
+
+    # tokenlon_index_file 如果存在就不用再去向 Ethereum 節點取值了
+    if not utils.check_csv_file(tokenlon_index_file_path):
+        # 將新的DataFrame存儲至資料庫
+        append_transaction_index(new_df, ETHEREUM_NODE_URL, tx_index_cache, head)
+
+    # 從 CSV 中取得最後的 Timestamp（不含毫秒），並計算與 now 的時間差
+    last_timestamp = utils.get_last_time(tokenlon_index_file_path)
+    time_diff = datetime.now() - datetime.fromtimestamp(last_timestamp)
+
+    # 如果超過 1 小時，表示 CSV 檔太舊，需將 CSV 檔更新
+    if time_diff.total_seconds() > 3600:
+        # 再以 Id 的 hash 索引取出還沒有 Tx Index 的交易（同一秒的多筆交易也不會遺失）
+        new_df = new_df.iloc[ids.missing(ids.parse(new_df['Id']), ids.load(tokenlon_index_file_path, start, end))]
+        # 再將剩下的資料向 ETH 節點要取，並將資料加入至 CSV 下方
+        append_transaction_index(new_df, ETHEREUM_NODE_URL, tx_index_cache, head)
+
+# 副程式：繪製 time_range 範圍內（預設為全部）Tx Index 的直方圖
+def plot_histogram(time_range=None):
+    with instrument.stage('histogram'):
+        # 從 CSV 中取得時間範圍內的資料，最近 N 天以最後一筆資料為準
+        start, end = timerange.resolve(time_range, utils.get_last_time(tokenlon_index_file_path))
+        tokenlon_txIndex = utils.load_data(tokenlon_index_file_path, start=start, end=end)
+
+        # 計算 bins 的最大值
+        max_txindex = tokenlon_txIndex['Index'].max()
+        bins = list(range(0, max_txindex + 41, 40))
+
+        # 將 TxIndex 按照 bins 分類
+        txindex_counts = pd.cut(tokenlon_txIndex['Index'], bins=bins).value_counts()
+
+    # 建立繪圖物件
+    fig, ax = plt.subplots()
+    # 設定子圖之間的間距，可以通過調整 bottom 參數增加底部的空白
+    fig.subplots_adjust(bottom=0.2)
+
+    # 繪製直方圖並標註數量
+    plt.hist(tokenlon_txIndex['Index'], bins=bins)
+    for i, count in enumerate(txindex_counts):
+        plt.text((bins[i] + bins[i+1])/2, count+1, str(count), ha='center')
+
+    # 設置 X 軸刻度標籤
+    bin_centers = [(bins[i] + bins[i+1])/2 for i in range(len(bins)-1)]
+    bin_labels = [f'[{bins[i]}, {bins[i+1]})' for i in range(len(bins)-1)]
+    plt.xticks(bin_centers, bin_labels)
+
+    # 取出第一個及最後一個Timestamp
+    # 首先取出第一個及最後一個Timestamp，並轉成datetime型別
+    first_ts = pd.to_datetime(tokenlon_txIndex['Timestamp'].iloc[0], unit='s')
+    last_ts = pd.to_datetime(tokenlon_txIndex['Timestamp'].iloc[-1], unit='s')
+
+    # 將Timestamp格式轉成人類可讀的形式
+    first_ts_str = first_ts.strftime('%Y-%m-%d')
+    last_ts_str = last_ts.strftime('%Y-%m-%d')
+
+    # 設置圖表標題及軸標籤
+    plt.title(f'{first_ts_str} ~ {last_ts_str} TxIndex Info')
+    plt.xticks(rotation=45, ha='right', rotation_mode='anchor', va='top')
+    plt.xlabel('TxIndex')
+    plt.ylabel('Count')
+
+    # 顯示圖表
+    plt.show()
+
+if __name__ == '__main__':
+    # 程式結束時將各階段耗時、RPC 請求次數及快取命中率寫入 ./data/reports
+    instrument.enable()
+
+    # 計算最近 3 天內的 Tx Index 值
+    enrich_transaction_index(3)
+    plot_histogram()
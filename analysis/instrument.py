@@ -0,0 +1,122 @@
+import atexit
+import cache
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# 輕量的量測工具：各處理階段的耗時、HTTP / RPC 請求次數、收到的 bytes、寫入的資料筆數及快取命中次數
+# 呼叫 enable() 後，程式結束時會將報告寫到 REPORT_PATH 底下：
+#   report-<時間>.json：各階段耗時、計數器、快取命中率（及 tracemalloc 的記憶體使用量）
+#   report-<時間>.collapsed：flamegraph.pl / speedscope 可直接讀取的 collapsed stack 格式（單位為毫秒）
+#   report-<時間>.prof：cProfile 的結果（profile=True 時），可以用 snakeviz 等工具檢視
+# 未呼叫 enable() 時仍會記錄，只是不會寫出報告
+
+REPORT_PATH = './data/reports'
+
+_lock = threading.Lock()
+_local = threading.local()
+
+# 各階段（以 / 連接巢狀的階段名稱）的執行次數及總耗時
+stages = {}
+
+# 計數器，例如 http_calls.tokenlon、http_bytes.tokenlon、rpc_calls、rows_ingested.tokenlon_subgraph
+counters = {}
+
+_settings = {'enabled': False, 'profile': None, 'trace_memory': False, 'started': None}
+
+# 副程式：目前執行緒所在的階段（由外而內）
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+# 量測一個處理階段的耗時；階段可以巢狀，例如 refresh/tokenlon，不同執行緒各自記錄自己的巢狀關係
+@contextmanager
+def stage(name):
+    stack = _stack()
+    stack.append(name)
+    path = '/'.join(stack)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            stage_stats = stages.setdefault(path, {'count': 0, 'seconds': 0.0})
+            stage_stats['count'] += 1
+            stage_stats['seconds'] += elapsed
+
+# 副程式：將計數器 name 加上 value
+def count(name, value=1):
+    with _lock:
+        counters[name] = counters.get(name, 0) + value
+
+# 副程式：記錄一次 HTTP 請求及收到的 bytes（依來源分別計算）
+def count_http(source, received_bytes):
+    count(f'http_calls.{source}')
+    count(f'http_bytes.{source}', received_bytes)
+
+# 副程式：開始量測，程式結束時寫出報告
+# profile=True 時以 cProfile 記錄所有函式的耗時；trace_memory=True 時以 tracemalloc 記錄記憶體使用量
+# 兩者未指定時，分別由環境變數 INSTRUMENT_PROFILE 及 INSTRUMENT_TRACEMALLOC（設為 1）決定
+def enable(profile=None, trace_memory=None):
+    if _settings['enabled']:
+        return
+    if profile is None:
+        profile = os.getenv('INSTRUMENT_PROFILE') == '1'
+    if trace_memory is None:
+        trace_memory = os.getenv('INSTRUMENT_TRACEMALLOC') == '1'
+    _settings.update(enabled=True, started=time.perf_counter(), trace_memory=trace_memory)
+    if profile:
+        _settings['profile'] = cProfile.Profile()
+        _settings['profile'].enable()
+    if trace_memory:
+        tracemalloc.start()
+    atexit.register(write_report)
+
+# 副程式：彙整目前的量測結果
+def report():
+    with _lock:
+        result = {
+            'created': datetime.now().astimezone().isoformat(timespec='seconds'),
+            'stages': {path: dict(stage_stats) for path, stage_stats in sorted(stages.items())},
+            'counters': dict(sorted(counters.items())),
+            'cache': {source: dict(source_stats) for source, source_stats in cache.stats.items()},
+        }
+    if _settings['started'] is not None:
+        result['wall_seconds'] = time.perf_counter() - _settings['started']
+    if _settings['trace_memory'] and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        result['memory'] = {'current_bytes': current, 'peak_bytes': peak,
+                            'top': [str(stat) for stat in tracemalloc.take_snapshot().statistics('lineno')[:10]]}
+    return result
+
+# 副程式：巢狀階段轉為 collapsed stack 格式（每行為「a;b;c 毫秒」，只計算不含子階段的耗時）
+def collapsed_stacks(stage_stats):
+    self_seconds = {path: value['seconds'] for path, value in stage_stats.items()}
+    for path, value in stage_stats.items():
+        parent = path.rpartition('/')[0]
+        if parent in self_seconds:
+            self_seconds[parent] -= value['seconds']
+    return [f"{path.replace('/', ';')} {max(int(seconds * 1000), 0)}" for path, seconds in self_seconds.items()]
+
+# 副程式：將報告寫到 REPORT_PATH，回傳 JSON 檔的路徑
+def write_report():
+    result = report()
+    os.makedirs(REPORT_PATH, exist_ok=True)
+    base_path = os.path.join(REPORT_PATH, f'report-{datetime.now():%Y%m%dT%H%M%S}')
+    with open(base_path + '.json', 'w') as f:
+        json.dump(result, f, indent=2)
+    with open(base_path + '.collapsed', 'w') as f:
+        f.write('\n'.join(collapsed_stacks(result['stages'])) + '\n')
+    if _settings['profile'] is not None:
+        _settings['profile'].disable()
+        _settings['profile'].dump_stats(base_path + '.prof')
+    print(f'量測報告已寫入 {base_path}.json')
+    return base_path + '.json'
@@ -0,0 +1,19 @@
+import importlib
+
+# 延遲載入的模組：第一次使用其屬性時才真正 import，只需要取資料的指令不必載入 matplotlib 等繪圖套件
+# 用法：plt = lazy.module('matplotlib.pyplot')，之後照常使用 plt.subplots() 等
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
+
+def module(name):
+    return LazyModule(name)
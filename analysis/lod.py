@@ -0,0 +1,69 @@
+import numpy as np
+
+# 折線圖的多層級降採樣（Level of Detail）
+# 每一層把前一層相鄰的兩個區塊合併，保留區塊內最小值及最大值的位置，因此尖峰（異常價格）不會因降採樣而消失
+# 第 L 層的每個區塊包含 2 ** L 筆原始資料；建立所有層級的總成本為 O(n)
+# 繪圖時依畫面上可見的資料筆數選擇層級，每次縮放／平移只需要取出固定數量的點
+
+# 副程式：建立 y 的 min/max 金字塔，回傳 [(argmin 位置, argmax 位置), ...]，第 i 個元素為第 i + 1 層
+def build_pyramid(y):
+    y = np.asarray(y, dtype='float64')
+    levels = []
+    argmin = argmax = np.arange(len(y))
+    while len(argmin) > 1:
+        pairs = len(argmin) // 2 * 2
+        left_min, right_min = argmin[0:pairs:2], argmin[1:pairs:2]
+        left_max, right_max = argmax[0:pairs:2], argmax[1:pairs:2]
+        next_min = np.where(y[right_min] < y[left_min], right_min, left_min)
+        next_max = np.where(y[right_max] > y[left_max], right_max, left_max)
+        # 奇數個區塊時，最後一個區塊直接保留到下一層
+        if pairs < len(argmin):
+            next_min = np.append(next_min, argmin[-1])
+            next_max = np.append(next_max, argmax[-1])
+        argmin, argmax = next_min, next_max
+        levels.append((argmin, argmax))
+    return levels
+
+# 副程式：取出 [start, end) 範圍內要繪製的資料位置（已排序），最多約 max_points 筆
+def select(levels, start, end, max_points):
+    count = end - start
+    if count <= max_points:
+        return np.arange(start, end)
+    # 每個區塊會產生 2 個點（最小值及最大值），選擇區塊數不超過 max_points / 2 的最細層級
+    level = int(np.ceil(np.log2(count / (max_points / 2))))
+    level = min(max(level, 1), len(levels))
+    block = 2 ** level
+    argmin, argmax = levels[level - 1]
+    first, last = start // block, -(-end // block)
+    positions = np.concatenate([argmin[first:last], argmax[first:last], [start, end - 1]])
+    positions = positions[(positions >= start) & (positions < end)]
+    return np.unique(positions)
+
+# 副程式：以降採樣後的資料繪製折線，並在縮放／平移（X 軸範圍改變）時依可見範圍重新取點
+# x 必須已遞增排序；max_points 未指定時為座標軸寬度（像素）的 2 倍
+def plot(ax, x, y, max_points=None, **kwargs):
+    x = np.ascontiguousarray(x, dtype='float64')
+    y = np.ascontiguousarray(y, dtype='float64')
+    levels = build_pyramid(y)
+
+    def points_limit():
+        if max_points is not None:
+            return max_points
+        return max(2 * int(ax.get_window_extent().width), 200)
+
+    def visible_positions(x_min, x_max):
+        # 左右各多取一點，讓線條延伸到畫面邊緣
+        start = max(int(np.searchsorted(x, x_min, side='left')) - 1, 0)
+        end = min(int(np.searchsorted(x, x_max, side='right')) + 1, len(x))
+        return select(levels, start, end, points_limit())
+
+    positions = select(levels, 0, len(x), points_limit())
+    line, = ax.plot(x[positions], y[positions], **kwargs)
+
+    def on_xlim_changed(axes):
+        x_min, x_max = axes.get_xlim()
+        positions = visible_positions(x_min, x_max)
+        line.set_data(x[positions], y[positions])
+
+    ax.callbacks.connect('xlim_changed', on_xlim_changed)
+    return line
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+# Token 註冊表：代號 → 地址（小寫）、小數點位數，以及 CoinGecko 的 coin id
+# ETH 同時包含 WETH 及原生 ETH（0x000…000）兩個地址，兩者視為同一個 Token
+TOKENS = {
+    'USDT': {'addresses': ['0xdac17f958d2ee523a2206206994597c13d831ec7'], 'decimals': 6, 'coingecko': 'tether'},
+    'USDC': {'addresses': ['0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'], 'decimals': 6, 'coingecko': 'usd-coin'},
+    'DAI': {'addresses': ['0x6b175474e89094c44da98b954eedeac495271d0f'], 'decimals': 18, 'coingecko': 'dai'},
+    'ETH': {'addresses': ['0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2', '0x0000000000000000000000000000000000000000'], 'decimals': 18, 'coingecko': 'ethereum'},
+    'WBTC': {'addresses': ['0x2260fac5e5542a773aa44fbcfedf7c193bc2c599'], 'decimals': 8, 'coingecko': 'bitcoin'},
+}
+
+# 代號的別名（包含 index_price.py 使用的 CoinGecko coin id）
+ALIASES = {
+    'WETH': 'ETH',
+    'BTC': 'WBTC',
+    'ethereum': 'ETH',
+    'bitcoin': 'WBTC',
+    'tether': 'USDT',
+    'usd-coin': 'USDC',
+    'dai': 'DAI',
+}
+
+SYMBOLS = list(TOKENS)
+
+# 地址 → 代號的編號（SYMBOLS 中的位置）
+ADDRESS_CODES = {address: code for code, symbol in enumerate(SYMBOLS) for address in TOKENS[symbol]['addresses']}
+
+# 不在註冊表中的 Token 使用的編號
+UNKNOWN = len(SYMBOLS)
+
+# 副程式：將代號或別名轉為註冊表中的代號
+def resolve(symbol):
+    symbol = ALIASES.get(symbol, symbol)
+    if symbol not in TOKENS:
+        raise ValueError(f"Unknown token: {symbol}")
+    return symbol
+
+# 副程式：取得 Token 的小數點位數
+def decimals(symbol):
+    return TOKENS[resolve(symbol)]['decimals']
+
+# 副程式：將地址欄位轉為代號編號（categorical 編碼，每個不同的地址只查一次註冊表）
+def encode_addresses(addresses):
+    categories = pd.Categorical(addresses)
+    category_codes = np.array([ADDRESS_CODES.get(address, UNKNOWN) for address in categories.categories], dtype='int64')
+    codes = np.full(len(categories), UNKNOWN, dtype='int64')
+    known = categories.codes >= 0
+    codes[known] = category_codes[categories.codes[known]]
+    return codes
+
+# 副程式：交易對（base／quote）在 directions 方向的 pyarrow DNF 篩選條件，讀取資料庫時只讀取這些交易（見 storage.iter_dataset()）
+# 方向的定義與 PairIndex.direction_positions() 相同；ETH 包含 WETH 及原生 ETH 兩個地址
+def pair_filters(base, quote, directions=('sell', 'buy')):
+    base_addresses = TOKENS[resolve(base)]['addresses']
+    quote_addresses = TOKENS[resolve(quote)]['addresses']
+    filters = []
+    for direction in directions:
+        if direction == 'sell':
+            filters.append([('MakerToken', 'in', quote_addresses), ('TakerToken', 'in', base_addresses)])
+        elif direction == 'buy':
+            filters.append([('MakerToken', 'in', base_addresses), ('TakerToken', 'in', quote_addresses)])
+        else:
+            raise ValueError(f"Unknown direction: {direction}")
+    return filters
+
+# 副程式：將整數字串的數量依各自的小數點位數換算為 Token 單位（token_decimals 為 -1，或數量缺值／不是整數字串時結果為 NaN）
+# 以字串切出整數部份及小數部份後各自轉為 float 再相加，不需要先把 18 位小數的大整數轉成 float 再除以 10 ** decimals（超過 int64 的範圍）
+# 結果為 float64，與精確值的誤差在 float64 的捨入範圍內；每種小數點位數各做一次向量化計算，不需要逐筆轉換為 Python int
+def scale_amounts(amounts, token_decimals):
+    amounts = pd.Series(amounts, dtype=object).reset_index(drop=True)
+    # 缺值（NaN、None）及空字串轉為 NaN，不會中斷整批資料的寫入
+    amounts = amounts.where(amounts.notna(), '').astype(str)
+    valid = amounts.str.fullmatch(r'[0-9]+').to_numpy(dtype=bool)
+    result = np.full(len(amounts), np.nan)
+    for d in np.unique(token_decimals[token_decimals >= 0]):
+        mask = (token_decimals == d) & valid
+        digits = amounts[mask].str.zfill(d + 1)
+        if d == 0:
+            result[mask] = pd.to_numeric(digits, errors='coerce').astype('float64')
+            continue
+        integer_part = pd.to_numeric(digits.str[:-d], errors='coerce').astype('float64').to_numpy()
+        fraction_part = pd.to_numeric(digits.str[-d:], errors='coerce').astype('float64').to_numpy()
+        result[mask] = integer_part + fraction_part / 10 ** d
+    return result
+
+# 副程式：新增依 Token 小數點位數換算後的 MakerValue、TakerValue，以及 MakerPrice（每 1 個 TakerToken 可換得的 MakerToken）
+# 原始的 MakerAmount、TakerAmount 會保留；不在註冊表中的 Token 為 NaN
+def normalize_amounts(data):
+    token_decimals = np.array([TOKENS[symbol]['decimals'] for symbol in SYMBOLS] + [-1], dtype='int64')
+    maker_value = scale_amounts(data['MakerAmount'], token_decimals[encode_addresses(data['MakerToken'])])
+    taker_value = scale_amounts(data['TakerAmount'], token_decimals[encode_addresses(data['TakerToken'])])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        maker_price = maker_value / taker_value
+    return data.assign(MakerValue=maker_value, TakerValue=taker_value, MakerPrice=maker_price)
+
+# 以 (MakerToken, TakerToken) 分組的索引，建立一次後，任何交易對及方向都只需要取出該組的資料
+# 同一組內的資料維持原本（Timestamp 遞增）的順序
+class PairIndex:
+    def __init__(self, data):
+        self.data = data
+        self.maker_codes = encode_addresses(data['MakerToken'])
+        self.taker_codes = encode_addresses(data['TakerToken'])
+        pair_codes = self.maker_codes * (UNKNOWN + 1) + self.taker_codes
+        # stable 排序保留組內原本的順序，再以 searchsorted 取得每一組的起訖位置
+        self.order = np.argsort(pair_codes, kind='stable')
+        self.sorted_codes = pair_codes[self.order]
+        self._amounts = None
+
+    # 取出 MakerToken 為 maker、TakerToken 為 taker 的資料在 data 中的位置
+    def positions(self, maker, taker):
+        code = SYMBOLS.index(resolve(maker)) * (UNKNOWN + 1) + SYMBOLS.index(resolve(taker))
+        start = np.searchsorted(self.sorted_codes, code, side='left')
+        end = np.searchsorted(self.sorted_codes, code, side='right')
+        return self.order[start:end]
+
+    # 取出交易對在 data 中的位置
+    # direction='sell'：Taker 用 base 換 quote（MakerToken=quote、TakerToken=base），即賣 base 的賣價
+    # direction='buy'：Taker 用 quote 換 base（MakerToken=base、TakerToken=quote），即買 base 的買價
+    def direction_positions(self, base, quote, direction):
+        if direction == 'sell':
+            return self.positions(quote, base)
+        if direction == 'buy':
+            return self.positions(base, quote)
+        raise ValueError(f"Unknown direction: {direction}")
+
+    # 取出交易對的資料
+    def trades(self, base, quote, direction):
+        return self.data.iloc[self.direction_positions(base, quote, direction)]
+
+    # 取得所有交易依各自小數點位數換算後的 MakerValue 及 TakerValue
+    # 寫入資料庫時已計算好；沒有這兩個欄位時，才以一次向量化計算補上（只計算一次）
+    def amounts(self):
+        if self._amounts is None:
+            if 'MakerValue' not in self.data:
+                self.data = normalize_amounts(self.data)
+            self._amounts = (self.data['MakerValue'].to_numpy(), self.data['TakerValue'].to_numpy())
+        return self._amounts
+
+    # 取出交易對的資料，並新增以 quote 計價的 Price 欄位（例如 ETH-USDT 的價格為每 1 ETH 的 USDT）
+    # min_quote_amount：只保留 quote 數量大於此值的大單
+    def priced_trades(self, base, quote, direction, min_quote_amount=None):
+        positions = self.direction_positions(base, quote, direction)
+        maker_amount, taker_amount = self.amounts()
+        if direction == 'sell':
+            base_amount, quote_amount = taker_amount[positions], maker_amount[positions]
+        else:
+            base_amount, quote_amount = maker_amount[positions], taker_amount[positions]
+        trades = self.data.iloc[positions].assign(Price=quote_amount / base_amount)
+        if min_quote_amount is not None:
+            trades = trades[quote_amount > min_quote_amount]
+        return trades
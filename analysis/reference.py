@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pairs
+import storage
+import timerange
+
+# 參考價格服務：每個資產一條以 USD 計價、依時間排序的價格序列，分析程式不需要再自行讀取及合併各來源
+# 各來源依優先順序合併：同一個時間點以優先順序較高、且有資料的來源為準，缺資料時改用下一個來源
+# 各來源先對齊到共同的時間格點（預設每小時），格點上的價格為前後兩筆資料的線性內插（與最接近的一筆資料相差需在 TOLERANCE 秒內）
+# 格點只到最後一筆資料之前（不會有晚於實際資料的格點）；之後尚未滿一個格點的資料（例如 CoinGecko 最新一筆為目前時間的價格）以原始的時間及價格接在最後
+# 合併結果依輸入資料集的指紋（筆數、最後的 Timestamp）快取在記憶體及 data/cache/reference 底下，資料沒有更新時直接讀取
+
+# 各資產的價格來源（依預設的優先順序），檔名與 index_price.py 相同，放在 data_dir 底下
+# coingecko：Timestamp、Price；uniswap3：tokenHourDatas 的 Open／Close（該小時結束時的價格為 Close）
+SOURCES = {
+    'ETH': [('coingecko', 'eth_usd_price.csv'), ('uniswap3', 'uniswap3_subgraph.csv')],
+    'WBTC': [('coingecko', 'btc_usd_price.csv')],
+}
+
+DATA_DIR = './data'
+
+# 共同時間格點的間隔（秒）
+GRID = 3600
+
+# 來源的資料與格點的時間差超過此值（秒）時，視為該來源在此格點沒有資料
+TOLERANCE = 2 * GRID
+
+# 快取格式版本，計算方式改變時遞增，舊的快取就不會再被使用
+CACHE_VERSION = 2
+
+_memory = {}
+_lock = threading.Lock()
+
+# 依時間排序的參考價格序列，timestamps、prices、sources 都是連續的 NumPy 陣列
+# sources 為每個格點所使用的來源在 source_names 中的位置
+class ReferenceSeries:
+    def __init__(self, asset, timestamps, prices, sources, source_names):
+        self.asset = asset
+        self.timestamps = timestamps
+        self.prices = prices
+        self.sources = sources
+        self.source_names = source_names
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # 時間範圍（見 timerange.resolve()）的起訖位置，最近 N 天以最後一個格點為準
+    def bounds(self, time_range=None):
+        start, end = timerange.resolve(time_range, int(self.timestamps[-1]) if len(self.timestamps) else 0)
+        return timerange.bounds(self.timestamps, start, end)
+
+    # 時間範圍內的 timestamps 及 prices（切片，不複製資料）
+    def window(self, time_range=None):
+        lo, hi = self.bounds(time_range)
+        return self.timestamps[lo:hi], self.prices[lo:hi]
+
+    # 轉為 Timestamp、Price、Source 欄位的 DF，可直接傳給 utils.add_nearest_price_column() 等原本使用 CoinGecko DF 的副程式
+    def frame(self, time_range=None):
+        lo, hi = self.bounds(time_range)
+        sources = pd.Categorical.from_codes(self.sources[lo:hi], self.source_names)
+        return pd.DataFrame({'Timestamp': self.timestamps[lo:hi], 'Price': self.prices[lo:hi], 'Source': sources})
+
+# 副程式：讀取一個來源的資料，回傳 (timestamps, prices)；uniswap3 以該小時結束的時間及 Close 作為一筆價格
+def read_source(source, csv_file_path):
+    if not storage.exists(csv_file_path):
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='float64')
+    if source == 'uniswap3':
+        data = storage.load(csv_file_path, columns=['Timestamp', 'Close'])
+        return data['Timestamp'].to_numpy(dtype='int64') + 3600, data['Close'].to_numpy(dtype='float64')
+    data = storage.load(csv_file_path, columns=['Timestamp', 'Price'])
+    return data['Timestamp'].to_numpy(dtype='int64'), data['Price'].to_numpy(dtype='float64')
+
+# 副程式：將一個來源的價格對齊到格點，以前後兩筆資料做線性內插
+# 與最接近的一筆資料相差超過 tolerance 秒、在該來源第一筆之前或最後一筆之後（不外插），或沒有資料時為 NaN
+def on_grid(timestamps, prices, grid_timestamps, tolerance=TOLERANCE):
+    values = np.full(len(grid_timestamps), np.nan)
+    if len(timestamps) == 0:
+        return values
+    right = np.clip(np.searchsorted(timestamps, grid_timestamps), 0, len(timestamps) - 1)
+    left = np.clip(right - 1, 0, None)
+    distance = np.minimum(np.abs(grid_timestamps - timestamps[left]), np.abs(timestamps[right] - grid_timestamps))
+    found = (distance <= tolerance) & (grid_timestamps >= timestamps[0]) & (grid_timestamps <= timestamps[-1])
+    values[found] = np.interp(grid_timestamps[found], timestamps, prices)
+    return values
+
+# 副程式：依優先順序合併各來源，回傳 ReferenceSeries
+def build(asset, sources, grid=GRID, tolerance=TOLERANCE):
+    observations = [read_source(source, csv_file_path) for source, csv_file_path in sources]
+    first = [timestamps[0] for timestamps, prices in observations if len(timestamps)]
+    last = [timestamps[-1] for timestamps, prices in observations if len(timestamps)]
+    source_names = [source for source, csv_file_path in sources]
+    if not first:
+        return ReferenceSeries(asset, np.zeros(0, dtype='int64'), np.zeros(0, dtype='float64'), np.zeros(0, dtype='int8'), source_names)
+    # 格點涵蓋所有來源的時間範圍，最後一個格點不晚於最後一筆資料
+    grid_end = max(last) // grid * grid
+    grid_timestamps = np.arange(min(first) // grid * grid, grid_end + 1, grid, dtype='int64')
+    prices = np.full(len(grid_timestamps), np.nan)
+    source_codes = np.full(len(grid_timestamps), -1, dtype='int8')
+    for code, (timestamps, source_prices) in enumerate(observations):
+        values = on_grid(timestamps, source_prices, grid_timestamps, tolerance)
+        fill = np.isnan(prices) & ~np.isnan(values)
+        prices[fill] = values[fill]
+        source_codes[fill] = code
+    keep = source_codes >= 0
+    grid_timestamps, prices, source_codes = grid_timestamps[keep], prices[keep], source_codes[keep]
+    # 最後一個格點之後的資料，依優先順序使用第一個有資料的來源
+    for code, (timestamps, source_prices) in enumerate(observations):
+        after = timestamps > grid_end
+        if after.any():
+            grid_timestamps = np.concatenate([grid_timestamps, timestamps[after]])
+            prices = np.concatenate([prices, source_prices[after]])
+            source_codes = np.concatenate([source_codes, np.full(int(after.sum()), code, dtype='int8')])
+            break
+    return ReferenceSeries(asset, np.ascontiguousarray(grid_timestamps), np.ascontiguousarray(prices), np.ascontiguousarray(source_codes), source_names)
+
+# 副程式：以輸入資料集的 metadata（筆數、最後的 Timestamp）及參數計算指紋，資料有更新時指紋就會改變
+def fingerprint(asset, sources, grid, tolerance):
+    inputs = []
+    for source, csv_file_path in sources:
+        meta = storage.read_meta(csv_file_path) if storage.exists(csv_file_path) else {}
+        inputs.append([source, os.path.abspath(csv_file_path), meta.get('row_count'), meta.get('last_timestamp'), meta.get('version')])
+    key = json.dumps([CACHE_VERSION, asset, grid, tolerance, inputs])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+# 副程式：取得資產（代號或別名，例如 'ethereum'、'ETH'）的參考價格序列
+# priority 為來源名稱的優先順序（預設為 SOURCES 中的順序），只會使用列出的來源
+def series(asset, data_dir=DATA_DIR, priority=None, grid=GRID, tolerance=TOLERANCE):
+    asset = pairs.resolve(asset)
+    if asset not in SOURCES:
+        raise ValueError(f"No reference price source for {asset}")
+    sources = [(source, os.path.join(data_dir, file_name)) for source, file_name in SOURCES[asset]]
+    if priority is not None:
+        sources = sorted((item for item in sources if item[0] in priority), key=lambda item: list(priority).index(item[0]))
+    key = fingerprint(asset, sources, grid, tolerance)
+    with _lock:
+        if key in _memory:
+            return _memory[key]
+    cache_dir = os.path.join(data_dir, 'cache', 'reference')
+    cache_path = os.path.join(cache_dir, f'{asset}-{key}.npz')
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            result = ReferenceSeries(asset, cached['timestamps'], cached['prices'], cached['sources'], list(cached['source_names']))
+    else:
+        result = build(asset, sources, grid, tolerance)
+        os.makedirs(cache_dir, exist_ok=True)
+        # 刪除同一個資產舊的快取，再以「暫存檔 + 取代」寫入
+        for name in os.listdir(cache_dir):
+            if name.startswith(f'{asset}-') and name.endswith('.npz'):
+                os.remove(os.path.join(cache_dir, name))
+        tmp_path = cache_path + '.tmp.npz'
+        np.savez(tmp_path, timestamps=result.timestamps, prices=result.prices, sources=result.sources, source_names=np.array(result.source_names))
+        os.replace(tmp_path, cache_path)
+    with _lock:
+        _memory[key] = result
+    return result
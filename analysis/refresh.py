@@ -0,0 +1,63 @@
+import asyncio
+import time
+import instrument
+from concurrent.futures import ThreadPoolExecutor
+
+# 以 asyncio 同時更新多個資料來源，總耗時接近最慢的單一來源，而不是所有來源的總和
+# 各來源的取資料函式（requests / pycoingecko）都是同步的，因此放到執行緒中執行
+# 每個來源各自有同時執行數量的上限及逾時時間；各來源寫入自己的資料集，一個來源失敗或逾時不會影響其他來源已寫入的資料
+
+# 每個來源同時執行的工作數量上限
+SOURCE_LIMITS = {
+    'coingecko': 2,
+    'tokenlon': 1,
+    'uniswap3': 1,
+}
+
+# 每個工作的逾時時間（秒）
+SOURCE_TIMEOUTS = {
+    'coingecko': 60,
+    'tokenlon': 600,
+    'uniswap3': 120,
+}
+
+# 副程式：在執行緒中執行一個工作，並以該來源的 semaphore 限制同時執行的數量
+# 逾時後不再等待此工作（執行緒會在背景中結束，已寫入的 partition 都是完整的檔案），其他工作不受影響
+async def run_job(loop, executor, semaphores, source, name, function, args):
+    def call():
+        with instrument.stage(f'refresh/{name}'):
+            return function(*args)
+
+    async with semaphores[source]:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(loop.run_in_executor(executor, call), SOURCE_TIMEOUTS.get(source))
+            status = 'ok'
+        except asyncio.TimeoutError:
+            status = 'timeout'
+        except Exception as e:
+            status = f'error: {e!r}'
+        elapsed = time.perf_counter() - start
+    instrument.count(f'refresh_{status.split(":")[0]}.{source}')
+    print(f'更新 {name}：{status}（{elapsed:.2f} 秒）')
+    return name, {'status': status, 'seconds': elapsed}
+
+async def run_jobs(jobs):
+    loop = asyncio.get_running_loop()
+    semaphores = {source: asyncio.Semaphore(SOURCE_LIMITS.get(source, 1)) for source, name, function, args in jobs}
+    executor = ThreadPoolExecutor(max_workers=max(sum(SOURCE_LIMITS.get(source, 1) for source in semaphores), 1))
+    try:
+        results = await asyncio.gather(*(run_job(loop, executor, semaphores, source, name, function, args) for source, name, function, args in jobs))
+    finally:
+        # 不等待逾時的工作
+        executor.shutdown(wait=False)
+    return dict(results)
+
+# 副程式：同時執行所有工作，回傳 {工作名稱: {'status': 'ok' / 'timeout' / 'error: ...', 'seconds': 秒數}}
+# jobs 為 [(來源, 工作名稱, 函式, 參數 tuple), ...]
+def run(jobs):
+    start = time.perf_counter()
+    with instrument.stage('refresh'):
+        results = asyncio.run(run_jobs(jobs))
+    print(f'更新完成：{len(jobs)} 個工作，總耗時 {time.perf_counter() - start:.2f} 秒')
+    return results
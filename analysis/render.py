@@ -0,0 +1,93 @@
+# 批次將所有交易對／方向／時間範圍的圖表輸出為圖檔（PNG、SVG），不需要開啟視窗
+# 資料只讀取及換算一次，再以多個 process 同時繪製，每個工作的耗時會印出來
+# python3 ./analysis/render.py
+
+# 使用不需要視窗的繪圖後端，必須在 import pyplot（utils）之前設定
+import matplotlib
+matplotlib.use('Agg')
+
+import os
+import time
+import matplotlib.pyplot as plt
+import index_price
+import pairs
+import reference
+import timerange
+import utils
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# 圖檔輸出的資料夾及格式
+images_path = './images'
+image_formats = ['png', 'svg']
+
+# 要輸出的圖表：(交易對, 方向, 時間範圍)
+# 交易對為 '{coin}-{target}'；方向為 'both'（買價及賣價）、'sell' 或 'buy'
+# 時間範圍為 (date_start, date_end) 的日期字串，或是到最新一筆資料為止的最近 N 天（見 timerange.resolve()）
+JOBS = [
+    (pair, direction, window)
+    for pair in ['ethereum-tether', 'bitcoin-tether']
+    for direction in ['both', 'sell', 'buy']
+    for window in [("2023/03/20 00:00:00+0800", "2023/03/23 00:00:00+0800"), 3, 7, 30]
+]
+
+# 副程式：讀取資料，並為每個交易對取出買價及賣價（含 CoingeckoPrice）各一次，回傳 {(coin, direction): DF} 及 {coin: CoinGecko DF}
+def load_inputs(jobs):
+    coins = sorted({pair.split('-')[0] for pair, direction, window in jobs})
+    # 只讀取要輸出的交易對的交易
+    subgraph_data = utils.load_data(index_price.tokenlon_subgraph_file_path, filters=[conjunction for coin in coins for conjunction in pairs.pair_filters(coin, 'tether')])
+    pair_index = pairs.PairIndex(subgraph_data)
+    coin_data = {coin: reference.series(coin, os.path.dirname(index_price.coin_csv_file_path[coin])).frame() for coin in coins}
+    trades = {}
+    for coin in coins:
+        for direction in ['sell', 'buy']:
+            coin_trades = pair_index.priced_trades(coin, 'tether', direction, index_price.min_quote_amount.get(coin))
+            coin_trades = utils.add_nearest_price_column(coin_data[coin], coin_trades)
+            trades[(coin, direction)] = coin_trades[['Timestamp', 'Price', 'CoingeckoPrice']]
+    return trades, coin_data
+
+# 副程式：在子 process 中繪製一張圖表並輸出為圖檔，回傳輸出的檔案及耗時（秒）
+def render_job(name, coingecko_data, sell_coin_data, buy_coin_data, time_range):
+    start = time.perf_counter()
+    fig, ax, hover_lines = utils.build_move_figure(name, coingecko_data, sell_coin_data, buy_coin_data, time_range)
+    file_paths = []
+    for image_format in image_formats:
+        file_path = os.path.join(images_path, f'{name}.{image_format}')
+        fig.savefig(file_path, format=image_format)
+        file_paths.append(file_path)
+    plt.close(fig)
+    return file_paths, time.perf_counter() - start
+
+# 副程式：以 max_workers 個 process 同時輸出所有圖表
+def render_all(jobs, max_workers=None):
+    start = time.perf_counter()
+    trades, coin_data = load_inputs(jobs)
+    print(f'讀取資料：{time.perf_counter() - start:.2f} 秒')
+    # 所有交易對都沒有交易時（例如剛建立的資料庫）無法決定時間範圍，不輸出任何圖表
+    last_timestamps = [int(data['Timestamp'].max()) for data in trades.values() if len(data)]
+    if not last_timestamps:
+        print('Note: 要輸出的交易對都沒有交易資料，略過輸出圖表')
+        return
+    last_timestamp = max(last_timestamps)
+    os.makedirs(images_path, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for pair, direction, window in jobs:
+            coin = pair.split('-')[0]
+            timestamp_start, timestamp_end = timerange.resolve(window, last_timestamp)
+            sell_coin_data = trades[(coin, 'sell')].iloc[:0] if direction == 'buy' else trades[(coin, 'sell')]
+            buy_coin_data = trades[(coin, 'buy')].iloc[:0] if direction == 'sell' else trades[(coin, 'buy')]
+            name = f'{pair}-{direction}-{timerange.label(window)}'
+            # 以二分搜尋只取出範圍內的資料，減少傳給子 process 的資料量
+            future = executor.submit(render_job, name,
+                                     timerange.view(coin_data[coin], timestamp_start, timestamp_end),
+                                     timerange.view(sell_coin_data, timestamp_start, timestamp_end),
+                                     timerange.view(buy_coin_data, timestamp_start, timestamp_end),
+                                     (timestamp_start, timestamp_end))
+            futures[future] = name
+        for future in as_completed(futures):
+            file_paths, elapsed = future.result()
+            print(f'{futures[future]}：{elapsed:.2f} 秒（{", ".join(file_paths)}）')
+    print(f'共 {len(jobs)} 張圖表，總耗時 {time.perf_counter() - start:.2f} 秒')
+
+if __name__ == '__main__':
+    render_all(JOBS)
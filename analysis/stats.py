@@ -0,0 +1,183 @@
+import bisect
+import numpy as np
+import pandas as pd
+from collections import deque
+
+# 價格的滾動統計及異常值偵測
+# 價格有趨勢時，整段資料只用一組平均值／標準差會把趨勢本身當成異常，因此改用時間視窗（秒）內的統計
+# 一次計算整段歷史資料時使用 pandas 的向量化 rolling；之後每筆新交易只需要以 RollingStats / EWStats 的 update() 更新狀態，不需要重算整段歷史資料
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# 預設的滾動視窗（秒）及判斷異常值的標準差倍數
+DEFAULT_WINDOW = 6 * 60 * 60
+DEFAULT_N = 2
+
+# 視窗內少於此筆數時不計算標準差（結果為 NaN，不視為異常值）
+MIN_PERIODS = 10
+
+# 參考價格（CoinGecko 每小時一筆）的滾動視窗（秒）；DEFAULT_WINDOW 內只有 6 筆，達不到 MIN_PERIODS，因此改用 1 天
+REFERENCE_WINDOW = 24 * 60 * 60
+
+# 以時間視窗計算的滾動平均值、標準差及分位數，每次 update() 加入一筆資料並移除視窗外的舊資料
+# 平均值及標準差以 Welford 演算法加入／移除資料，每筆為 O(1)
+# quantiles=True 時另外保存排序好的視窗資料供 quantile() 二分搜尋，每筆的插入／刪除為 O(視窗筆數)，不需要分位數時不要開啟
+class RollingStats:
+    def __init__(self, window=DEFAULT_WINDOW, quantiles=False):
+        self.window = window
+        self.values = deque()
+        self.sorted_values = [] if quantiles else None
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def __len__(self):
+        return len(self.values)
+
+    def _add(self, value):
+        delta = value - self.mean
+        self.mean += delta / (len(self.values))
+        self.m2 += delta * (value - self.mean)
+
+    def _remove(self, value):
+        count = len(self.values)
+        if count == 0:
+            self.mean = self.m2 = 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / count
+        self.m2 -= delta * (value - self.mean)
+
+    # 加入一筆資料（timestamp 需遞增），並移除 timestamp - window 之前的資料
+    def update(self, timestamp, value):
+        value = float(value)
+        self.values.append((timestamp, value))
+        self._add(value)
+        if self.sorted_values is not None:
+            bisect.insort(self.sorted_values, value)
+        while self.values[0][0] <= timestamp - self.window:
+            old_value = self.values.popleft()[1]
+            self._remove(old_value)
+            if self.sorted_values is not None:
+                del self.sorted_values[bisect.bisect_left(self.sorted_values, old_value)]
+        return self
+
+    # 樣本標準差（與 pandas 的 std() 相同，ddof=1）；資料少於 MIN_PERIODS 筆時為 NaN
+    @property
+    def std(self):
+        if len(self.values) < MIN_PERIODS:
+            return np.nan
+        return float(np.sqrt(max(self.m2, 0.0) / (len(self.values) - 1)))
+
+    # 視窗內的分位數（線性內插，與 pandas 的 quantile() 相同），需以 quantiles=True 建立
+    def quantile(self, q):
+        if self.sorted_values is None:
+            raise ValueError("RollingStats was created without quantiles=True")
+        if not self.sorted_values:
+            return np.nan
+        position = q * (len(self.sorted_values) - 1)
+        lower = int(np.floor(position))
+        upper = min(lower + 1, len(self.sorted_values) - 1)
+        return self.sorted_values[lower] + (self.sorted_values[upper] - self.sorted_values[lower]) * (position - lower)
+
+    # value 相對於目前視窗的 z-score
+    def zscore(self, value):
+        return (value - self.mean) / self.std
+
+# 以半衰期（秒）計算的指數加權平均值及標準差，越舊的資料權重越小，每次 update() 為 O(1)
+# 權重依兩筆資料的時間差衰減，交易時間不固定也適用
+class EWStats:
+    def __init__(self, halflife=DEFAULT_WINDOW / 2):
+        self.halflife = halflife
+        self.weight = 0.0
+        self.mean = 0.0
+        self.var = 0.0
+        self.timestamp = None
+        self.count = 0
+
+    def update(self, timestamp, value):
+        value = float(value)
+        if self.timestamp is not None:
+            self.weight *= 0.5 ** ((timestamp - self.timestamp) / self.halflife)
+        self.timestamp = timestamp
+        self.weight += 1.0
+        self.count += 1
+        # 加權版的 Welford 演算法：新資料的權重為 1 / 總權重
+        alpha = 1.0 / self.weight
+        delta = value - self.mean
+        self.mean += alpha * delta
+        self.var = (1.0 - alpha) * (self.var + alpha * delta * delta)
+        return self
+
+    @property
+    def std(self):
+        if self.count < MIN_PERIODS:
+            return np.nan
+        return float(np.sqrt(self.var))
+
+    def zscore(self, value):
+        return (value - self.mean) / self.std
+
+# 副程式：一次計算整段資料的時間視窗滾動平均值及標準差（包含當筆資料），回傳兩個 NumPy 陣列
+# timestamps 需遞增；結果與逐筆 RollingStats.update() 相同
+def rolling_mean_std(timestamps, values, window=DEFAULT_WINDOW):
+    rolling = _rolling(timestamps, values, window)
+    return rolling.mean().to_numpy(), rolling.std().to_numpy()
+
+# 副程式：一次計算整段資料的時間視窗滾動分位數，回傳 NumPy 陣列
+def rolling_quantile(timestamps, values, q, window=DEFAULT_WINDOW):
+    return _rolling(timestamps, values, window).quantile(q).to_numpy()
+
+def _rolling(timestamps, values, window):
+    index = pd.to_datetime(np.asarray(timestamps, dtype='float64'), unit='s')
+    series = pd.Series(np.asarray(values, dtype='float64'), index=index)
+    return series.rolling(f'{int(window)}s', min_periods=1)
+
+# 副程式：一次計算整段資料的時間視窗滾動 z-score，視窗內少於 MIN_PERIODS 筆或標準差為 0 時為 NaN
+def rolling_zscores(timestamps, values, window=DEFAULT_WINDOW):
+    values = np.asarray(values, dtype='float64')
+    rolling = _rolling(timestamps, values, window)
+    mean, std = rolling.mean().to_numpy(), rolling.std().to_numpy().copy()
+    count = rolling.count().to_numpy()
+    std[(count < MIN_PERIODS) | (std == 0)] = np.nan
+    return (values - mean) / std
+
+# 副程式：價格相對於參考價格（例如 CoingeckoPrice）的偏離程度（Price / 參考價格 - 1）
+def deviations(prices, reference_prices):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.asarray(prices, dtype='float64') / np.asarray(reference_prices, dtype='float64') - 1
+
+# 副程式：交易對的價格相對於參考價格偏離程度的滾動 z-score
+# data 為單一交易對及方向的資料（例如 PairIndex.priced_trades() 的結果），需有 Timestamp、Price 及參考價格欄位
+def deviation_zscores(data, reference_column='CoingeckoPrice', window=DEFAULT_WINDOW):
+    return rolling_zscores(data['Timestamp'], deviations(data['Price'], data[reference_column]), window)
+
+# 依交易對（例如 (coin, direction)）分別保存偏離程度的滾動統計，新交易進來時以 O(1) 更新並取得 z-score
+class PairDeviationStats:
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.pairs = {}
+
+    def update(self, pair, timestamp, price, reference_price):
+        deviation = float(deviations(price, reference_price))
+        pair_stats = self.pairs.setdefault(pair, RollingStats(self.window)).update(timestamp, deviation)
+        return pair_stats.zscore(deviation)
+
+# 副程式：取得 |z-score| 在 n 倍標準差內的資料的最小／大值，作為 Y 軸的顯示範圍
+# 有 timestamps 時使用時間視窗的滾動統計，否則使用整段資料的平均值及標準差
+def clip_range(values, timestamps=None, n=DEFAULT_N, window=DEFAULT_WINDOW):
+    values = np.asarray(values, dtype='float64')
+    if timestamps is None:
+        z = (values - values.mean()) / values.std()
+    else:
+        z = rolling_zscores(timestamps, values, window)
+    # z-score 為 NaN（資料太少）時不視為異常值
+    kept = values[~(np.abs(z) > n)]
+    if not len(kept):
+        kept = values
+    return kept.min(), kept.max()
+
+# 副程式：以 UTC 日期分組，計算每天的異常值筆數，回傳 (日期, 筆數) 兩個陣列
+def daily_counts(timestamps, mask):
+    days = np.asarray(timestamps, dtype='int64')[mask] // SECONDS_PER_DAY
+    days, counts = np.unique(days, return_counts=True)
+    return pd.to_datetime(days * SECONDS_PER_DAY, unit='s').date, counts
@@ -0,0 +1,403 @@
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+import instrument
+import pairs
+from datetime import datetime, timezone
+
+# 以「天」為單位切分的欄式（Parquet）本地資料庫，取代 data/ 底下的 CSV 檔
+# 每個 CSV 檔對應到 data/store/<檔名> 資料夾，底下為 date=YYYY-MM-DD/part-*.parquet
+# 所有 Timestamp 在寫入時都統一轉為 int64 的「秒」，Token 地址統一轉為小寫
+
+# 各資料集的欄位型別；未列出的欄位維持 pandas 讀取到的型別
+# MakerAmount / TakerAmount 為最多 78 位數的整數，無法放進 int64，因此以字串保存原始值
+COLUMN_DTYPES = {
+    'Id': 'string',
+    'BlockNumber': 'int64',
+    'Timestamp': 'int64',
+    'MakerToken': 'string',
+    'MakerAmount': 'string',
+    'TakerToken': 'string',
+    'TakerAmount': 'string',
+    'Method': 'category',
+    'Index': 'int64',
+    'Price': 'float64',
+    'Open': 'float64',
+    'High': 'float64',
+    'Low': 'float64',
+    'Close': 'float64',
+    'MakerValue': 'float64',
+    'TakerValue': 'float64',
+    'MakerPrice': 'float64',
+}
+
+# 讀取時以 categorical 表示的欄位（不同的值很少，以整數代碼保存，佔用的記憶體遠小於字串）
+CATEGORICAL_COLUMNS = ['MakerToken', 'TakerToken', 'Method']
+
+# 資料格式版本，舊版的資料集會在第一次讀取時自動升級
+# 2：Tokenlon 資料新增 MakerValue、TakerValue、MakerPrice 欄位
+# 3：key hash 索引由整個資料集一個檔案（_keys.npy）改為每個 partition 一個檔案
+SCHEMA_VERSION = 3
+
+# 大於此值的 Timestamp 視為毫秒（CoinGecko），需轉換為秒
+MILLISECOND_THRESHOLD = 10 ** 11
+
+SECONDS_PER_DAY = 86400
+
+# 轉換 CSV 檔時每次讀取的筆數
+CSV_CHUNK_ROWS = 200000
+
+# 讀取 CSV 檔時直接指定的型別，Token 地址及 Method 以 categorical 讀取，數量維持原始的字串
+CSV_DTYPES = {'MakerAmount': str, 'TakerAmount': str, 'MakerToken': 'category', 'TakerToken': 'category', 'Method': 'category'}
+
+# 判斷資料是否重複的欄位（有的欄位才會使用），例如 Tokenlon 以 Id、CoinGecko 以 Timestamp 判斷
+KEY_COLUMNS = ['Id', 'Timestamp']
+
+# 副程式：取得 CSV 檔對應的資料集資料夾，例如 ./data/eth_usd_price.csv → ./data/store/eth_usd_price
+def dataset_dir(csv_file_path):
+    directory, file_name = os.path.split(csv_file_path)
+    return os.path.join(directory, 'store', os.path.splitext(file_name)[0])
+
+# 副程式：將資料轉為統一的型別，Timestamp 轉為 int64 秒，Token 地址轉為小寫
+def normalize(data):
+    data = data.copy()
+    timestamps = pd.to_numeric(data['Timestamp'])
+    if len(timestamps) and timestamps.max() > MILLISECOND_THRESHOLD:
+        timestamps = timestamps // 1000
+    data['Timestamp'] = timestamps.astype('int64')
+    for column in ('MakerToken', 'TakerToken'):
+        if column in data:
+            data[column] = data[column].astype(str).str.lower()
+    # 依 Token 小數點位數換算的數量及價格，只在寫入時計算一次
+    if 'MakerAmount' in data and 'MakerValue' not in data:
+        data = pairs.normalize_amounts(data)
+    for column, dtype in COLUMN_DTYPES.items():
+        if column in data and column != 'Timestamp':
+            data[column] = data[column].astype(str) if dtype == 'string' else data[column].astype(dtype)
+    return data
+
+# 副程式：將 Timestamp（秒）轉為 UTC 日期字串
+def day_of(timestamp):
+    return datetime.fromtimestamp(int(timestamp), tz=timezone.utc).strftime('%Y-%m-%d')
+
+# 副程式：列出資料集中所有的日期資料夾（依日期遞增排序）
+def list_days(csv_file_path):
+    root = dataset_dir(csv_file_path)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name[len('date='):] for name in os.listdir(root) if name.startswith('date='))
+
+# 副程式：資料集是否存在；若尚未建立但有舊的 CSV 檔，會先自動轉換
+def exists(csv_file_path):
+    if list_days(csv_file_path):
+        upgrade(csv_file_path)
+        return True
+    if os.path.exists(csv_file_path):
+        migrate_csv(csv_file_path)
+        return True
+    return False
+
+# 副程式：資料集的 metadata 檔（最後的 Timestamp、資料筆數、最大的 BlockNumber）
+def meta_path(csv_file_path):
+    return os.path.join(dataset_dir(csv_file_path), '_meta.json')
+
+# 副程式：append() 寫入中的標記檔（此次寫入的 partition 檔名及日期），metadata 更新完成後才刪除
+# partition 與 metadata 無法一起以一個檔案操作取代，中斷時以此檔補上 metadata（見 recover_append()）
+def pending_path(csv_file_path):
+    return os.path.join(dataset_dir(csv_file_path), '_append.json')
+
+# 副程式：partition 的 key hash 索引檔（已排序的 uint64 陣列），與 partition 放在同一個日期資料夾，用來判斷資料是否已存在
+def part_keys_path(part_path):
+    return part_path[:-len('.parquet')] + '.keys.npy'
+
+# 副程式：以 KEY_COLUMNS 計算每一列的 64 位元 hash
+def key_hashes(data):
+    hashes = np.zeros(len(data), dtype='uint64')
+    for column in KEY_COLUMNS:
+        if column in data:
+            values = data[column].to_numpy(dtype=object) if column == 'Id' else data[column].to_numpy()
+            hashes = hashes * np.uint64(1000003) ^ pd.util.hash_array(values)
+    return hashes
+
+# 副程式：先寫到暫存檔再取代，避免中斷時留下不完整的檔案
+def write_json_atomic(path, value):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def write_keys_atomic(path, keys):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, keys)
+    os.replace(tmp_path, path)
+
+# 寫入新資料後呼叫的函式：{資料集名稱: [function(csv_file_path, data)]}，例如 cube.py 以此增量更新彙總表
+append_listeners = {}
+
+# 副程式：註冊 append() 寫入新資料後要呼叫的函式，data 為實際寫入（已去除重複）的資料
+def on_append(dataset_name, function):
+    append_listeners.setdefault(dataset_name, []).append(function)
+
+# 副程式：空的 metadata
+def empty_meta():
+    return {'version': SCHEMA_VERSION, 'last_timestamp': 0, 'row_count': 0, 'max_block': None, 'last_part': None}
+
+# 副程式：將新寫入的資料加入 metadata 的統計
+def add_to_meta(meta, data):
+    if len(data) == 0:
+        return meta
+    meta['last_timestamp'] = max(meta['last_timestamp'], int(data['Timestamp'].max()))
+    meta['row_count'] += len(data)
+    if 'BlockNumber' in data:
+        meta['max_block'] = max(meta['max_block'] or 0, int(data['BlockNumber'].max()))
+    return meta
+
+# 副程式：由資料重新建立 metadata 及每個 partition 的 key hash 索引（舊版資料或檔案遺失時使用）
+def rebuild_index(csv_file_path):
+    root = dataset_dir(csv_file_path)
+    meta = empty_meta()
+    for day in list_days(csv_file_path):
+        day_dir = os.path.join(root, f'date={day}')
+        for part_name in sorted(name for name in os.listdir(day_dir) if name.endswith('.parquet')):
+            part_path = os.path.join(day_dir, part_name)
+            part_data = pd.read_parquet(part_path)
+            write_keys_atomic(part_keys_path(part_path), np.unique(key_hashes(part_data)))
+            add_to_meta(meta, part_data)
+    write_json_atomic(meta_path(csv_file_path), meta)
+    # 已由所有 partition 重新計算，不需要再補上中斷的寫入
+    if os.path.exists(pending_path(csv_file_path)):
+        os.remove(pending_path(csv_file_path))
+    # 第 2 版以前整個資料集共用的 key hash 索引檔
+    if os.path.exists(os.path.join(root, '_keys.npy')):
+        os.remove(os.path.join(root, '_keys.npy'))
+    return meta
+
+# 副程式：讀取 metadata，只需要讀取一個小檔案，不需要讀取資料本身；上次的 append() 中斷時先補上 metadata
+def read_meta(csv_file_path):
+    if not os.path.exists(meta_path(csv_file_path)):
+        return rebuild_index(csv_file_path)
+    with open(meta_path(csv_file_path)) as f:
+        meta = json.load(f)
+    if os.path.exists(pending_path(csv_file_path)):
+        meta = recover_append(csv_file_path, meta)
+    return meta
+
+# 副程式：append() 寫入 partition 之後、更新 metadata 之前中斷時，只讀取標記檔中列出的 partition 補上 metadata
+# metadata 的 last_part 已是該次寫入時，表示 metadata 已更新、只是標記檔還沒刪除
+def recover_append(csv_file_path, meta):
+    with open(pending_path(csv_file_path)) as f:
+        pending = json.load(f)
+    if meta.get('last_part') != pending['part']:
+        for day in pending['days']:
+            part_path = os.path.join(dataset_dir(csv_file_path), f'date={day}', pending['part'])
+            if os.path.exists(part_path):
+                add_to_meta(meta, pd.read_parquet(part_path))
+        meta['last_part'] = pending['part']
+        write_json_atomic(meta_path(csv_file_path), meta)
+    os.remove(pending_path(csv_file_path))
+    return meta
+
+# 副程式：讀取一天所有 partition 的 key hash（已排序、不重複）
+# 重複的資料 Timestamp 相同，一定在同一天，因此寫入時只需要讀取新資料所在日期的索引，成本與資料集的大小無關
+# 缺少索引檔的 partition（例如寫入時中斷）會由資料重新計算
+def read_day_keys(day_dir):
+    if not os.path.isdir(day_dir):
+        return np.zeros(0, dtype='uint64')
+    keys = []
+    for part_name in sorted(name for name in os.listdir(day_dir) if name.endswith('.parquet')):
+        part_path = os.path.join(day_dir, part_name)
+        keys_path = part_keys_path(part_path)
+        if not os.path.exists(keys_path):
+            write_keys_atomic(keys_path, np.unique(key_hashes(pd.read_parquet(part_path))))
+        keys.append(np.load(keys_path))
+    return np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype='uint64')
+
+# 副程式：將資料依日期寫入新的 partition 檔，不會改寫既有的檔案，回傳實際寫入的筆數
+# dedupe=True 時，會以新資料所在日期的 key hash 索引略過已存在（或此次資料中重複）的資料，成本只和新資料及這幾天的筆數有關
+# 每個新的 partition 另外寫入只含自己的 key hash 索引檔，既有的索引檔不會改寫；metadata 以「暫存檔 + 取代」的方式更新
+# 寫入 partition 前先寫入標記檔，metadata 更新後才刪除，中斷時下次讀取 metadata 會補上（見 recover_append()）
+def append(csv_file_path, data, dedupe=True):
+    if len(data) == 0:
+        return 0
+    data = normalize(data)
+    root = dataset_dir(csv_file_path)
+    os.makedirs(root, exist_ok=True)
+    days = pd.to_datetime(data['Timestamp'], unit='s', utc=True).dt.strftime('%Y-%m-%d')
+    keys = key_hashes(data)
+    if dedupe:
+        existing_keys = [read_day_keys(os.path.join(root, f'date={day}')) for day in days.unique()]
+        existing_keys = np.unique(np.concatenate(existing_keys)) if existing_keys else np.zeros(0, dtype='uint64')
+        # existing_keys 已排序，以二分搜尋判斷每一筆是否已存在
+        position = np.searchsorted(existing_keys, keys)
+        found = np.zeros(len(keys), dtype=bool)
+        if len(existing_keys):
+            found = existing_keys[np.clip(position, 0, len(existing_keys) - 1)] == keys
+        keep = ~found & ~pd.Series(keys).duplicated().to_numpy()
+        data = data[keep]
+        keys = keys[keep]
+        days = days[keep]
+        if len(data) == 0:
+            return 0
+    meta = read_meta(csv_file_path) if os.path.exists(meta_path(csv_file_path)) else empty_meta()
+    # 以寫入時間（奈秒）作為檔名，讓同一天的 partition 依寫入順序排列
+    part_name = f'part-{time.time_ns()}.parquet'
+    groups = data.groupby(days.to_numpy(), sort=True).indices
+    write_json_atomic(pending_path(csv_file_path), {'part': part_name, 'days': sorted(groups)})
+    for day, positions in groups.items():
+        day_dir = os.path.join(root, f'date={day}')
+        os.makedirs(day_dir, exist_ok=True)
+        part_path = os.path.join(day_dir, part_name)
+        tmp_path = part_path + '.tmp'
+        data.iloc[positions].to_parquet(tmp_path, index=False, compression='zstd')
+        os.replace(tmp_path, part_path)
+        # 先寫入 partition 再寫入索引檔，中斷時缺少的索引檔會在下次讀取時重新計算
+        write_keys_atomic(part_keys_path(part_path), np.unique(keys[positions]))
+    # 更新 metadata 後刪除標記檔
+    add_to_meta(meta, data)
+    meta['last_part'] = part_name
+    write_json_atomic(meta_path(csv_file_path), meta)
+    os.remove(pending_path(csv_file_path))
+    instrument.count(f'rows_ingested.{os.path.basename(root)}', len(data))
+    for function in append_listeners.get(os.path.basename(root), []):
+        function(csv_file_path, data)
+    return len(data)
+
+# 副程式：讀取資料集，只讀取 columns 指定的欄位、[start, end) 時間範圍內及符合 filters（見 iter_dataset()）的資料
+def load(csv_file_path, columns=None, start=None, end=None, filters=None):
+    exists(csv_file_path)
+    return read_dataset(csv_file_path, columns, start, end, filters)
+
+def read_dataset(csv_file_path, columns=None, start=None, end=None, filters=None):
+    parts = list(iter_dataset(csv_file_path, columns, start, end, filters))
+    if not parts:
+        return pd.DataFrame(columns=list(columns) if columns is not None else ['Timestamp'])
+    # 每天的資料已排序，且日期資料夾依日期讀取，合併後即為依 Timestamp 排序
+    return concat_parts(parts)
+
+# 副程式：逐天讀取資料集，每次回傳一天（已依 Timestamp 排序）的 DF，記憶體用量只和一天的資料量有關
+# columns：只讀取這些欄位；[start, end)：只讀取時間範圍內的日期資料夾，並在讀取 Parquet 時就篩掉範圍外的資料
+# filters：pyarrow 的 DNF 條件（[[(欄位, 運算子, 值), ...], ...]，內層為 AND、外層為 OR），例如 pairs.pair_filters() 的交易對條件，同樣在讀取時套用
+# Token 地址及 Method 以 categorical 讀取，每個不同的值只保存一次
+def iter_dataset(csv_file_path, columns=None, start=None, end=None, filters=None):
+    root = dataset_dir(csv_file_path)
+    days = list_days(csv_file_path)
+    if start is not None:
+        days = [day for day in days if day >= day_of(start)]
+    if end is not None:
+        days = [day for day in days if day <= day_of(end - 1)]
+    # 為了排序及篩選時間範圍，讀取時一定要包含 Timestamp 欄位
+    read_columns = None if columns is None else list(dict.fromkeys(['Timestamp'] + list(columns)))
+    dictionary_columns = [column for column in CATEGORICAL_COLUMNS if read_columns is None or column in read_columns]
+    for index, day in enumerate(days):
+        # 只有頭尾兩天需要以 Timestamp 篩選，中間的日期整天都在範圍內
+        time_filters = []
+        if start is not None and index == 0:
+            time_filters.append(('Timestamp', '>=', start))
+        if end is not None and index == len(days) - 1:
+            time_filters.append(('Timestamp', '<', end))
+        day_filters = [conjunction + time_filters for conjunction in filters] if filters else (time_filters or None)
+        day_dir = os.path.join(root, f'date={day}')
+        parts = []
+        for part_name in sorted(name for name in os.listdir(day_dir) if name.endswith('.parquet')):
+            part_path = os.path.join(day_dir, part_name)
+            parts.append(pd.read_parquet(part_path, columns=read_columns, filters=day_filters, read_dictionary=dictionary_columns or None))
+        if not parts:
+            continue
+        day_data = concat_parts(parts)
+        if len(day_data) == 0:
+            continue
+        if not day_data['Timestamp'].is_monotonic_increasing:
+            day_data = day_data.sort_values(by='Timestamp', ascending=True, kind='stable', ignore_index=True)
+        yield day_data if columns is None else day_data[list(columns)]
+
+# 副程式：合併多個 DF，categorical 欄位先統一為相同的類別，合併後才不會變回字串
+def concat_parts(parts):
+    if len(parts) == 1:
+        return parts[0].reset_index(drop=True)
+    parts = list(parts)
+    for column in CATEGORICAL_COLUMNS:
+        if column in parts[0] and all(isinstance(part[column].dtype, pd.CategoricalDtype) for part in parts):
+            categories = pd.api.types.union_categoricals([part[column] for part in parts]).categories
+            parts = [part.assign(**{column: part[column].cat.set_categories(categories)}) for part in parts]
+    return pd.concat(parts, ignore_index=True)
+
+# 副程式：取得資料集最後的 Timestamp（秒），只需要讀取 metadata
+def last_timestamp(csv_file_path):
+    if not exists(csv_file_path):
+        return 0
+    return read_meta(csv_file_path)['last_timestamp']
+
+# 副程式：將每一天的多個 partition 合併為一個檔案，減少檔案數量
+def compact(csv_file_path):
+    root = dataset_dir(csv_file_path)
+    for day in list_days(csv_file_path):
+        day_dir = os.path.join(root, f'date={day}')
+        part_names = sorted(name for name in os.listdir(day_dir) if name.endswith('.parquet'))
+        if len(part_names) <= 1:
+            continue
+        day_start = int(pd.Timestamp(day, tz='UTC').timestamp())
+        day_data = read_dataset(csv_file_path, start=day_start, end=day_start + SECONDS_PER_DAY)
+        merged_path = os.path.join(day_dir, part_names[-1])
+        tmp_path = merged_path + '.tmp'
+        day_data.to_parquet(tmp_path, index=False, compression='zstd')
+        # 先以合併後的檔案及索引取代最後一個 partition，再刪除其他 partition（中斷時最多留下重複資料，不會遺失資料）
+        os.replace(tmp_path, merged_path)
+        write_keys_atomic(part_keys_path(merged_path), np.unique(key_hashes(day_data)))
+        for part_name in part_names[:-1]:
+            part_path = os.path.join(day_dir, part_name)
+            os.remove(part_path)
+            if os.path.exists(part_keys_path(part_path)):
+                os.remove(part_keys_path(part_path))
+
+# 副程式：將舊版格式的資料集逐一改寫為目前的格式（SCHEMA_VERSION）
+def upgrade(csv_file_path):
+    version = 1
+    if os.path.exists(meta_path(csv_file_path)):
+        with open(meta_path(csv_file_path)) as f:
+            version = json.load(f).get('version', 1)
+    if version >= SCHEMA_VERSION:
+        return
+    root = dataset_dir(csv_file_path)
+    # 第 3 版只改變索引檔，資料本身不需要改寫
+    for day in list_days(csv_file_path) if version < 2 else []:
+        day_dir = os.path.join(root, f'date={day}')
+        for part_name in sorted(name for name in os.listdir(day_dir) if name.endswith('.parquet')):
+            part_path = os.path.join(day_dir, part_name)
+            part_data = normalize(pd.read_parquet(part_path))
+            part_data.to_parquet(part_path + '.tmp', index=False, compression='zstd')
+            os.replace(part_path + '.tmp', part_path)
+    rebuild_index(csv_file_path)
+    print(f'Note: {dataset_dir(csv_file_path)} 已升級至第 {SCHEMA_VERSION} 版格式')
+
+# 一次性轉換：將舊的 CSV 檔寫入資料庫（原本的 CSV 檔會保留）
+# 每次只讀取 CSV_CHUNK_ROWS 筆寫入，記憶體用量與 CSV 檔的大小無關；寫入完成後再將每天的 partition 合併為一個檔案
+# 先寫入暫存的資料集資料夾（<名稱>.migrating），全部完成後才以 os.replace 放到正式的位置
+# 中斷時正式的資料集仍不存在，下次讀取時會重新轉換，不會只轉換到一半
+def migrate_csv(csv_file_path):
+    directory, file_name = os.path.split(csv_file_path)
+    name, extension = os.path.splitext(file_name)
+    tmp_csv_file_path = os.path.join(directory, f'{name}.migrating{extension}')
+    tmp_root, root = dataset_dir(tmp_csv_file_path), dataset_dir(csv_file_path)
+    if os.path.exists(tmp_root):
+        shutil.rmtree(tmp_root)
+    for chunk in pd.read_csv(csv_file_path, parse_dates=False, dtype=CSV_DTYPES, chunksize=CSV_CHUNK_ROWS):
+        append(tmp_csv_file_path, chunk)
+    compact(tmp_csv_file_path)
+    os.makedirs(tmp_root, exist_ok=True)
+    # 正式的資料夾中沒有任何日期資料夾（否則不會轉換），只可能留有由資料計算的檔案（例如彙總表），可以直接刪除
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.replace(tmp_root, root)
+    print(f'Note: {csv_file_path} 已轉換至 {dataset_dir(csv_file_path)}')
+
+if __name__ == '__main__':
+    # python3 ./analysis/storage.py：將 data/ 底下所有含 Timestamp 欄位的 CSV 檔轉換至資料庫
+    for file_name in sorted(os.listdir('./data')):
+        csv_file_path = os.path.join('./data', file_name)
+        if not file_name.endswith('.csv') or list_days(csv_file_path):
+            continue
+        if 'Timestamp' in pd.read_csv(csv_file_path, nrows=0).columns:
+            migrate_csv(csv_file_path)
@@ -0,0 +1,240 @@
+import json
+import os
+import socketserver
+import threading
+import time
+import numpy as np
+import pandas as pd
+import cache
+import ethrpc
+import ids
+import index_price
+import index_transactionIndex
+import pairs
+import reference
+import stats
+import storage
+import utils
+from datetime import datetime
+
+# 持續執行的即時模式：依各自的間隔輪詢 Tokenlon Subgraph、CoinGecko 及 Ethereum 節點，只加入新的資料
+# 價格對應、偏離程度統計及 Tx Index 直方圖都在記憶體中逐筆更新，不需要每次重新讀取全部資料
+# 目前的狀態會寫入 STATE_PATH（JSON），也可以另外開一個 TCP port，連線後回傳同樣的 JSON
+
+# 各來源的輪詢間隔（秒）
+TAIL_INTERVALS = {
+    'tokenlon': 15,
+    'coingecko': 60,
+    'ethrpc': 15,
+}
+
+STATE_PATH = './data/tail_state.json'
+
+# 啟動時從資料庫載入最近多久（秒）的交易，作為偏離程度統計的初始狀態
+BOOTSTRAP_WINDOW = stats.DEFAULT_WINDOW
+
+# 狀態中保留的最近交易筆數
+RECENT_TRADES = 20
+
+# Tx Index 直方圖的 bin 寬度（與 index_transactionIndex.py 相同）
+TX_INDEX_BIN = 40
+
+class TailState:
+    def __init__(self, coins, window=stats.DEFAULT_WINDOW):
+        self.coins = coins
+        self.deviation_stats = stats.PairDeviationStats(window)
+        self.pairs = {}
+        self.references = {}
+        # 參考價格還沒有資料（例如新的資料庫、CoinGecko 尚未輪詢成功）時，先保留該 coin 的交易，取得參考價格後再加入
+        self.unpriced_trades = {coin: [] for coin in coins}
+        self.pending_tx_index = []
+        self.tx_index_counts = np.zeros(0, dtype='int64')
+        self.last_timestamp = 0
+        self.boundary_ids = set()
+        self.updated = {}
+        # 未設定 ETH 節點時不需要保留待取 Tx Index 的交易
+        self.track_tx_index = True
+
+    # 副程式：從資料庫載入初始狀態（只在啟動時執行一次）
+    def bootstrap(self):
+        for coin in self.coins:
+            csv_file_path = index_price.coin_csv_file_path[coin]
+            self.references[coin] = reference.series(coin, os.path.dirname(csv_file_path)).frame()[['Timestamp', 'Price']]
+        self.last_timestamp = utils.get_last_time(index_price.tokenlon_subgraph_file_path)
+        recent = utils.load_data(index_price.tokenlon_subgraph_file_path, start=self.last_timestamp - BOOTSTRAP_WINDOW)
+        self.boundary_ids = set(recent.loc[recent['Timestamp'] == self.last_timestamp, 'Id'])
+        self.add_trades(recent)
+        if utils.check_csv_file(index_transactionIndex.tokenlon_index_file_path):
+            indices = utils.load_data(index_transactionIndex.tokenlon_index_file_path, columns=['Index'])['Index'].to_numpy()
+            self.add_tx_indices(indices)
+
+    # 副程式：以新交易更新 coins（預設為全部）各交易對的價格及偏離程度統計（每筆 O(1)）
+    def add_trades(self, trades, coins=None):
+        if len(trades) == 0:
+            return
+        pair_index = pairs.PairIndex(trades)
+        for coin in coins or self.coins:
+            if len(self.references.get(coin, ())) == 0:
+                self.unpriced_trades[coin].append(trades)
+                continue
+            for direction in ('sell', 'buy'):
+                priced = pair_index.priced_trades(coin, 'tether', direction, index_price.min_quote_amount.get(coin))
+                if len(priced) == 0:
+                    continue
+                priced = utils.add_nearest_price_column(self.references[coin], priced)
+                pair_state = self.pairs.setdefault(f'{coin}-tether-{direction}', {'count': 0, 'outliers': 0, 'recent': []})
+                for timestamp, price, reference_price in zip(priced['Timestamp'], priced['Price'], priced['CoingeckoPrice']):
+                    z = self.deviation_stats.update((coin, direction), int(timestamp), price, reference_price)
+                    pair_state['count'] += 1
+                    if abs(z) > stats.DEFAULT_N:
+                        pair_state['outliers'] += 1
+                    pair_state['recent'].append({'Timestamp': int(timestamp), 'Price': float(price), 'CoingeckoPrice': float(reference_price), 'ZScore': None if np.isnan(z) else float(z)})
+                del pair_state['recent'][:-RECENT_TRADES]
+                rolling = self.deviation_stats.pairs[(coin, direction)]
+                pair_state['deviation_mean'] = rolling.mean
+                pair_state['deviation_std'] = None if np.isnan(rolling.std) else rolling.std
+
+    # 副程式：將 Tx Index 加入直方圖
+    def add_tx_indices(self, indices):
+        if len(indices) == 0:
+            return
+        counts = np.bincount(np.asarray(indices, dtype='int64') // TX_INDEX_BIN)
+        if len(counts) > len(self.tx_index_counts):
+            self.tx_index_counts = np.pad(self.tx_index_counts, (0, len(counts) - len(self.tx_index_counts)))
+        self.tx_index_counts[:len(counts)] += counts
+
+    # 副程式：輪詢 Tokenlon Subgraph，只保留 last_timestamp 之後（或同一秒但尚未看過）的交易
+    def poll_tokenlon(self):
+        new_rows = []
+        for page in utils.iter_tokenlon_pages(self.last_timestamp):
+            page = page[(page['Timestamp'] > self.last_timestamp) | ~page['Id'].isin(self.boundary_ids)]
+            if len(page):
+                new_rows.append(page)
+        if not new_rows:
+            return 0
+        new_trades = storage.normalize(pd.concat(new_rows, ignore_index=True))
+        utils.write_data(index_price.tokenlon_subgraph_file_path, new_trades)
+        last_timestamp = int(new_trades['Timestamp'].max())
+        if last_timestamp > self.last_timestamp:
+            self.boundary_ids = set()
+        self.boundary_ids.update(new_trades.loc[new_trades['Timestamp'] == last_timestamp, 'Id'])
+        self.last_timestamp = last_timestamp
+        self.add_trades(new_trades)
+        if self.track_tx_index:
+            self.pending_tx_index.append(new_trades[['Id', 'BlockNumber', 'Timestamp']])
+        return len(new_trades)
+
+    # 副程式：輪詢 CoinGecko，只加入比資料庫中最後一筆更新的資料，再重新取得參考價格序列
+    def poll_coingecko(self):
+        added = 0
+        for coin in self.coins:
+            csv_file_path = index_price.coin_csv_file_path[coin]
+            coin_price = storage.normalize(utils.get_coingecko_price(coin))
+            coin_price = coin_price[coin_price['Timestamp'] > utils.get_last_time(csv_file_path)]
+            if len(coin_price):
+                utils.write_data(csv_file_path, coin_price)
+                # 資料已更新，reference.series() 會重新合併各來源（格點之後的最新資料保留原始的時間及價格）
+                self.references[coin] = reference.series(coin, os.path.dirname(csv_file_path)).frame()[['Timestamp', 'Price']]
+                added += len(coin_price)
+                if self.unpriced_trades[coin] and len(self.references[coin]):
+                    unpriced, self.unpriced_trades[coin] = self.unpriced_trades[coin], []
+                    self.add_trades(pd.concat(unpriced, ignore_index=True), [coin])
+        return added
+
+    # 副程式：向 Ethereum 節點取得新交易的 Tx Index，加入資料庫及直方圖
+    # 只解析已有 ethrpc.CONFIRMATIONS 個確認的區塊：較新的區塊可能因鏈重組（reorg）而改變，而區塊內容及 Index 會永久寫入快取，留待之後的輪詢
+    def poll_ethrpc(self, node_url, tx_index_cache):
+        if not self.pending_tx_index:
+            return 0
+        pending = pd.concat(self.pending_tx_index, ignore_index=True)
+        head = ethrpc.fetch_block_number(node_url)
+        confirmed = pending['BlockNumber'].to_numpy(dtype='int64') <= head - ethrpc.CONFIRMATIONS
+        unconfirmed = [pending[~confirmed]] if not confirmed.all() else []
+        pending = pending[confirmed]
+        if len(pending):
+            indices = ethrpc.resolve_transaction_indices(node_url, ids.parse(pending['Id']).tx_hex(), pending['BlockNumber'], tx_index_cache, index_transactionIndex.tx_index_cache_path, head)
+            utils.write_data(index_transactionIndex.tokenlon_index_file_path, pending.assign(Index=indices))
+            self.add_tx_indices(indices)
+        self.pending_tx_index = unconfirmed
+        return len(pending)
+
+    # 副程式：目前的狀態（可轉為 JSON）
+    def snapshot(self):
+        return {
+            'updated': self.updated,
+            'last_timestamp': self.last_timestamp,
+            'references': {coin: {'Timestamp': int(reference['Timestamp'].iloc[-1]), 'Price': float(reference['Price'].iloc[-1])} for coin, reference in self.references.items() if len(reference)},
+            'pairs': self.pairs,
+            'tx_index_histogram': {'bin': TX_INDEX_BIN, 'counts': self.tx_index_counts.tolist()},
+            'pending_tx_index': int(sum(len(pending) for pending in self.pending_tx_index)),
+        }
+
+# 以 TCP 提供目前狀態：每次連線回傳一次 JSON 後關閉
+class StateHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        with self.server.lock:
+            body = self.server.body
+        self.request.sendall(body)
+
+# 副程式：在背景執行緒中開啟 TCP server，回傳 server（server.body 為最新的 JSON bytes）
+def serve_state(port):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', port), StateHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.body = b'{}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# 副程式：持續輪詢，直到中斷（Ctrl+C）；ticks 指定時只執行該次數（測試用）
+def run(coins=('ethereum', 'bitcoin'), state_path=STATE_PATH, port=None, intervals=None, ticks=None):
+    intervals = dict(TAIL_INTERVALS, **(intervals or {}))
+    # 輪詢間隔比快取的 TTL 短時，縮短 TTL，避免拿到快取中的舊結果
+    cache.SOURCE_TTL['tokenlon'] = min(cache.SOURCE_TTL['tokenlon'], intervals['tokenlon'] / 2)
+    cache.SOURCE_TTL['coingecko'] = min(cache.SOURCE_TTL['coingecko'], intervals['coingecko'] / 2)
+    state = TailState(list(coins))
+    state.bootstrap()
+    polls = {
+        'tokenlon': state.poll_tokenlon,
+        'coingecko': state.poll_coingecko,
+    }
+    node_url = utils.getenv("ETHEREUM_NODE_URL")
+    if node_url:
+        tx_index_cache = ethrpc.load_tx_index_cache(index_transactionIndex.tx_index_cache_path)
+        polls['ethrpc'] = lambda: state.poll_ethrpc(node_url, tx_index_cache)
+    else:
+        print('Note: 未設定 ETHEREUM_NODE_URL，不會更新 Tx Index')
+        state.track_tx_index = False
+    server = serve_state(port) if port else None
+    next_time = {source: 0.0 for source in polls}
+    tick = 0
+    try:
+        while ticks is None or tick < ticks:
+            now = time.monotonic()
+            for source, poll in polls.items():
+                if now < next_time[source]:
+                    continue
+                next_time[source] = now + intervals[source]
+                start = time.perf_counter()
+                try:
+                    added = poll()
+                except Exception as e:
+                    # 單一來源失敗時只印出錯誤，下次輪詢再試
+                    print(f'Note: 輪詢 {source} 失敗（{e!r}）')
+                    continue
+                state.updated[source] = datetime.now().astimezone().isoformat(timespec='seconds')
+                if added:
+                    print(f'{source}：新增 {added} 筆（{time.perf_counter() - start:.2f} 秒）')
+            snapshot = state.snapshot()
+            storage.write_json_atomic(state_path, snapshot)
+            if server is not None:
+                with server.lock:
+                    server.body = json.dumps(snapshot).encode()
+            tick += 1
+            if ticks is None or tick < ticks:
+                time.sleep(max(min(next_time.values()) - time.monotonic(), 0.1))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+    return state
@@ -0,0 +1,64 @@
+import numpy as np
+from datetime import datetime
+
+# 以二分搜尋查詢時間範圍，取代以布林遮罩篩選整個 DF 的寫法
+# 資料需依 Timestamp（int64 秒）遞增排序；時間範圍一律為 [start, end)，start 或 end 為 None 時表示不限制
+# 取出的資料為原資料的連續切片（view），不會複製資料，查詢成本為 O(log N + k)
+
+SECONDS_PER_DAY = 86400
+
+# 日期字串的格式，例如 "2023/03/20 00:00:00+0800"
+DATE_FORMAT = "%Y/%m/%d %H:%M:%S%z"
+
+# 副程式：將時間點轉為 Unix 時間（秒），可為秒數、日期字串或 datetime，None 維持 None
+def to_timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.strptime(value, DATE_FORMAT)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+# 副程式：將時間範圍轉為 (start, end) 的 Unix 時間（秒）
+# time_range 可為：
+#   None：整個時間範圍
+#   數字 N：到 last_timestamp 為止（包含）的最近 N 天，例如 3 或 0.5
+#   (start, end)：秒數、日期字串或 datetime，任一端可為 None
+def resolve(time_range, last_timestamp=None):
+    if time_range is None:
+        return None, None
+    if isinstance(time_range, (int, float)):
+        if last_timestamp is None:
+            raise ValueError("last_timestamp is required for a relative time range")
+        return int(last_timestamp - time_range * SECONDS_PER_DAY), int(last_timestamp) + 1
+    start, end = time_range
+    return to_timestamp(start), to_timestamp(end)
+
+# 副程式：時間範圍的文字標籤（檔名使用），例如 3d、20230320-20230323
+def label(time_range):
+    if time_range is None:
+        return 'all'
+    if isinstance(time_range, (int, float)):
+        return f'{time_range:g}d'
+    start, end = (datetime.strptime(value, DATE_FORMAT) if isinstance(value, str) else value for value in time_range)
+    return '-'.join('' if value is None else (f'{value:%Y%m%d}' if isinstance(value, datetime) else str(int(value))) for value in (start, end))
+
+# 副程式：以 searchsorted 找出已排序的 timestamps 中 [start, end) 的起訖位置
+def bounds(timestamps, start=None, end=None):
+    timestamps = np.asarray(timestamps)
+    lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+    hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='left'))
+    return lo, max(lo, hi)
+
+# 副程式：取出 data（依 column 遞增排序的 DF）在 [start, end) 內的連續切片
+def view(data, start=None, end=None, column='Timestamp'):
+    if start is None and end is None:
+        return data
+    lo, hi = bounds(data[column].to_numpy(), start, end)
+    return data.iloc[lo:hi]
+
+# 副程式：同 view()，但另外保留 start 之前的一筆資料（例如參考價格線需要從範圍的左端畫起）
+def view_with_previous(data, start=None, end=None, column='Timestamp'):
+    lo, hi = bounds(data[column].to_numpy(), start, end)
+    return data.iloc[max(lo - 1, 0):hi]
@@ -1,103 +1,269 @@
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import numpy as np
 import os
-import requests
 import json
 import pandas as pd
+import lazy
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta
-from pycoingecko import CoinGeckoAPI
-from dotenv import load_dotenv
+import storage
+# 載入時會向 storage 註冊，寫入 Tokenlon 資料時同時更新彙總表
+import cube
+import cache
+import lod
+import stats
+import timerange
+import instrument
 
-# 副程式：取得 Tokenlon Subgraph 的 Query
-def get_tokenlon_graphql_query(gte_timestamp, skip):
+# 繪圖及網路相關的套件在第一次使用時才載入，只取資料或只讀取資料庫時不需要付出載入 matplotlib 的時間
+plt = lazy.module('matplotlib.pyplot')
+mdates = lazy.module('matplotlib.dates')
+requests = lazy.module('requests')
+pycoingecko = lazy.module('pycoingecko')
+dotenv = lazy.module('dotenv')
+
+_dotenv_loaded = False
+
+# 副程式：取得環境變數，第一次呼叫時才從 .env 檔案載入（整個程式只載入一次）
+def getenv(name):
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        dotenv.load_dotenv()
+        _dotenv_loaded = True
+    return os.getenv(name)
+
+# 副程式：計算 90 天前的 timestamp，並取到整點，讓同一小時內的查詢內容相同而可以使用快取
+def days_90_hour_timestamp():
+    days_90_timestamp = int((datetime.now() - timedelta(days=90)).timestamp())
+    return days_90_timestamp - days_90_timestamp % 3600
+
+# GraphQL 請求的逾時時間（秒），避免單一請求卡住整個更新流程
+GRAPH_TIMEOUT = 60
+
+# 副程式：送出 GraphQL 請求並回傳 data 欄位，相同的請求會先查本地快取
+# note 只有在實際向網路要取資料時才會印出
+def post_graphql(source, url, query, note, immutable=False):
+    def fetch():
+        with instrument.stage(f'http.{source}'):
+            r = requests.post(url, json={'query': query}, timeout=GRAPH_TIMEOUT)
+        instrument.count_http(source, len(r.content))
+        print(note)
+        return json.loads(r.text)['data']
+    return cache.cached(source, {'url': url, 'query': query}, fetch, immutable)
+
+# Tokenlon Subgraph 各 entity 的設定：時間欄位、要取出的欄位，以及 Method 欄位的值
+# limitOrders 的 Method 由 limitOrderType 欄位自帶，因此設為 None
+TOKENLON_ENTITIES = {
+    'swappeds': {
+        'timestamp': 'timestamp',
+        'fields': ["id", "blockNumber", "timestamp", "makerAssetAddr", "settleAmount", "takerAssetAddr", "takerAssetAmount"],
+        'method': 'amm',
+    },
+    'fillOrders': {
+        'timestamp': 'timestamp',
+        'fields': ["id", "blockNumber", "timestamp", "makerAssetAddr", "settleAmount", "takerAssetAddr", "takerAssetAmount"],
+        'method': 'pmmOrRfq',
+    },
+    'limitOrders': {
+        'timestamp': 'blockTimestamp',
+        'fields': ["id", "blockNumber", "blockTimestamp", "makerToken", "makerTokenFilledAmount", "takerToken", "takerTokenFilledAmount", "limitOrderType"],
+        'method': None,
+    },
+}
+
+# 各 entity 欄位對應到 tokenlon_subgraph.csv 的統一欄位名稱
+TOKENLON_RENAME = {"id": "Id", "blockNumber": "BlockNumber", "timestamp": "Timestamp", "blockTimestamp": "Timestamp", "makerAssetAddr": "MakerToken", "makerToken": "MakerToken", "settleAmount": "MakerAmount", "makerTokenFilledAmount": "MakerAmount", "takerAssetAddr": "TakerToken", "takerToken": "TakerToken", "takerAssetAmount": "TakerAmount", "takerTokenFilledAmount": "TakerAmount", "limitOrderType": "Method"}
+TOKENLON_COLUMNS = ["Id", "BlockNumber", "Timestamp", "MakerToken", "MakerAmount", "TakerToken", "TakerAmount", "Method"]
+
+# The Graph 一次最多只能取 1000 筆資料
+GRAPH_PAGE_SIZE = 1000
+
+# 副程式：以 (timestamp, id) 游標取得單一 entity 的 Query
+# 與 skip 不同，游標查詢的成本不會隨著已讀取的筆數增加
+def get_tokenlon_cursor_query(entity, cursor_timestamp, cursor_id, first=GRAPH_PAGE_SIZE):
+    config = TOKENLON_ENTITIES[entity]
+    ts = config['timestamp']
+    if cursor_id is None:
+        # 第一頁：從 cursor_timestamp（含）開始
+        where = f'{{{ts}_gte: "{cursor_timestamp}"}}'
+    else:
+        # 之後的頁：時間較晚，或時間相同但 id 較大的資料
+        where = f'{{or: [{{{ts}_gt: "{cursor_timestamp}"}}, {{{ts}: "{cursor_timestamp}", id_gt: "{cursor_id}"}}]}}'
+    fields = "\n    ".join(config['fields'])
     return f"""{{
-  swappeds(
-    first: 1000
-    skip: {skip}
-    orderBy: timestamp
-    orderDirection: desc
-    where: {{timestamp_gte: {gte_timestamp}}}
+  {entity}(
+    first: {first}
+    orderBy: {ts}
+    orderDirection: asc
+    where: {where}
   ) {{
-    id
-    blockNumber
-    timestamp
-    makerAssetAddr
-    settleAmount
-    takerAssetAddr
-    takerAssetAmount
-  }}
-  fillOrders(
-    first: 1000
-    skip: {skip}
-    orderBy: timestamp
-    orderDirection: desc
-    where: {{timestamp_gte: {gte_timestamp}}}
-  ) {{
-    id
-    blockNumber
-    timestamp
-    makerAssetAddr
-    settleAmount
-    takerAssetAddr
-    takerAssetAmount
-  }}
-  limitOrders(
-    first: 1000
-    skip: {skip}
-    orderBy: blockTimestamp
-    orderDirection: desc
-    where: {{blockTimestamp_gte: "{gte_timestamp}"}}
-  ) {{
-    id
-    blockNumber
-    blockTimestamp
-    makerToken
-    makerTokenFilledAmount
-    takerToken
-    takerTokenFilledAmount
-    limitOrderType
+    {fields}
   }}
 }}"""
 
-# 副程式：從 The Graph 中取出
-def get_tokenlon_data(skip):
-    # 從 .env 檔案取得 GRAPH_URL 參數
-    load_dotenv()
-    GRAPH_URL = os.getenv("GRAPH_URL")
-    # 計算 90 天前的 timestamp
-    days_90_timestamp = int((datetime.now() - timedelta(days=90)).timestamp())
-    query = get_tokenlon_graphql_query(days_90_timestamp, skip)
-    # 建立 GraphQL query 的請求
-    r = requests.post(GRAPH_URL, json={'query': query})
-    print('Note: Use The Tokenlon Graph API')
-    # 從回傳的結果中提取出需要的資料
-    query_data = json.loads(r.text)['data']
-    # 取出 swappeds，重新命名，並增加一個 method 欄位，均存放 amm 字串值
-    swappeds = pd.DataFrame(query_data['swappeds'], columns=["id", "blockNumber", "timestamp", "makerAssetAddr", "settleAmount", "takerAssetAddr", "takerAssetAmount"])
-    swappeds = swappeds.rename(columns={"id": "Id", "blockNumber": "BlockNumber", "timestamp": "Timestamp", "makerAssetAddr": "MakerToken", "settleAmount": "MakerAmount", "takerAssetAddr": "TakerToken", "takerAssetAmount": "TakerAmount"})
-    swappeds = swappeds.assign(Method="amm")
-    # 取出 fillOrders，並增加一個 method 欄位，均存放 pmmOrRfq 字串值
-    fillOrders = pd.DataFrame(query_data['fillOrders'], columns=["id", "blockNumber", "timestamp", "makerAssetAddr", "settleAmount", "takerAssetAddr", "takerAssetAmount"])
-    fillOrders = fillOrders.rename(columns={"id": "Id", "blockNumber": "BlockNumber", "timestamp": "Timestamp", "makerAssetAddr": "MakerToken", "settleAmount": "MakerAmount", "takerAssetAddr": "TakerToken", "takerAssetAmount": "TakerAmount"})
-    fillOrders = fillOrders.assign(Method="pmmOrRfq")
-    # 取出 limitOrders，並自帶一個 method 欄位，存放 limitOrderType
-    limitOrders = pd.DataFrame(query_data['limitOrders'], columns=["id", "blockNumber", "blockTimestamp", "makerToken", "makerTokenFilledAmount", "takerToken", "takerTokenFilledAmount", "limitOrderType"])
-    limitOrders = limitOrders.rename(columns={"id": "Id", "blockNumber": "BlockNumber", "blockTimestamp": "Timestamp", "makerToken": "MakerToken", "makerTokenFilledAmount": "MakerAmount", "takerToken": "TakerToken", "takerTokenFilledAmount": "TakerAmount", "limitOrderType": "Method"})
-    # 將這 3 個變數組合在一起，並使用 Timestamp 進行遞增排序
-    merged_data = pd.concat([swappeds, fillOrders, limitOrders], ignore_index=True)
-    merged_data["Timestamp"] = merged_data["Timestamp"].astype(int)
-    return merged_data.sort_values(by="Timestamp", ascending=True)
+# 副程式：將單一 entity 的查詢結果轉成 tokenlon_subgraph.csv 的統一格式
+def tokenlon_entity_to_df(entity, rows):
+    config = TOKENLON_ENTITIES[entity]
+    data = pd.DataFrame(rows, columns=config['fields']).rename(columns=TOKENLON_RENAME)
+    if config['method'] is not None:
+        data = data.assign(Method=config['method'])
+    data["Timestamp"] = data["Timestamp"].astype(int)
+    return data[TOKENLON_COLUMNS]
+
+# 副程式：讀取游標檢查點，檔案不存在時從 gte_timestamp 開始
+def load_tokenlon_cursor(checkpoint_path, gte_timestamp):
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            return json.load(f)
+    return {entity: {'timestamp': int(gte_timestamp), 'id': None, 'done': False} for entity in TOKENLON_ENTITIES}
+
+# 副程式：寫入游標檢查點，先寫到暫存檔再取代，避免中斷時留下不完整的檔案
+def save_tokenlon_cursor(checkpoint_path, cursor):
+    if checkpoint_path is None:
+        return
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cursor, f)
+    os.replace(tmp_path, checkpoint_path)
+
+# 副程式：以游標向 The Graph 取出單一 entity 的一頁資料
+def fetch_tokenlon_entity_page(graph_url, entity, cursor_timestamp, cursor_id):
+    query = get_tokenlon_cursor_query(entity, cursor_timestamp, cursor_id)
+    # 取滿一頁的結果之後不會再改變，可以永久快取；不足一頁（最新的資料）則依 TTL 過期
+    query_data = post_graphql('tokenlon', graph_url, query, f'Note: Use The Tokenlon Graph API ({entity})', immutable=lambda data: len(data[entity]) == GRAPH_PAGE_SIZE)
+    return query_data[entity]
+
+# 副程式：合併多個各自已依 column 排序的 DF，結果依 column 排序（相同值時依 frames 的順序，與 stable sort 相同）
+# 不需要重新排序：每一列在結果中的位置 = 在自己 DF 中的位置 + 其他 DF 中排在它之前的列數（以二分搜尋計算）
+def merge_sorted(frames, column):
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    values = [frame[column].to_numpy() for frame in frames]
+    positions = []
+    for i, own in enumerate(values):
+        position = np.arange(len(own))
+        for j, other in enumerate(values):
+            if j != i:
+                position = position + np.searchsorted(other, own, side='right' if j < i else 'left')
+        positions.append(position)
+    order = np.empty(sum(len(own) for own in values), dtype='int64')
+    order[np.concatenate(positions)] = np.arange(len(order))
+    return pd.concat(frames, ignore_index=True).take(order).reset_index(drop=True)
+
+# 產生器：swappeds、fillOrders 及 limitOrders 各自以游標獨立分頁，並同時向 The Graph 發出請求
+# 已取完（回傳不足一頁）的 entity 不會再被查詢；進度較快的 entity 最多只預先緩衝 max_buffered_pages 頁
+# 各 entity 的頁面本身已依 (timestamp, id) 排序，因此只要把所有 entity 都已取到的時間（watermark）以前的資料
+# 做多路合併後 yield 出去即可，整體輸出依 Timestamp 遞增排序，不需要最後再全部 concat 後重新排序
+# 呼叫端處理完該頁並要求下一頁時，才會將「已輸出」的游標寫入 checkpoint_path，中斷後可從該處繼續
+# 全部取完後會刪除 checkpoint_path
+def iter_tokenlon_pages(gte_timestamp, checkpoint_path=None, max_buffered_pages=2):
+    GRAPH_URL = getenv("GRAPH_URL")
+    # cursor：已輸出的位置（寫入檢查點）；fetched：已向 The Graph 取到的位置
+    cursor = load_tokenlon_cursor(checkpoint_path, gte_timestamp)
+    fetched = {entity: dict(state) for entity, state in cursor.items()}
+    buffers = {entity: tokenlon_entity_to_df(entity, []) for entity in TOKENLON_ENTITIES}
+    futures = {}
+    executor = ThreadPoolExecutor(max_workers=len(TOKENLON_ENTITIES))
+    try:
+        while True:
+            # 替還沒取完、沒有請求進行中、且緩衝未滿的 entity 送出下一頁的請求
+            for entity, state in fetched.items():
+                if state['done'] or entity in futures.values():
+                    continue
+                if len(buffers[entity]) >= max_buffered_pages * GRAPH_PAGE_SIZE:
+                    continue
+                future = executor.submit(fetch_tokenlon_entity_page, GRAPH_URL, entity, state['timestamp'], state['id'])
+                futures[future] = entity
+            if not futures:
+                break
+            # 等到任一 entity 回傳後，就先處理該頁
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                entity = futures.pop(future)
+                rows = future.result()
+                if len(rows) < GRAPH_PAGE_SIZE:
+                    fetched[entity]['done'] = True
+                if rows:
+                    fetched[entity]['timestamp'] = int(rows[-1][TOKENLON_ENTITIES[entity]['timestamp']])
+                    fetched[entity]['id'] = rows[-1]['id']
+                    buffers[entity] = pd.concat([buffers[entity], tokenlon_entity_to_df(entity, rows)], ignore_index=True)
+            # 所有未取完的 entity 都已取到 watermark，之前的資料不會再有新的加入
+            pending = [state['timestamp'] for state in fetched.values() if not state['done']]
+            watermark = min(pending) if pending else np.inf
+            ready = []
+            for entity, buffer in buffers.items():
+                n = int(np.searchsorted(buffer['Timestamp'].to_numpy(), watermark, side='right'))
+                if n > 0:
+                    ready.append(buffer.iloc[:n])
+                    buffers[entity] = buffer.iloc[n:].reset_index(drop=True)
+                    cursor[entity]['timestamp'] = int(buffer['Timestamp'].iloc[n - 1])
+                    cursor[entity]['id'] = buffer['Id'].iloc[n - 1]
+                cursor[entity]['done'] = fetched[entity]['done'] and buffers[entity].empty
+            if ready:
+                # 每個 entity 的資料都已依 Timestamp 排序，直接合併
+                yield merge_sorted(ready, 'Timestamp')
+            save_tokenlon_cursor(checkpoint_path, cursor)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+# 以排序後的 reference 陣列對 data 的 Timestamp 做二分搜尋（as-of join），全程向量化
+# direction：'nearest' 取最靠近、'backward' 取不晚於、'forward' 取不早於的 reference 點
+# interpolate=True 時，改以前後兩個 reference 點做線性內插
+# 回傳 data 的複本，並新增 price_column、{price_column}Timestamp（對應的 reference 時間）及 TimeGap（時間差）三個欄位
+def asof_join(reference, data, direction='nearest', interpolate=False, price_column='CoingeckoPrice', on='Timestamp', value='Price'):
+    if direction not in ('nearest', 'backward', 'forward'):
+        raise ValueError(f"Unknown direction: {direction}")
+    # reference 必須以時間遞增排序，已排序時不會複製資料
+    ref_timestamps = reference[on].to_numpy(dtype=float)
+    ref_prices = reference[value].to_numpy(dtype=float)
+    if len(ref_timestamps) == 0:
+        raise ValueError("Reference data must not be empty")
+    if np.any(ref_timestamps[1:] < ref_timestamps[:-1]):
+        order = np.argsort(ref_timestamps, kind='stable')
+        ref_timestamps = ref_timestamps[order]
+        ref_prices = ref_prices[order]
+    timestamps = data[on].to_numpy(dtype=float)
+    last = len(ref_timestamps) - 1
+    # right：第一個大於 timestamp 的位置；left：第一個大於等於 timestamp 的位置
+    right = np.searchsorted(ref_timestamps, timestamps, side='right')
+    left = np.searchsorted(ref_timestamps, timestamps, side='left')
+    backward_index = right - 1
+    forward_index = left
+    if direction == 'backward':
+        index = backward_index
+        valid = index >= 0
+    elif direction == 'forward':
+        index = forward_index
+        valid = index <= last
+    else:
+        # 前後兩點取距離較近者，距離相同時取前一點（與原本 argsort 的結果一致）
+        before = np.clip(backward_index, 0, last)
+        after = np.clip(forward_index, 0, last)
+        use_after = np.abs(ref_timestamps[after] - timestamps) < np.abs(timestamps - ref_timestamps[before])
+        index = np.where(use_after, after, before)
+        valid = np.ones(len(timestamps), dtype=bool)
+    safe_index = np.clip(index, 0, last)
+    matched_timestamps = np.where(valid, ref_timestamps[safe_index], np.nan)
+    if interpolate:
+        # np.interp 在兩端會沿用端點值，超出範圍的部份依 direction 設為 NaN
+        prices = np.interp(timestamps, ref_timestamps, ref_prices)
+        if direction == 'backward':
+            prices = np.where(timestamps < ref_timestamps[0], np.nan, prices)
+        elif direction == 'forward':
+            prices = np.where(timestamps > ref_timestamps[-1], np.nan, prices)
+    else:
+        prices = np.where(valid, ref_prices[safe_index], np.nan)
+    result = data.copy()
+    result[price_column] = prices
+    result[f'{price_column}Timestamp'] = matched_timestamps
+    result['TimeGap'] = timestamps - matched_timestamps
+    return result
 
 # 將 subgraph_price 的 Timestamp 對 coingecko_price 搜尋最靠近的 Price 值
 # 並寫入 subgraph_price 第 3 個 CoingeckoPrice Column 中
-def add_nearest_price_column(coingecko_price, subgraph_price):
-    def find_nearest_price(timestamp):
-        nearest_timestamp = coingecko_price['Timestamp'].iloc[(coingecko_price['Timestamp']-timestamp).abs().argsort()[0]]
-        nearest_price = coingecko_price.loc[coingecko_price['Timestamp'] == nearest_timestamp, 'Price'].iloc[0]
-        return nearest_price
-    subgraph_price['CoingeckoPrice'] = subgraph_price['Timestamp'].apply(find_nearest_price)
-    return subgraph_price
+def add_nearest_price_column(coingecko_price, subgraph_price, direction='nearest', interpolate=False):
+    return asof_join(coingecko_price, subgraph_price, direction=direction, interpolate=interpolate)
 
 # 副程式：取得 Tokenlon Subgraph 的 Query
 def get_uniswap3_graphql_query(gte_timestamp, skip):
@@ -119,14 +285,9 @@ def get_uniswap3_graphql_query(gte_timestamp, skip):
 }}"""
 
 def get_uniswap3_data(skip):
-    # 計算 90 天前的 timestamp
-    days_90_timestamp = int((datetime.now() - timedelta(days=90)).timestamp())
-    query = get_uniswap3_graphql_query(days_90_timestamp, skip)
-    # 建立 GraphQL query 的請求
-    r = requests.post("https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3", json={'query': query})
-    print('Note: Use The Uniswap V3 Graph API')
-    # 從回傳的結果中提取出需要的資料
-    query_data = json.loads(r.text)['data']
+    query = get_uniswap3_graphql_query(days_90_hour_timestamp(), skip)
+    # 建立 GraphQL query 的請求，並從回傳的結果中提取出需要的資料
+    query_data = post_graphql('uniswap3', "https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3", query, 'Note: Use The Uniswap V3 Graph API')
     tokenHourDatas = pd.json_normalize(query_data)
     # 取出 tokenHourDatas
     tokenHourDatas = pd.DataFrame(query_data['tokenHourDatas'], columns=["id", "periodStartUnix", "open", "high", "low", "close"])
@@ -160,234 +321,294 @@ def plot(name, data):
     # 顯示圖表
     plt.show()
 
+# 副程式：建立滑鼠提示使用的資料，轉成依 x 遞增排序的連續 NumPy 陣列，之後每次查詢只需要二分搜尋
+# x：繪圖時使用的 X 座標（Timestamp 或 matplotlib 的日期數值）
+def hover_series(line_name, x, timestamps, prices, reference_prices):
+    x = np.asarray(x, dtype='float64')
+    order = np.argsort(x, kind='stable')
+    return {
+        'name': line_name,
+        'x': np.ascontiguousarray(x[order]),
+        'timestamp': np.ascontiguousarray(np.asarray(timestamps, dtype='float64')[order]),
+        'price': np.ascontiguousarray(np.asarray(prices, dtype='float64')[order]),
+        'reference': np.ascontiguousarray(np.asarray(reference_prices, dtype='float64')[order]),
+    }
+
+# 副程式：將 Unix 時間（秒）向量化轉為 matplotlib 的日期數值（當地時間，與 datetime.fromtimestamp 相同）
+def timestamps_to_datenum(timestamps):
+    local_times = pd.to_datetime(np.asarray(timestamps, dtype='float64'), unit='s', utc=True).tz_convert(datetime.now().astimezone().tzinfo).tz_localize(None)
+    return mdates.date2num(local_times.to_numpy())
+
+# 副程式：以 searchsorted 找出 xs（已排序）中最接近 x 的位置
+def nearest_index(xs, x):
+    index = int(np.searchsorted(xs, x))
+    if index <= 0:
+        return 0
+    if index >= len(xs):
+        return len(xs) - 1
+    return index if xs[index] - x < x - xs[index - 1] else index - 1
+
+# 副程式：以 searchsorted 找出前後兩點，計算 x 位置的線性內插值
+def interp_at(xs, ys, x):
+    index = int(np.clip(np.searchsorted(xs, x), 1, len(xs) - 1))
+    x0, x1 = xs[index - 1], xs[index]
+    if x1 == x0:
+        return ys[index]
+    return ys[index - 1] + (ys[index] - ys[index - 1]) * (np.clip(x, x0, x1) - x0) / (x1 - x0)
+
+# 副程式：綁定滑鼠移動事件，在標題顯示最靠近滑鼠的線及點的 Price 資訊
+# 有多條線時，先以 Y 座標判斷最近的線，再以 X 座標找出該線上最近的點；format_title(line_name, time, price, reference_price) 回傳標題文字
+# 滑鼠事件會被合併，每 interval 毫秒最多更新一次；支援 blit 的後端只重畫標題，不重畫整張圖
+def connect_hover(fig, ax, series, format_title, interval=16):
+    series = [line for line in series if len(line['x'])]
+    if not series:
+        return
+    canvas = fig.canvas
+    title = ax.title
+    # 標題設為 animated，完整重畫時不會畫進背景，之後只需要在背景上重畫標題
+    title.set_animated(True)
+    state = {'background': None, 'pending': None, 'scheduled': False}
+
+    def on_draw(event):
+        # 存檔（例如工具列的儲存按鈕）時 matplotlib 會照常畫出 animated 的標題，且 event.canvas 可能是另一個 canvas（例如 SVG），不需要處理
+        if event.canvas.is_saving():
+            return
+        state['background'] = canvas.copy_from_bbox(fig.bbox) if canvas.supports_blit else None
+        # 以此次重畫使用的 renderer 畫上標題
+        title.draw(event.renderer)
+
+    def update():
+        state['scheduled'] = False
+        if state['pending'] is None:
+            return
+        x, y = state['pending']
+        state['pending'] = None
+        # 計算距離每條線的距離，取得最近的線
+        line = min(series, key=lambda line: abs(y - interp_at(line['x'], line['price'], x)))
+        # 取得最近的點的索引值
+        index = nearest_index(line['x'], x)
+        # 將 Timestamp 轉成人類看得懂的型式
+        time = datetime.fromtimestamp(line['timestamp'][index]).strftime('%Y-%m-%d %H:%M:%S')
+        title.set_text(format_title(line['name'], time, line['price'][index], line['reference'][index]))
+        if state['background'] is not None:
+            canvas.restore_region(state['background'])
+            ax.draw_artist(title)
+            canvas.blit(fig.bbox)
+        else:
+            canvas.draw_idle()
+
+    timer = canvas.new_timer(interval=interval)
+    timer.single_shot = True
+    timer.add_callback(update)
+
+    def on_move(event):
+        # 判斷滑鼠事件發生在 ax 這個子圖上，只記錄最新的位置，由計時器統一更新
+        if event.inaxes != ax or event.xdata is None:
+            return
+        state['pending'] = (event.xdata, event.ydata)
+        if not state['scheduled']:
+            state['scheduled'] = True
+            timer.start()
+
+    # 綁定事件處理器
+    canvas.mpl_connect('draw_event', on_draw)
+    canvas.mpl_connect('motion_notify_event', on_move)
+    # 保留計時器的參考，避免被回收
+    fig._hover_timer = timer
+
 # 繪製圖形，並透過滑鼠位置更新圖片上的 Price 資訊
-def plotMove(name, data):
-    timestamps, prices, coingeckoPrices = zip(*zip(data['Timestamp'], data['Price'], data['CoingeckoPrice']))
+def plotMove(name, data, time_range=None):
+    data = timerange.view(data, *resolve_time_range(time_range, data))
+    timestamps = data['Timestamp'].to_numpy(dtype='float64')
+    prices = data['Price'].to_numpy(dtype='float64')
+    coingeckoPrices = data['CoingeckoPrice'].to_numpy(dtype='float64')
     fig, ax = plt.subplots()
     ax.set_title(name)
     ax.set_xlabel('Timestamp')
     ax.set_ylabel('Price (USD)')
-    ax.plot(timestamps, prices, color='red', label='Price')
-    ax.plot(timestamps, coingeckoPrices, color='blue', label='Coingecko Price')
+    # 以降採樣後的資料繪製，縮放／平移時會依可見範圍重新取點，尖峰仍會保留
+    lod.plot(ax, timestamps, prices, color='red', label='Price')
+    lod.plot(ax, timestamps, coingeckoPrices, color='blue', label='Coingecko Price')
     ax.legend()
-    # 定義事件處理器
-    def on_move(event):
-        if event.inaxes == ax:
-            x, y = event.xdata, event.ydata
-            # 尋找最接近滑鼠位置的點
-            index = min(range(len(timestamps)), key=lambda i: abs(timestamps[i]-x))
-            # 將 Timestamp 轉成人類看得懂的型式
-            time = datetime.fromtimestamp(timestamps[index]).strftime('%Y-%m-%d %H:%M:%S')
-            price = prices[index]
-            coingeckoPrice = coingeckoPrices[index]
-            # 更新標題顯示價格
-            ax.set_title(f'{name} Time: {time}\nPrice: {price:.6f}, CoingeckoPrice: {coingeckoPrice:.6f}')
-            fig.canvas.draw()
-    # 綁定事件處理器
-    fig.canvas.mpl_connect('motion_notify_event', on_move)
+    # 綁定事件處理器，更新標題顯示價格
+    connect_hover(fig, ax, [hover_series('Price', timestamps, timestamps, prices, coingeckoPrices)],
+                  lambda line_name, time, price, coingeckoPrice: f'{name} Time: {time}\nPrice: {price:.6f}, CoingeckoPrice: {coingeckoPrice:.6f}')
     # 將 Y 軸的顯示範圍為 prices 的 3 倍標準差內的最小／大值
-    price_min, price_max = filtered_prices_max(prices)
-    coingeckoPrices_min, coingeckoPrices_max = filtered_prices_max(coingeckoPrices)
+    price_min, price_max = filtered_prices_max(prices, timestamps)
+    coingeckoPrices_min, coingeckoPrices_max = filtered_prices_max(coingeckoPrices, timestamps)
     plt.ylim(min(price_min, coingeckoPrices_min), max(price_max, coingeckoPrices_max))
     # 繪圖
     plt.show()
 
 # 繪製圖形，並透過滑鼠位置更新圖片上的 Price 資訊
-def plotMove2(name, coingecko_data, sell_coin_data, buy_coin_data):
-    # 只要留下 coingecko_data 的 Timestamp 大於 sell_coin_data 或 buy_coin_data 內的資料
-    min_timestamp = min(min(sell_coin_data['Timestamp']), min(buy_coin_data['Timestamp']))
-    last_index = (coingecko_data['Timestamp'] >= min_timestamp).idxmax() - 1
-    coingecko_data = coingecko_data.iloc[last_index:]
-    print(coingecko_data)
+def plotMove2(name, coingecko_data, sell_coin_data, buy_coin_data, time_range=0.5):
+    # 以二分搜尋取出 time_range 範圍內的資料（預設為最近 0.5 天），coingecko_data 另外保留範圍前的一筆，價格線才會從左端畫起
+    timestamp_start, timestamp_end = resolve_time_range(time_range, sell_coin_data, buy_coin_data)
+    sell_coin_data = timerange.view(sell_coin_data, timestamp_start, timestamp_end)
+    buy_coin_data = timerange.view(buy_coin_data, timestamp_start, timestamp_end)
+    coingecko_data = timerange.view_with_previous(coingecko_data, timestamp_start, timestamp_end)
     # 將資料轉成繪圖可以使用的格式
-    coingecko_timestamps, coingecko_prices = zip(*zip(coingecko_data['Timestamp'], coingecko_data['Price']))
-    sell_timestamps, sell_prices, sell_coingeckoPrices = zip(*zip(sell_coin_data['Timestamp'], sell_coin_data['Price'], sell_coin_data['CoingeckoPrice']))
-    buy_timestamps, buy_prices, buy_coingeckoPrices = zip(*zip(buy_coin_data['Timestamp'], buy_coin_data['Price'], buy_coin_data['CoingeckoPrice']))
+    coingecko_timestamps, coingecko_prices = coingecko_data['Timestamp'].to_numpy(dtype='float64'), coingecko_data['Price'].to_numpy(dtype='float64')
+    sell_timestamps, sell_prices, sell_coingeckoPrices = (sell_coin_data[column].to_numpy(dtype='float64') for column in ('Timestamp', 'Price', 'CoingeckoPrice'))
+    buy_timestamps, buy_prices, buy_coingeckoPrices = (buy_coin_data[column].to_numpy(dtype='float64') for column in ('Timestamp', 'Price', 'CoingeckoPrice'))
     fig, ax = plt.subplots()
     ax.set_title(name)
     ax.set_xlabel('Timestamp')
     ax.set_ylabel('Price (USD)')
-    ax.plot(buy_timestamps, buy_prices, color='blue', label='Buy Price')
-    ax.plot(sell_timestamps, sell_prices, color='red', label='Sell Price')
-    ax.plot(coingecko_timestamps, coingecko_prices, color='green', label='Coingecko Price')
-    # ax.plot(coingecko_timestamps, coingecko_prices, color='green', label='Uniswap V3 Price')
+    # 以降採樣後的資料繪製，縮放／平移時會依可見範圍重新取點，尖峰仍會保留
+    lod.plot(ax, buy_timestamps, buy_prices, color='blue', label='Buy Price')
+    lod.plot(ax, sell_timestamps, sell_prices, color='red', label='Sell Price')
+    lod.plot(ax, coingecko_timestamps, coingecko_prices, color='green', label='Coingecko Price')
+    # lod.plot(ax, coingecko_timestamps, coingecko_prices, color='green', label='Uniswap V3 Price')
     ax.legend()
-    def on_move(event):
-        # 判斷滑鼠事件發生在 ax 這個子圖上
-        if event.inaxes == ax:
-            # 取得滑鼠位置
-            x, y = event.xdata, event.ydata        
-            # 計算距離每條線的距離
-            sell_distance = abs(y - np.interp(x, sell_timestamps, sell_prices))
-            buy_distance = abs(y - np.interp(x, buy_timestamps, buy_prices))
-            # 取得最近的線
-            min_distance = min(sell_distance, buy_distance)
-            # 判斷最近的線是 buy 線還是 sell 線
-            if min_distance == sell_distance:
-                timestamps = sell_timestamps
-                prices = sell_prices
-                coingeckoPrices = sell_coingeckoPrices
-                line_name = 'Sell'
-            else:
-                timestamps = buy_timestamps
-                prices = buy_prices
-                coingeckoPrices = buy_coingeckoPrices
-                line_name = 'Buy'
-            # 取得最近的點的索引值和座標值
-            index = np.argmin(np.abs(timestamps - x))
-            timestamp_value = timestamps[index]
-            # 將 Timestamp 轉成人類看得懂的型式
-            time = datetime.fromtimestamp(timestamp_value).strftime('%Y-%m-%d %H:%M:%S')
-            # time = timestamp_value
-            price_value = prices[index]
-            coingeckoPrice_value = coingeckoPrices[index]
-            # 更新圖表標題顯示 Price 和 Timestamp 值
-            ax.set_title(f'{name} Time: {time}\n{line_name}: Price={price_value:.6f}, CoingeckoPrices={coingeckoPrice_value:.6f}')
-            # ax.set_title(f'{name} Time: {time}\n{line_name}: Price={price_value:.6f}, Uniswap3Prices={coingeckoPrice_value:.6f}')
-            fig.canvas.draw()
-    # 綁定事件處理器
-    fig.canvas.mpl_connect('motion_notify_event', on_move)
+    # 綁定事件處理器，更新圖表標題顯示 Price 和 Timestamp 值
+    connect_hover(fig, ax, [hover_series('Sell', sell_timestamps, sell_timestamps, sell_prices, sell_coingeckoPrices),
+                            hover_series('Buy', buy_timestamps, buy_timestamps, buy_prices, buy_coingeckoPrices)],
+                  lambda line_name, time, price_value, coingeckoPrice_value: f'{name} Time: {time}\n{line_name}: Price={price_value:.6f}, CoingeckoPrices={coingeckoPrice_value:.6f}')
+    # lambda line_name, time, price_value, coingeckoPrice_value: f'{name} Time: {time}\n{line_name}: Price={price_value:.6f}, Uniswap3Prices={coingeckoPrice_value:.6f}'
     # 將 Y 軸的顯示範圍為 prices 的 3 倍標準差內的最小／大值
-    sell_price_min, sell_price_max = filtered_prices_max(sell_prices)
-    buy_price_min, buy_price_max = filtered_prices_max(buy_prices)
-    coingeckoPrices_min, coingeckoPrices_max = filtered_prices_max(coingecko_prices)
+    sell_price_min, sell_price_max = filtered_prices_max(sell_prices, sell_timestamps)
+    buy_price_min, buy_price_max = filtered_prices_max(buy_prices, buy_timestamps)
+    coingeckoPrices_min, coingeckoPrices_max = filtered_prices_max(coingecko_prices, coingecko_timestamps, window=stats.REFERENCE_WINDOW)
     plt.ylim(min(sell_price_min, buy_price_min, coingeckoPrices_min), max(sell_price_max, buy_price_max, coingeckoPrices_max))
-    # 計算 1 天前的 timestamp
-    days_timestamp = int((datetime.now() - timedelta(days=0.5)).timestamp())
     # 將 X 軸顯示範圍為 sell 或 buy 的 timestamp 顯示範圍
-    # plt.xlim(min(min(sell_timestamps),min(buy_timestamps)), max(sell_timestamps))
-    plt.xlim(days_timestamp, max(sell_timestamps))
+    trade_timestamps = np.concatenate([sell_timestamps, buy_timestamps])
+    if len(trade_timestamps):
+        plt.xlim(trade_timestamps.min() if timestamp_start is None else timestamp_start, trade_timestamps.max())
     # 繪圖
     plt.show()
 
-# 繪製圖形，並透過滑鼠位置更新圖片上的 Price 資訊
-def plotMove3(name, coingecko_data, sell_coin_data, buy_coin_data):
-    # 限制圖表顯示範圍
-    # date_start = "2023/03/10 00:00:00+0800"
-    # date_end = "2023/03/17 00:00:00+0800"
-    # date_start = "2023/03/15 00:00:00+0800"
-    # date_end = "2023/03/18 00:00:00+0800"
-    date_start = "2023/03/20 00:00:00+0800"
-    date_end = "2023/03/23 00:00:00+0800"
+# 副程式：以 "2023/03/20 00:00:00+0800" 格式的日期字串取得 Unix 時間（秒）
+def date_to_timestamp(date):
+    return timerange.to_timestamp(date)
+
+# 副程式：將時間範圍（見 timerange.resolve()）轉為 (start, end)，相對的天數以 datas 中最新一筆資料為準
+def resolve_time_range(time_range, *datas):
+    last_timestamps = [data['Timestamp'].iloc[-1] for data in datas if len(data)]
+    return timerange.resolve(time_range, max(last_timestamps) if last_timestamps else None)
+
+# plotMove3 預設的顯示範圍
+plot_time_range = ("2023/03/20 00:00:00+0800", "2023/03/23 00:00:00+0800")
+
+# 副程式：建立 time_range 範圍內的買價／賣價與 CoinGecko 價格圖表，回傳 fig、ax 及滑鼠提示使用的資料
+# 只建立圖表，不顯示也不綁定事件，互動模式（plotMove3）及批次輸出圖檔（render.py）共用
+# sell_coin_data 或 buy_coin_data 為空的 DF 時，只繪製另一個方向
+def build_move_figure(name, coingecko_data, sell_coin_data, buy_coin_data, time_range=plot_time_range):
     # 設置時間刻度
     locator = mdates.HourLocator(interval=6)  # 每小时一个刻度
     formatter = mdates.DateFormatter('%m/%d %H:%M')  # 以小时和分钟的形式显示时间
     # locator = mdates.DayLocator(interval=1)  # 每天一个刻度
     # formatter = mdates.DateFormatter('%m/%d')  # 以月和日的形式显示时间    
-    # 将字符串转换为datetime对象，以及将datetime对象转换为Unix时间戳
-    timestamp_start = int(datetime.strptime(date_start, "%Y/%m/%d %H:%M:%S%z").timestamp())
-    timestamp_end = int(datetime.strptime(date_end, "%Y/%m/%d %H:%M:%S%z").timestamp())
-    # 以 date_start 及 date_end 篩選資料來源
-    coingecko_data = coingecko_data[(coingecko_data['Timestamp'] >= timestamp_start) & (coingecko_data['Timestamp'] <= timestamp_end)]
-    sell_coin_data = sell_coin_data[(sell_coin_data['Timestamp'] >= timestamp_start) & (sell_coin_data['Timestamp'] <= timestamp_end)]
-    buy_coin_data = buy_coin_data[(buy_coin_data['Timestamp'] >= timestamp_start) & (buy_coin_data['Timestamp'] <= timestamp_end)]
+    # 以二分搜尋取出 [timestamp_start, timestamp_end) 範圍內的資料（不複製資料）
+    timestamp_start, timestamp_end = resolve_time_range(time_range, sell_coin_data, buy_coin_data)
+    coingecko_data = timerange.view(coingecko_data, timestamp_start, timestamp_end)
+    sell_coin_data = timerange.view(sell_coin_data, timestamp_start, timestamp_end)
+    buy_coin_data = timerange.view(buy_coin_data, timestamp_start, timestamp_end)
     # 將資料轉成繪圖可以使用的格式
-    coingecko_timestamps, coingecko_prices = zip(*zip(coingecko_data['Timestamp'], coingecko_data['Price']))
-    sell_timestamps, sell_prices, sell_coingeckoPrices = zip(*zip(sell_coin_data['Timestamp'], sell_coin_data['Price'], sell_coin_data['CoingeckoPrice']))
-    buy_timestamps, buy_prices, buy_coingeckoPrices = zip(*zip(buy_coin_data['Timestamp'], buy_coin_data['Price'], buy_coin_data['CoingeckoPrice']))
-    # 重新格式化时间戳
-    coingecko_timestamps = [datetime.fromtimestamp(ts) for ts in coingecko_data['Timestamp']]
-    sell_timestamps = [datetime.fromtimestamp(ts) for ts in sell_coin_data['Timestamp']]
-    buy_timestamps = [datetime.fromtimestamp(ts) for ts in buy_coin_data['Timestamp']]
+    coingecko_timestamps, coingecko_prices = coingecko_data['Timestamp'].to_numpy(dtype='float64'), coingecko_data['Price'].to_numpy(dtype='float64')
+    sell_timestamps, sell_prices, sell_coingeckoPrices = (sell_coin_data[column].to_numpy(dtype='float64') for column in ('Timestamp', 'Price', 'CoingeckoPrice'))
+    buy_timestamps, buy_prices, buy_coingeckoPrices = (buy_coin_data[column].to_numpy(dtype='float64') for column in ('Timestamp', 'Price', 'CoingeckoPrice'))
+    # 重新格式化时间戳（轉為 matplotlib 的日期數值，以當地時間顯示）
+    coingecko_x = timestamps_to_datenum(coingecko_timestamps)
+    sell_x = timestamps_to_datenum(sell_timestamps)
+    buy_x = timestamps_to_datenum(buy_timestamps)
     # 建立繪圖物件
     fig, ax = plt.subplots()
     # 設定子圖之間的間距，可以通過調整 bottom 參數增加底部的空白
     fig.subplots_adjust(bottom=0.2)
     # 设置时间刻度
+    ax.xaxis_date()
     ax.xaxis.set_major_locator(locator)
     ax.xaxis.set_major_formatter(formatter)
     ax.set_title(name)
     ax.set_xlabel('Timestamp')
     ax.set_ylabel('Price (USD)')
-    ax.plot(buy_timestamps, buy_prices, color='blue', label='Buy Price')
-    ax.plot(sell_timestamps, sell_prices, color='red', label='Sell Price')
-    ax.plot(coingecko_timestamps, coingecko_prices, color='green', label='Coingecko Price')
-    # ax.plot(coingecko_timestamps, coingecko_prices, color='green', label='Uniswap V3 Price')
+    # 以降採樣後的資料繪製，縮放／平移時會依可見範圍重新取點，尖峰仍會保留
+    if len(buy_x):
+        lod.plot(ax, buy_x, buy_prices, color='blue', label='Buy Price')
+    if len(sell_x):
+        lod.plot(ax, sell_x, sell_prices, color='red', label='Sell Price')
+    lod.plot(ax, coingecko_x, coingecko_prices, color='green', label='Coingecko Price')
+    # lod.plot(ax, coingecko_x, coingecko_prices, color='green', label='Uniswap V3 Price')
     ax.legend()
-    def on_move(event):
-        # 判斷滑鼠事件發生在 ax 這個子圖上
-        if event.inaxes == ax:
-            # 取得滑鼠位置
-            x, y = event.xdata, event.ydata        
-            # 計算距離每條線的距離
-            sell_distance = abs(y - np.interp(x, sell_timestamps, sell_prices))
-            buy_distance = abs(y - np.interp(x, buy_timestamps, buy_prices))
-            # 取得最近的線
-            min_distance = min(sell_distance, buy_distance)
-            # 判斷最近的線是 buy 線還是 sell 線
-            if min_distance == sell_distance:
-                timestamps = sell_timestamps
-                prices = sell_prices
-                coingeckoPrices = sell_coingeckoPrices
-                line_name = 'Sell'
-            else:
-                timestamps = buy_timestamps
-                prices = buy_prices
-                coingeckoPrices = buy_coingeckoPrices
-                line_name = 'Buy'
-            # 取得最近的點的索引值和座標值
-            index = np.argmin(np.abs(timestamps - x))
-            timestamp_value = timestamps[index]
-            # 將 Timestamp 轉成人類看得懂的型式
-            time = datetime.fromtimestamp(timestamp_value).strftime('%Y-%m-%d %H:%M:%S')
-            # time = timestamp_value
-            price_value = prices[index]
-            coingeckoPrice_value = coingeckoPrices[index]
-            # 更新圖表標題顯示 Price 和 Timestamp 值
-            ax.set_title(f'{name} Time: {time}\n{line_name}: Price={price_value:.6f}, CoingeckoPrices={coingeckoPrice_value:.6f}')
-            # ax.set_title(f'{name} Time: {time}\n{line_name}: Price={price_value:.6f}, Uniswap3Prices={coingeckoPrice_value:.6f}')
-            fig.canvas.draw()
-    # 綁定事件處理器
-    fig.canvas.mpl_connect('motion_notify_event', on_move)
     # 將 Y 軸的顯示範圍為 prices 的 3 倍標準差內的最小／大值
-    sell_price_min, sell_price_max = filtered_prices_max(sell_prices)
-    buy_price_min, buy_price_max = filtered_prices_max(buy_prices)
-    coingeckoPrices_min, coingeckoPrices_max = filtered_prices_max(coingecko_prices)
-    plt.ylim(min(sell_price_min, buy_price_min, coingeckoPrices_min), max(sell_price_max, buy_price_max, coingeckoPrices_max))
-    # 將 X 軸顯示範圍為 sell 或 buy 的 timestamp 顯示範圍
-    plt.xlim(min(min(sell_timestamps),min(buy_timestamps)), max(sell_timestamps))
+    # CoinGecko 為每小時一筆，使用較長的 REFERENCE_WINDOW
+    bounds = [filtered_prices_max(prices, timestamps, window=window) for timestamps, prices, window in ((sell_timestamps, sell_prices, stats.DEFAULT_WINDOW), (buy_timestamps, buy_prices, stats.DEFAULT_WINDOW), (coingecko_timestamps, coingecko_prices, stats.REFERENCE_WINDOW)) if len(prices)]
+    if bounds:
+        ax.set_ylim(min(bound[0] for bound in bounds), max(bound[1] for bound in bounds))
+    # 將 X 軸顯示範圍為 sell 或 buy 的 timestamp 顯示範圍，兩者都沒有資料時為整個時間範圍
+    if len(sell_x) or len(buy_x):
+        trade_x = np.concatenate([sell_x, buy_x])
+        ax.set_xlim(trade_x.min(), (sell_x if len(sell_x) else buy_x).max())
+    elif timestamp_start is not None and timestamp_end is not None:
+        ax.set_xlim(timestamps_to_datenum([timestamp_start, timestamp_end]))
     # 调整时间标签角度
     # plt.xticks(rotation=45)
-    plt.xticks(rotation=45, ha='right', rotation_mode='anchor', va='top')
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right', rotation_mode='anchor', va='top')
+    # X 軸為日期，滑鼠位置為 matplotlib 的日期數值，因此以轉換後的值查詢
+    hover_lines = [hover_series('Sell', sell_x, sell_timestamps, sell_prices, sell_coingeckoPrices),
+                   hover_series('Buy', buy_x, buy_timestamps, buy_prices, buy_coingeckoPrices)]
+    return fig, ax, hover_lines
+
+# 繪製圖形，並透過滑鼠位置更新圖片上的 Price 資訊
+# time_range 為顯示範圍（見 timerange.resolve()），例如 ("2023/03/15 00:00:00+0800", "2023/03/18 00:00:00+0800") 或最近 3 天（3）
+def plotMove3(name, coingecko_data, sell_coin_data, buy_coin_data, time_range=plot_time_range):
+    fig, ax, hover_lines = build_move_figure(name, coingecko_data, sell_coin_data, buy_coin_data, time_range)
+    # 綁定事件處理器，更新圖表標題顯示 Price 和 Timestamp 值
+    connect_hover(fig, ax, hover_lines,
+                  lambda line_name, time, price_value, coingeckoPrice_value: f'{name} Time: {time}\n{line_name}: Price={price_value:.6f}, CoingeckoPrices={coingeckoPrice_value:.6f}')
+    # lambda line_name, time, price_value, coingeckoPrice_value: f'{name} Time: {time}\n{line_name}: Price={price_value:.6f}, Uniswap3Prices={coingeckoPrice_value:.6f}'
     # 繪圖
     plt.show()
 
 # 從 CoinGecko 取得最新的 90 天資料（取得 1 ~ 90 天的資料，資料精細度僅可到「小時」
 def get_coingecko_price(coin):
-    # 初始化 CoinGeckoAPI
-    cg = CoinGeckoAPI()
-    # 從 CoinGecko 取得最新資料
-    coin_usd_data = cg.get_coin_market_chart_by_id(id=coin, vs_currency='usd', days=90, interval='only daily can use', localization = False)
-    print('Note: Use CoinGecko API')
+    def fetch():
+        # 初始化 CoinGeckoAPI
+        cg = pycoingecko.CoinGeckoAPI()
+        # 從 CoinGecko 取得最新資料
+        print('Note: Use CoinGecko API')
+        with instrument.stage('http.coingecko'):
+            value = cg.get_coin_market_chart_by_id(id=coin, vs_currency='usd', days=90, interval='only daily can use', localization = False)
+        # pycoingecko 只回傳解析後的結果，以 JSON 長度估計收到的 bytes
+        instrument.count_http('coingecko', len(json.dumps(value)))
+        return value
+    coin_usd_data = cache.cached('coingecko', {'id': coin, 'vs_currency': 'usd', 'days': 90}, fetch)
     # 取得 prices 欄位
     coin_usd_price = coin_usd_data['prices']
     # 將數據轉換為 Pandas DataFrame
     return pd.DataFrame(coin_usd_price, columns=['Timestamp', 'Price'])
 
-# 定義函式：檢查是否存在 CSV 檔案
+# 定義函式：檢查是否存在資料（data/store 底下的資料集，或尚未轉換的 CSV 檔案）
 def check_csv_file(csv_file_path):
-    if os.path.exists(csv_file_path):
-        return True
-    else:
-        return False
+    return storage.exists(csv_file_path)
 
+# 取得最新資料的 Timestamp（秒），資料不存在時回傳 0
 def get_last_time(csv_file_path):
-    last_timestamp = 0
-    # 檢查是否存在 CSV 檔案，以及最新資料的時間和現在的時間之間的差距
-    if check_csv_file(csv_file_path):
-        coin_data_csv = pd.read_csv(csv_file_path, parse_dates=False)
-        last_timestamp = coin_data_csv['Timestamp'].iloc[-1]
-    return last_timestamp
+    return storage.last_timestamp(csv_file_path)
 
+# 讀取資料，只讀取 columns 指定的欄位，以及 [start, end) 時間範圍（秒）內的資料
+def load_data(csv_file_path, columns=None, start=None, end=None, filters=None):
+    with instrument.stage('load_data'):
+        return storage.load(csv_file_path, columns, start, end, filters)
+
+# 將資料直接寫入（第一次建立資料時使用）
+def write_data(csv_file_path, data):
+    with instrument.stage('write_data'):
+        storage.append(csv_file_path, data)
+
+# 將新資料加入，已存在的資料（以 Id 及 Timestamp 判斷）會被略過，因此同一秒的多筆交易不會遺失
+# 沒有 Id 的價格資料（CoinGecko）仍只加入比最後的 Timestamp 更新的資料
 def update_csv(csv_file_path, data):
     if not check_csv_file(csv_file_path):
         raise ValueError("CSV file must be exist")
-    # 從 CSV 中取得最後的 Timestamp
-    last_timestamp = get_last_time(csv_file_path)
-    # 只要從 CoinGecko 篩出 csv 裡沒有的資料就好
-    data_new = data[data['Timestamp'] > last_timestamp]
-    # 數據加入到原有檔案中
-    data_new.to_csv(csv_file_path, mode='a', header=False, index=False)
+    with instrument.stage('update_csv'):
+        # Timestamp 先統一轉為秒
+        data = storage.normalize(data)
+        if 'Id' not in data:
+            data = data[data['Timestamp'] > get_last_time(csv_file_path)]
+        # 數據以新的 partition 加入，不會改寫原有檔案
+        return storage.append(csv_file_path, data)
 
 # 定義函式：計算最新資料的時間和現在的時間之間的差距
 # def get_time_diff(eth_usd_data_csv):
@@ -399,43 +620,22 @@ def update_csv(csv_file_path, data):
 #     return time_diff
 
 # 取得 prices 的 n 倍標準差內的最小／大值
-def filtered_prices_max(prices):
-    n = 2
-    # 計算平均值和標準差
-    mean = np.mean(prices)
-    std = np.std(prices)
-    # 計算上限和下限
-    upper_bound = mean + n * std
-    lower_bound = mean - n * std
-    # 篩選出在 4 倍標準差內的數值
-    filtered_prices = [price for price in prices if lower_bound <= price <= upper_bound]
-    # filtered_prices = df[(df['Price'] >= lower_bound) & (df['Price'] <= upper_bound)]['Price']
-    # 取得最大值
-    return min(filtered_prices), max(filtered_prices)
+# 有 timestamps 時以時間視窗（window 秒）內的滾動平均值／標準差判斷，價格有趨勢時不會把趨勢本身當成異常
+def filtered_prices_max(prices, timestamps=None, n=stats.DEFAULT_N, window=stats.DEFAULT_WINDOW):
+    return stats.clip_range(prices, timestamps, n, window)
 
-# 取得 prices 的 n 倍標準差內的最小／大值
-def over_n_std_to_df(input):
-    data = input[['Timestamp', 'Price']].copy()
-    n = 2
-    # 計算平均值和標準差
-    mean = data['Price'].mean()
-    std = data['Price'].std()
-    # 計算上限和下限
-    upper_bound = mean + n * std
-    lower_bound = mean - n * std
-    # 假設你的 DataFrame 名稱為 df，欄位名稱分別為 Timestamp 和 Price
-    data['Timestamp'] = pd.to_datetime(data['Timestamp'], unit='s')  # 假設 Timestamp 單位為秒，使用 unit='s' 轉換
-    data = data[data['Price'] > upper_bound]
-    data_date = data[['Timestamp']].copy()
-    data_date['Timestamp'] = data_date['Timestamp'].dt.date  # 新增 Date 欄位，只保留日期部份
-    grouped = data_date.groupby('Timestamp').size()  # 將 DataFrame 按照日期分組，並計算每個日期的個數
-    # plt.bar(grouped.index, grouped.values)  # 顯示長條圖
-    # plt.xlabel('Date')
-    # plt.ylabel('Count')
-    # plt.xticks(rotation=45)
-    # plt.show()
+# 取出 Price 高於時間視窗內滾動平均值 n 倍標準差的資料，並繪製每天的筆數
+# time_range 為統計的時間範圍（見 timerange.resolve()），window 為滾動統計的時間視窗（秒）
+def over_n_std_to_df(input, n=stats.DEFAULT_N, window=stats.DEFAULT_WINDOW, time_range=None):
+    input = timerange.view(input, *resolve_time_range(time_range, input))
+    z = stats.rolling_zscores(input['Timestamp'], input['Price'], window)
+    over = z > n
+    # 與原本相同，回傳的 Timestamp 為 datetime（UTC）
+    data = input.loc[over, ['Timestamp', 'Price']].assign(ZScore=z[over])
+    data['Timestamp'] = pd.to_datetime(data['Timestamp'], unit='s')
+    days, counts = stats.daily_counts(input['Timestamp'], over)
     fig, ax = plt.subplots()
-    ax.bar(grouped.index, grouped.values)  # 顯示長條圖
+    ax.bar(days, counts)  # 顯示長條圖
 
     # 設定 x 軸標籤的日期格式
     date_fmt = mdates.DateFormatter('%m/%d')
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+
+import utils
+
+# 副程式：原本以 argsort 逐筆找最接近的 reference 點的寫法，作為 nearest 的比較基準
+def argsort_nearest(reference, data):
+    def find_nearest_price(timestamp):
+        nearest_timestamp = reference['Timestamp'].iloc[(reference['Timestamp'] - timestamp).abs().argsort()[0]]
+        return reference.loc[reference['Timestamp'] == nearest_timestamp, 'Price'].iloc[0]
+    return data['Timestamp'].apply(find_nearest_price).to_numpy()
+
+# 副程式：隨機的 reference（整數時間）及交易（時間帶 .3 的小數，不會剛好落在兩個 reference 點的正中間）
+def random_inputs(seed, n_reference=50, n_data=300):
+    rng = np.random.default_rng(seed)
+    ref_timestamps = np.cumsum(rng.integers(1, 7200, n_reference))
+    reference = pd.DataFrame({'Timestamp': ref_timestamps, 'Price': rng.normal(1800, 50, n_reference)})
+    timestamps = np.sort(rng.integers(ref_timestamps[0] - 10000, ref_timestamps[-1] + 10000, n_data)) + 0.3
+    return reference, pd.DataFrame({'Timestamp': timestamps})
+
+@pytest.mark.parametrize('seed', range(5))
+def test_nearest_matches_argsort(seed):
+    reference, data = random_inputs(seed)
+    result = utils.asof_join(reference, data, 'nearest')
+    np.testing.assert_array_equal(result['CoingeckoPrice'].to_numpy(), argsort_nearest(reference, data))
+    np.testing.assert_array_equal(result['TimeGap'].to_numpy(), data['Timestamp'].to_numpy() - result['CoingeckoPriceTimestamp'].to_numpy())
+
+@pytest.mark.parametrize('direction', ['backward', 'forward'])
+def test_backward_and_forward_match_merge_asof(direction):
+    reference, data = random_inputs(7)
+    result = utils.asof_join(reference, data, direction)
+    expected = pd.merge_asof(data, reference.astype('float64'), on='Timestamp', direction=direction)
+    np.testing.assert_array_equal(result['CoingeckoPrice'].to_numpy(), expected['Price'].to_numpy())
+
+def test_exact_timestamps_match_in_every_direction():
+    reference = pd.DataFrame({'Timestamp': [100, 200, 300], 'Price': [1.0, 2.0, 3.0]})
+    data = pd.DataFrame({'Timestamp': [100, 200, 300]})
+    for direction in ('nearest', 'backward', 'forward'):
+        result = utils.asof_join(reference, data, direction)
+        assert list(result['CoingeckoPrice']) == [1.0, 2.0, 3.0]
+        assert list(result['TimeGap']) == [0, 0, 0]
+
+@pytest.mark.parametrize('direction', ['nearest', 'backward', 'forward'])
+def test_interpolate(direction):
+    reference, data = random_inputs(3)
+    result = utils.asof_join(reference, data, direction, interpolate=True)['CoingeckoPrice'].to_numpy()
+    timestamps = data['Timestamp'].to_numpy()
+    expected = np.interp(timestamps, reference['Timestamp'], reference['Price'])
+    # 範圍外：nearest 沿用端點值，backward 在第一點之前、forward 在最後一點之後為 NaN
+    if direction == 'backward':
+        expected[timestamps < reference['Timestamp'].iloc[0]] = np.nan
+    elif direction == 'forward':
+        expected[timestamps > reference['Timestamp'].iloc[-1]] = np.nan
+    np.testing.assert_allclose(result, expected)
+
+def test_unsorted_reference_is_sorted_first():
+    reference, data = random_inputs(11)
+    shuffled = reference.sample(frac=1, random_state=0)
+    pd.testing.assert_frame_equal(utils.asof_join(shuffled, data), utils.asof_join(reference, data))
+
+def test_empty_reference_raises():
+    with pytest.raises(ValueError):
+        utils.asof_join(pd.DataFrame({'Timestamp': [], 'Price': []}), pd.DataFrame({'Timestamp': [1.0]}))
+
+def test_unknown_direction_raises():
+    reference, data = random_inputs(0)
+    with pytest.raises(ValueError):
+        utils.asof_join(reference, data, 'sideways')
@@ -0,0 +1,132 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+
+import cube
+import pairs
+import reference
+import storage
+
+START = 1700006400  # 2023-11-15 00:00:00 UTC
+HOURS = 72
+
+ADDRESS = {symbol: pairs.TOKENS[symbol]['addresses'][0] for symbol in pairs.TOKENS}
+
+# 副程式：每小時一筆的 CoinGecko 價格（剛好在格點上，參考價格序列即為這些資料）
+def reference_prices(rng, hours, base):
+    return pd.DataFrame({'Timestamp': START + np.arange(hours) * 3600, 'Price': base * np.exp(np.cumsum(rng.normal(0, 0.01, hours)))})
+
+# 副程式：隨機的 Tokenlon 交易，包含 ETH／WBTC 對 USDT／USDC 的買賣、沒有參考價格的 DAI→USDC 及不在註冊表中的 Token
+def random_trades(rng, n):
+    timestamps = np.sort(rng.integers(START, START + HOURS * 3600 + 4 * 3600, n))
+    # 避開兩個參考價格的正中間，最接近的參考價格才不會有兩個
+    timestamps[timestamps % 3600 == 1800] += 1
+    kinds = rng.choice(['eth-sell', 'eth-buy', 'wbtc-sell', 'wbtc-buy', 'dai', 'unknown'], n)
+    quantity = rng.uniform(0.1, 10, n)
+    quote = quantity * rng.uniform(1500, 2500, n)
+    rows = []
+    for i, kind in enumerate(kinds):
+        coin, decimals = ('WBTC', 8) if kind.startswith('wbtc') else ('ETH', 18)
+        coin_amount = str(int(quantity[i] * 10 ** decimals))
+        usd_amount = str(int(quote[i] * 10 ** 6))
+        if kind.endswith('sell'):
+            row = (ADDRESS['USDT'], usd_amount, ADDRESS[coin], coin_amount)
+        elif kind.endswith('buy'):
+            row = (ADDRESS[coin], coin_amount, ADDRESS['USDC'], usd_amount)
+        elif kind == 'dai':
+            row = (ADDRESS['USDC'], usd_amount, ADDRESS['DAI'], str(int(quote[i] * 10 ** 18)))
+        else:
+            row = (ADDRESS['USDT'], usd_amount, '0x' + '11' * 20, coin_amount)
+        rows.append(row)
+    maker_token, maker_amount, taker_token, taker_amount = zip(*rows)
+    return pd.DataFrame({
+        'Id': [f'0x{i:064x}-0x{i:064x}-0' for i in range(n)],
+        'BlockNumber': 17000000 + np.arange(n),
+        'Timestamp': timestamps,
+        'MakerToken': maker_token,
+        'MakerAmount': maker_amount,
+        'TakerToken': taker_token,
+        'TakerAmount': taker_amount,
+        'Method': rng.choice(['amm', 'pmmOrRfq', 'ByTrader'], n),
+    })
+
+# 副程式：直接由原始交易以 groupby 計算 cube.query() 應有的結果
+def expected_query(raw, references, base, quote, direction, by):
+    maker, taker = (quote, base) if direction == 'sell' else (base, quote)
+    rows = raw[raw['MakerToken'].isin(pairs.TOKENS[maker]['addresses']) & raw['TakerToken'].isin(pairs.TOKENS[taker]['addresses'])].copy()
+    if direction == 'sell':
+        rows['BaseVolume'], rows['QuoteVolume'], rows['Price'] = rows['TakerValue'], rows['MakerValue'], rows['MakerValue'] / rows['TakerValue']
+    else:
+        rows['BaseVolume'], rows['QuoteVolume'], rows['Price'] = rows['MakerValue'], rows['TakerValue'], rows['TakerValue'] / rows['MakerValue']
+    rows['Hour'] = rows['Timestamp'] // 3600 * 3600
+    # 最接近的參考價格（逐筆計算），相差超過 reference.TOLERANCE 時沒有偏離程度
+    ref = references[base]
+    deviations = []
+    for timestamp, price in zip(rows['Timestamp'], rows['Price']):
+        distance = np.abs(ref['Timestamp'].to_numpy() - timestamp)
+        nearest = int(np.argmin(distance))
+        deviations.append(price / ref['Price'].iloc[nearest] - 1 if distance[nearest] <= reference.TOLERANCE else np.nan)
+    rows['Deviation'] = deviations
+    if not by:
+        rows['Total'] = 'total'
+        by = ['Total']
+    grouped = rows.groupby(list(by), sort=True)
+    return pd.DataFrame({
+        'Count': grouped.size(),
+        'BaseVolume': grouped['BaseVolume'].sum(),
+        'QuoteVolume': grouped['QuoteVolume'].sum(),
+        'Low': grouped['Price'].min(),
+        'High': grouped['Price'].max(),
+        'DeviationCount': grouped['Deviation'].count(),
+        'VWAP': grouped['QuoteVolume'].sum() / grouped['BaseVolume'].sum(),
+        'DeviationMean': grouped['Deviation'].mean(),
+        'DeviationStd': grouped['Deviation'].std(),
+    }).reset_index()
+
+def assert_query_matches(csv_file_path, references, by):
+    raw = storage.load(csv_file_path)
+    for base, quote, direction in [('ETH', 'USDT', 'sell'), ('ETH', 'USDC', 'buy'), ('WBTC', 'USDT', 'sell'), ('WBTC', 'USDC', 'buy')]:
+        result = cube.query(csv_file_path, base, quote, direction, by=by)
+        expected = expected_query(raw, references, base, quote, direction, by)
+        result = result[expected.columns].astype({'Count': 'int64', 'DeviationCount': 'int64'})
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False, rtol=1e-9)
+
+@pytest.fixture
+def data_dir(tmp_path):
+    return str(tmp_path / 'data')
+
+@pytest.mark.parametrize('by', [('Method',), ('Method', 'Hour'), ()])
+def test_query_matches_groupby_over_raw_rows(data_dir, by):
+    rng = np.random.default_rng(0)
+    references = {'ETH': reference_prices(rng, HOURS, 1800), 'WBTC': reference_prices(rng, HOURS, 30000)}
+    storage.append(os.path.join(data_dir, 'eth_usd_price.csv'), references['ETH'])
+    storage.append(os.path.join(data_dir, 'btc_usd_price.csv'), references['WBTC'])
+    csv_file_path = os.path.join(data_dir, 'tokenlon_subgraph.csv')
+    trades = random_trades(rng, 2000)
+    # 分成幾次寫入，彙總表以 storage.append 的 listener 增量更新
+    for chunk in np.array_split(np.arange(len(trades)), 4):
+        storage.append(csv_file_path, trades.iloc[chunk])
+    assert_query_matches(csv_file_path, references, by)
+
+def test_deviations_catch_up_when_reference_is_late(data_dir):
+    rng = np.random.default_rng(1)
+    references = {'ETH': reference_prices(rng, HOURS, 1800), 'WBTC': reference_prices(rng, HOURS, 30000)}
+    eth_path, btc_path = os.path.join(data_dir, 'eth_usd_price.csv'), os.path.join(data_dir, 'btc_usd_price.csv')
+    # 參考價格只寫入前 2 天，交易則有 3 天
+    storage.append(eth_path, references['ETH'].iloc[:48])
+    storage.append(btc_path, references['WBTC'].iloc[:48])
+    csv_file_path = os.path.join(data_dir, 'tokenlon_subgraph.csv')
+    storage.append(csv_file_path, random_trades(rng, 1500))
+    late = {coin: prices.iloc[:48] for coin, prices in references.items()}
+    assert_query_matches(csv_file_path, late, ('Method', 'Hour'))
+    # 參考價格補上後，查詢時重新彙總尚未確定的小時，結果與完整的參考價格相同
+    storage.append(eth_path, references['ETH'].iloc[48:])
+    storage.append(btc_path, references['WBTC'].iloc[48:])
+    assert_query_matches(csv_file_path, references, ('Method', 'Hour'))
+    full = cube.load(csv_file_path)
+    pd.testing.assert_frame_equal(full.sort_values(cube.KEY_COLUMNS, ignore_index=True), cube.rebuild(csv_file_path).sort_values(cube.KEY_COLUMNS, ignore_index=True), rtol=1e-9)
@@ -0,0 +1,201 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+
+import cache
+import ethrpc
+
+# 以 http.server 模擬的 Ethereum 節點：只回應 eth_getTransactionByHash、eth_getBlockByNumber 及 eth_blockNumber
+# 每個 HTTP 請求的 batch 內容及收到的時間都記錄在 requests 中；statuses 中的 HTTP 狀態碼會依序回傳給接下來的請求
+# 所有交易都在 tx_block 區塊中，最新區塊高度為 block_number
+# fail_hashes 中的交易所在的 batch 一律回傳 500（用來模擬中途失敗）；回應的順序與請求相反，以確認依 id 對應結果
+
+def tx_hash(n):
+    return '0x' + f'{n:064x}'
+
+class JsonRpcStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), JsonRpcHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.statuses = []
+        self.fail_hashes = set()
+        self.transactions = {}
+        self.blocks = {}
+        self.tx_block = 1
+        self.block_number = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    # 副程式：各請求中的 method
+    def methods(self):
+        return [call['method'] for batch, received in self.requests for call in batch]
+
+    def result(self, method, params):
+        if method == 'eth_getTransactionByHash':
+            index = self.transactions.get(params[0])
+            return None if index is None else {'hash': params[0], 'blockNumber': hex(self.tx_block), 'transactionIndex': hex(index)}
+        if method == 'eth_getBlockByNumber':
+            block = self.blocks.get(int(params[0], 16))
+            return None if block is None else {'number': params[0], 'transactions': block}
+        if method == 'eth_blockNumber':
+            return hex(self.block_number)
+        raise ValueError(method)
+
+class JsonRpcHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        batch = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.requests.append((batch, time.monotonic()))
+            status = server.statuses.pop(0) if server.statuses else 200
+        if status == 200 and any(call['params'] and call['params'][0] in server.fail_hashes for call in batch):
+            status = 500
+        if status != 200:
+            self.reply(status, {'error': 'unavailable'})
+            return
+        responses = [{'jsonrpc': '2.0', 'id': call['id'], 'result': server.result(call['method'], call['params'])} for call in batch]
+        self.reply(200, responses[::-1])
+
+@pytest.fixture
+def node():
+    server = JsonRpcStub()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+# 每個測試使用各自的 HTTP 快取檔案
+@pytest.fixture(autouse=True)
+def http_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_PATH', str(tmp_path / 'http_cache.sqlite'))
+    monkeypatch.setattr(cache, '_connection', None)
+    yield
+    if cache._connection is not None:
+        cache._connection.close()
+    cache._connection = None
+
+def test_batches_are_split_and_results_keep_call_order(node):
+    node.transactions = {tx_hash(n): n for n in range(23)}
+    hashes = [tx_hash(n) for n in range(23)][::-1]
+    indices = ethrpc.fetch_transaction_indices(node.url, hashes, batch_size=5, concurrency=3, rate_limit=None)
+    assert indices == list(range(23))[::-1]
+    assert sorted(len(batch) for batch, received in node.requests) == [3, 5, 5, 5, 5]
+    assert sorted(call['params'][0] for batch, received in node.requests for call in batch) == sorted(hashes)
+
+def test_retries_with_backoff_on_429_and_5xx(node):
+    node.transactions = {tx_hash(1): 7}
+    node.statuses = [429, 503]
+    start = time.monotonic()
+    assert ethrpc.fetch_transaction_indices(node.url, [tx_hash(1)], rate_limit=None, backoff=0.1) == [7]
+    # 第一次重試前等待 backoff，第二次等待 2 * backoff
+    assert time.monotonic() - start >= 0.3
+    assert len(node.requests) == 3
+
+def test_gives_up_after_retries(node):
+    node.transactions = {tx_hash(1): 7}
+    node.statuses = [500] * 3
+    with pytest.raises(requests.HTTPError):
+        ethrpc.fetch_transaction_indices(node.url, [tx_hash(1)], rate_limit=None, retries=2, backoff=0.01)
+    assert len(node.requests) == 3
+
+def test_rate_limit_spaces_requests(node):
+    node.transactions = {tx_hash(n): n for n in range(6)}
+    rate = 20
+    ethrpc.fetch_transaction_indices(node.url, [tx_hash(n) for n in range(6)], batch_size=1, concurrency=4, rate_limit=rate)
+    received = sorted(received for batch, received in node.requests)
+    assert len(received) == 6
+    assert received[-1] - received[0] >= 5 / rate * 0.9
+
+def test_resume_only_requests_missing_calls(node):
+    node.transactions = {tx_hash(n): n for n in range(10)}
+    node.fail_hashes = {tx_hash(9)}
+    hashes = [tx_hash(n) for n in range(10)]
+    with pytest.raises(requests.HTTPError):
+        ethrpc.fetch_transaction_indices(node.url, hashes, batch_size=3, concurrency=1, rate_limit=None, retries=1, backoff=0.01)
+    # 失敗之前完成的 batch 已寫入快取，重新執行時只會送出尚未取得的交易
+    node.fail_hashes = set()
+    node.requests = []
+    assert ethrpc.fetch_transaction_indices(node.url, hashes, batch_size=3, rate_limit=None) == list(range(10))
+    assert sorted(call['params'][0] for batch, received in node.requests for call in batch) == [tx_hash(9)]
+
+def test_resolve_transaction_indices_by_block(node, tmp_path):
+    node.block_number = 200
+    node.blocks = {100: [tx_hash(n) for n in range(3)], 101: [tx_hash(n) for n in range(3, 6)]}
+    cache_path = str(tmp_path / 'tx_index_cache.csv')
+    tx_index_cache = {}
+    hashes = [tx_hash(4), tx_hash(1), tx_hash(5)]
+    # 大寫的 tx hash 也要能對應到區塊中的小寫 hash
+    indices = ethrpc.resolve_transaction_indices(node.url, [tx.upper().replace('0X', '0x') for tx in hashes], [101, 100, 101], tx_index_cache, cache_path, rate_limit=None)
+    assert indices == [1, 1, 2]
+    # 每個區塊只取一次，不需要逐筆查詢交易
+    assert sorted(node.methods()) == ['eth_blockNumber', 'eth_getBlockByNumber', 'eth_getBlockByNumber']
+    saved = pd.read_csv(cache_path)
+    assert dict(zip(saved['TxHash'], zip(saved['BlockNumber'], saved['Index']))) == {tx_hash(4): (101, 1), tx_hash(1): (100, 1), tx_hash(5): (101, 2)}
+    # 已在快取中的交易不會再送出請求
+    node.requests = []
+    assert ethrpc.resolve_transaction_indices(node.url, hashes, [101, 100, 101], ethrpc.load_tx_index_cache(cache_path), rate_limit=None) == [1, 1, 2]
+    assert node.requests == []
+
+def test_resolve_falls_back_to_transaction_lookup(node):
+    node.block_number = 200
+    node.blocks = {100: [tx_hash(0)]}
+    node.transactions = {tx_hash(7): 3}
+    assert ethrpc.resolve_transaction_indices(node.url, [tx_hash(0), tx_hash(7)], [100, 100], {}, rate_limit=None) == [0, 3]
+    assert node.methods().count('eth_getTransactionByHash') == 1
+
+def test_fetch_block_number_is_not_cached(node):
+    node.block_number = 120
+    assert ethrpc.fetch_block_number(node.url, rate_limit=None) == 120
+    node.block_number = 121
+    assert ethrpc.fetch_block_number(node.url, rate_limit=None) == 121
+
+# 副程式：快取中 call 的過期時間（None 為永久保存）
+def cached_expires(method, params):
+    return cache._connect().execute("SELECT expires FROM entries WHERE key = ?", (cache.make_key('ethrpc', [method, params]),)).fetchone()[0]
+
+def test_unconfirmed_blocks_are_not_cached_forever(node, tmp_path):
+    node.block_number = 110
+    node.blocks = {98: [tx_hash(0)], 99: [tx_hash(1)]}
+    cache_path = str(tmp_path / 'tx_index_cache.csv')
+    tx_index_cache = {}
+    assert ethrpc.resolve_transaction_indices(node.url, [tx_hash(0), tx_hash(1)], [98, 99], tx_index_cache, cache_path, rate_limit=None) == [0, 0]
+    # 區塊 98 已有 12 個確認，99 還沒有：只有 98 的結果永久快取及寫入 tx index 快取檔
+    assert cached_expires('eth_getBlockByNumber', [hex(98), False]) is None
+    assert cached_expires('eth_getBlockByNumber', [hex(99), False]) is not None
+    assert tx_index_cache == {tx_hash(0): 0}
+    assert list(pd.read_csv(cache_path)['TxHash']) == [tx_hash(0)]
+
+def test_transaction_lookup_is_immutable_only_when_confirmed(node):
+    node.transactions = {tx_hash(1): 7}
+    node.tx_block = 100
+    ethrpc.fetch_transaction_indices(node.url, [tx_hash(1)], rate_limit=None, head=111)
+    assert cached_expires('eth_getTransactionByHash', [tx_hash(1)]) is not None
+    cache.clear()
+    ethrpc.fetch_transaction_indices(node.url, [tx_hash(1)], rate_limit=None, head=112)
+    assert cached_expires('eth_getTransactionByHash', [tx_hash(1)]) is None
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+
+import ids
+
+# 副程式：隨機的 Tokenlon 交易 Id 字串（"0x<hash>-0x<tx hash>-<log index>"）
+def random_ids(rng, n):
+    hashes = rng.integers(0, 256, (n, 2, ids.HASH_BYTES), dtype='uint8')
+    log_indices = rng.integers(0, 1000, n)
+    return [f'0x{order.tobytes().hex()}-0x{tx.tobytes().hex()}-{log_index}' for (order, tx), log_index in zip(hashes, log_indices)]
+
+def test_parse_round_trip():
+    strings = random_ids(np.random.default_rng(0), 500) + [f'0x{"ab" * 32}-0x{"cd" * 32}-0', f'0x{"00" * 32}-0x{"ff" * 32}-123456']
+    trade_ids = ids.parse(strings)
+    assert len(trade_ids) == len(strings)
+    assert list(trade_ids.to_strings()) == strings
+    assert list(trade_ids.tx_hex()) == [value.split('-')[1] for value in strings]
+    assert list(trade_ids.log_indices) == [int(value.split('-')[2]) for value in strings]
+
+def test_parse_accepts_uppercase_hex():
+    value = f'0x{"AB" * 32}-0x{"Cd" * 32}-7'
+    assert ids.parse([value]).to_strings()[0] == value.lower()
+
+@pytest.mark.parametrize('value', [
+    f'0x{"ab" * 32}-0x{"cd" * 32}',
+    f'0x{"ab" * 32}-0x{"cd" * 32}-',
+    f'0x{"ab" * 32}-0x{"cd" * 32}-1a',
+    f'0x{"zz" * 32}-0x{"cd" * 32}-1',
+    f'1x{"ab" * 32}-0x{"cd" * 32}-1',
+    f'0x{"ab" * 32}_0x{"cd" * 32}-1',
+])
+def test_parse_rejects_invalid_ids(value):
+    with pytest.raises(ValueError):
+        ids.parse([value])
+
+def test_parse_empty():
+    assert len(ids.parse([])) == 0
+    assert len(ids.concat([])) == 0
+
+def test_take_and_concat():
+    strings = random_ids(np.random.default_rng(1), 20)
+    trade_ids = ids.parse(strings)
+    parts = [trade_ids.take(slice(0, 7)), trade_ids.take(slice(7, 20))]
+    assert list(ids.concat(parts).to_strings()) == strings
+    assert list(trade_ids.take(np.array([3, 1])).to_strings()) == [strings[3], strings[1]]
+
+def test_join_matches_merge_on_strings():
+    rng = np.random.default_rng(2)
+    strings = random_ids(rng, 400)
+    left_strings = [strings[i] for i in rng.integers(0, 400, 300)] + random_ids(rng, 50)
+    right_strings = strings[::2]
+    left_positions, right_positions = ids.join(ids.parse(left_strings), ids.parse(right_strings))
+    expected = pd.DataFrame({'Id': left_strings}).reset_index().merge(pd.DataFrame({'Id': right_strings}).reset_index(), on='Id', suffixes=('_left', '_right'))
+    np.testing.assert_array_equal(left_positions, expected['index_left'].to_numpy())
+    np.testing.assert_array_equal(right_positions, expected['index_right'].to_numpy())
+    missing = ids.missing(ids.parse(left_strings), ids.parse(right_strings))
+    assert sorted(set(missing) | set(left_positions)) == list(range(len(left_strings)))
+    assert all(left_strings[i] not in set(right_strings) for i in missing)
+
+def test_join_checks_full_id_on_key_collision():
+    trade_ids = ids.parse(random_ids(np.random.default_rng(3), 2))
+    # 兩個不同的 Id 使用相同的 key：以 key 找到後逐 byte 比較，不會配對錯誤
+    right_index = ids.HashIndex(trade_ids.take(slice(1, 2)).keys())
+    colliding = ids.HashIndex(trade_ids.take(slice(0, 1)).keys())
+    left_positions, right_positions = ids.join(trade_ids.take(slice(0, 1)), trade_ids.take(slice(1, 2)), colliding)
+    assert len(left_positions) == len(right_positions) == 0
+    assert len(ids.join(trade_ids.take(slice(1, 2)), trade_ids.take(slice(1, 2)), right_index)[0]) == 1
+
+def test_hash_index():
+    trade_ids = ids.parse(random_ids(np.random.default_rng(4), 10))
+    index = ids.HashIndex(trade_ids.keys())
+    assert len(index) == 10
+    assert index.get(trade_ids.keys()[4]) == 4
+    assert index.get(np.uint64(12345)) == -1
+    with pytest.raises(ValueError):
+        ids.HashIndex(np.concatenate([trade_ids.keys(), trade_ids.keys()[:1]]))
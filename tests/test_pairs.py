@@ -0,0 +1,50 @@
+import os
+import sys
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+
+import pairs
+
+# 副程式：以 Decimal 精確換算後再轉為 float，作為比較基準
+def exact(amount, decimals):
+    return float(Decimal(amount) / Decimal(10) ** decimals)
+
+@pytest.mark.parametrize('decimals, amounts', [
+    (6, ['0', '1', '999999', '1000000', '1234567890123', '5000000000000000']),
+    (8, ['1', '12345678', '2100000000000000', '99999999']),
+    (18, ['1', '999999999999999999', '1000000000000000000', '123456789012345678901234', '115792089237316195423570985008687907853269984665640564039457584007913129639935']),
+])
+def test_scale_amounts_matches_decimal(decimals, amounts):
+    result = pairs.scale_amounts(pd.Series(amounts), np.full(len(amounts), decimals))
+    np.testing.assert_allclose(result, [exact(amount, decimals) for amount in amounts], rtol=1e-15, atol=0)
+
+def test_scale_amounts_mixed_decimals_keep_order():
+    amounts = pd.Series(['1500000', '150000000', '1500000000000000000', '7'])
+    result = pairs.scale_amounts(amounts, np.array([6, 8, 18, -1]))
+    np.testing.assert_allclose(result[:3], [1.5, 1.5, 1.5])
+    # 不在註冊表中的 Token（-1）為 NaN
+    assert np.isnan(result[3])
+
+def test_scale_amounts_missing_values_are_nan():
+    amounts = pd.Series(['1000000', None, np.nan, '', 'abc', '2000000'], dtype=object)
+    result = pairs.scale_amounts(amounts, np.full(6, 6))
+    assert result[0] == 1.0 and result[5] == 2.0
+    assert np.isnan(result[1:5]).all()
+
+# USDT 6 位、ETH 18 位小數；MakerPrice 為每 1 個 TakerToken 可換得的 MakerToken
+def test_normalize_amounts_prices():
+    data = pd.DataFrame({
+        'MakerToken': [pairs.TOKENS['USDT']['addresses'][0], pairs.TOKENS['ETH']['addresses'][0]],
+        'MakerAmount': ['1800000000', '2000000000000000000'],
+        'TakerToken': [pairs.TOKENS['ETH']['addresses'][0], pairs.TOKENS['USDT']['addresses'][0]],
+        'TakerAmount': ['1000000000000000000', '3600000000'],
+    })
+    result = pairs.normalize_amounts(data)
+    np.testing.assert_allclose(result['MakerValue'], [1800, 2])
+    np.testing.assert_allclose(result['TakerValue'], [1, 3600])
+    np.testing.assert_allclose(result['MakerPrice'], [1800, 2 / 3600])
@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+
+import storage
+
+# 2023-11-14 22:13:20 UTC，接近日期的邊界，讓資料分在兩天
+DAY_END = 1700000000
+
+# 副程式：Tokenlon 格式的交易，Id 為 "0x<hash>-0x<tx hash>-<log index>"
+def trades(timestamps, first_id=0):
+    n = len(timestamps)
+    ids = [f'0x{i:064x}-0x{i:064x}-{i % 3}' for i in range(first_id, first_id + n)]
+    return pd.DataFrame({
+        'Id': ids,
+        'BlockNumber': np.arange(first_id, first_id + n) + 17000000,
+        'Timestamp': timestamps,
+        'MakerToken': '0xdac17f958d2ee523a2206206994597c13d831ec7',
+        'MakerAmount': '1800000000',
+        'TakerToken': '0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2',
+        'TakerAmount': '1000000000000000000',
+        'Method': 'amm',
+    })
+
+@pytest.fixture
+def csv_file_path(tmp_path):
+    return str(tmp_path / 'data' / 'tokenlon_subgraph.csv')
+
+def test_same_second_trades_are_kept(csv_file_path):
+    # 同一秒的多筆交易 Id 不同，不可以被當成重複資料
+    assert storage.append(csv_file_path, trades([DAY_END] * 5)) == 5
+    assert storage.append(csv_file_path, trades([DAY_END] * 3, first_id=5)) == 3
+    data = storage.load(csv_file_path)
+    assert len(data) == 8
+    assert data['Id'].is_unique
+
+def test_reappended_page_adds_no_rows(csv_file_path):
+    page = trades(DAY_END + np.arange(-3, 3) * 3600)
+    assert storage.append(csv_file_path, page) == 6
+    meta = storage.read_meta(csv_file_path)
+    # 同一頁再寫入一次（例如游標重新取得同一頁），以及與新資料重疊的一頁
+    assert storage.append(csv_file_path, page) == 0
+    assert storage.append(csv_file_path, pd.concat([page.iloc[3:], trades([DAY_END + 10 * 3600], first_id=6)])) == 1
+    assert len(storage.load(csv_file_path)) == 7
+    assert storage.read_meta(csv_file_path)['row_count'] == meta['row_count'] + 1
+
+def test_duplicates_within_one_append_are_dropped(csv_file_path):
+    page = trades([DAY_END, DAY_END + 1])
+    assert storage.append(csv_file_path, pd.concat([page, page])) == 2
+
+def test_meta_tracks_appends(csv_file_path):
+    storage.append(csv_file_path, trades([DAY_END - 100, DAY_END + 100]))
+    storage.append(csv_file_path, trades([DAY_END + 500], first_id=2))
+    meta = storage.read_meta(csv_file_path)
+    assert meta['row_count'] == 3
+    assert meta['last_timestamp'] == DAY_END + 500
+    assert meta['max_block'] == 17000002
+    assert storage.last_timestamp(csv_file_path) == DAY_END + 500
+    # 由資料重新計算的 metadata 與增量更新的結果相同
+    rebuilt = storage.rebuild_index(csv_file_path)
+    assert {key: rebuilt[key] for key in ('row_count', 'last_timestamp', 'max_block')} == {key: meta[key] for key in ('row_count', 'last_timestamp', 'max_block')}
+
+def test_interrupted_append_is_recovered(csv_file_path, monkeypatch):
+    storage.append(csv_file_path, trades([DAY_END - 100]))
+    write_json_atomic = storage.write_json_atomic
+
+    def interrupt_meta(path, value):
+        if path.endswith('_meta.json'):
+            raise KeyboardInterrupt
+        write_json_atomic(path, value)
+
+    monkeypatch.setattr(storage, 'write_json_atomic', interrupt_meta)
+    with pytest.raises(KeyboardInterrupt):
+        storage.append(csv_file_path, trades([DAY_END + 100, DAY_END + 200], first_id=1))
+    monkeypatch.setattr(storage, 'write_json_atomic', write_json_atomic)
+    # partition 已寫入、metadata 尚未更新：讀取 metadata 時補上
+    meta = storage.read_meta(csv_file_path)
+    assert (meta['row_count'], meta['last_timestamp']) == (3, DAY_END + 200)
+    assert not os.path.exists(storage.pending_path(csv_file_path))
+    # 再寫入同樣的資料不會重複
+    assert storage.append(csv_file_path, trades([DAY_END + 100, DAY_END + 200], first_id=1)) == 0
+    with open(storage.meta_path(csv_file_path)) as f:
+        assert json.load(f)['row_count'] == 3
+
+def test_load_time_range_and_columns(csv_file_path):
+    storage.append(csv_file_path, trades(DAY_END + np.arange(-5, 5) * 3600))
+    data = storage.load(csv_file_path, columns=['Id'], start=DAY_END - 3600, end=DAY_END + 3600)
+    assert list(data.columns) == ['Id']
+    assert len(data) == 2
+
+def test_compact_keeps_rows_and_dedupe(csv_file_path):
+    for i in range(3):
+        storage.append(csv_file_path, trades([DAY_END + 100 + i], first_id=i))
+    storage.compact(csv_file_path)
+    day_dir = os.path.join(storage.dataset_dir(csv_file_path), f'date={storage.day_of(DAY_END + 100)}')
+    assert len([name for name in os.listdir(day_dir) if name.endswith('.parquet')]) == 1
+    assert len(storage.load(csv_file_path)) == 3
+    assert storage.append(csv_file_path, trades([DAY_END + 100], first_id=0)) == 0